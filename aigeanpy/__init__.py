@@ -3,4 +3,5 @@ from aigeanpy.net import *
 from aigeanpy.clustering_numpy import *
 from aigeanpy.net import *
 from aigeanpy.satmap import *
-from aigeanpy.analysis import *
\ No newline at end of file
+from aigeanpy.analysis import *
+from aigeanpy.catalog import *
\ No newline at end of file
@@ -0,0 +1,326 @@
+import os
+import sqlite3
+from aigeanpy.satmap import read_meta
+
+# file types of the Aigean archive that are indexed
+CATALOG_EXTENSIONS = ('.hdf5', '.asdf', '.zip')
+
+
+class Catalog():
+
+    def __init__(self, database=':memory:') -> None:
+        """Local spatiotemporal catalog of Aigean scenes, stored in SQLite
+
+        Parameters
+        ----------
+        database : str, optional
+            File name of the SQLite database, by default ':memory:'
+
+        Examples
+        --------
+        >>> from catalog import Catalog
+        >>> with Catalog('aigean.sqlite') as catalog:
+        ...     catalog.refresh('.')
+        ...     scenes = catalog.query(bbox=(100, 200, 450, 500), start='2022-12-05', stop='2022-12-06', instrument='fand')
+        """
+        if not isinstance(database, str):
+            raise TypeError('The database is not str type')
+
+        self.connection = sqlite3.connect(database)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS scenes (
+                filename TEXT NOT NULL,
+                path TEXT UNIQUE,
+                instrument TEXT,
+                date TEXT,
+                time TEXT,
+                datetime TEXT,
+                resolution NUMERIC,
+                x0 NUMERIC, x1 NUMERIC, y0 NUMERIC, y1 NUMERIC,
+                size INTEGER,
+                mtime REAL
+            );
+            CREATE INDEX IF NOT EXISTS scenes_instrument_datetime ON scenes (instrument, datetime);
+            CREATE INDEX IF NOT EXISTS scenes_datetime ON scenes (datetime);
+            CREATE INDEX IF NOT EXISTS scenes_filename ON scenes (filename);
+            CREATE UNIQUE INDEX IF NOT EXISTS scenes_remote ON scenes (filename) WHERE path IS NULL;
+        ''')
+
+        # spatial index on the footprints, plain column filters when sqlite has no rtree module
+        try:
+            self.connection.execute('CREATE VIRTUAL TABLE IF NOT EXISTS scenes_rtree USING rtree(id, x0, x1, y0, y1)')
+            self.rtree = True
+        except sqlite3.OperationalError:
+            self.connection.execute('CREATE INDEX IF NOT EXISTS scenes_x0 ON scenes (x0, x1)')
+            self.rtree = False
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM scenes').fetchone()[0]
+
+    def close(self):
+        """Close the database"""
+        self.connection.close()
+
+    def refresh(self, directory):
+        """Index the Aigean files in a directory and its sub directories
+
+        Only files that are new, or whose size or modification time changed, are read again.
+        Scenes of files that were removed from the directory are dropped.
+
+        Parameters
+        ----------
+        directory : str
+            The directory to index
+
+        Returns
+        -------
+        dict
+            Returns the number of 'added', 'updated', 'unchanged' and 'removed' scenes, and the list of 'failed' files
+
+        Raises
+        ------
+        ValueError
+            The directory does not exist
+        """
+        if not isinstance(directory, str):
+            raise TypeError('The directory is not str type')
+        if not os.path.isdir(directory):
+            raise ValueError('The directory does not exist')
+
+        directory = os.path.abspath(directory)
+        report = {'added': 0, 'updated': 0, 'unchanged': 0, 'removed': 0, 'failed': []}
+
+        # size and mtime of the files already indexed in the directory
+        indexed = {}
+        prefix = directory_prefix(directory)
+        for row in self.connection.execute('SELECT path, size, mtime FROM scenes WHERE substr(path, 1, ?) = ?', (len(prefix), prefix)):
+            indexed[row['path']] = (row['size'], row['mtime'])
+
+        found = set()
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if not name.endswith(CATALOG_EXTENSIONS):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # the file was removed during the walk
+                    report['failed'].append(path)
+                    continue
+                found.add(path)
+
+                # skip files that have not changed
+                if indexed.get(path) == (stat.st_size, stat.st_mtime):
+                    report['unchanged'] += 1
+                    continue
+                try:
+                    meta = read_meta(path)
+                except Exception:
+                    report['failed'].append(path)
+                    continue
+
+                self.upsert(name, meta, path=path, size=stat.st_size, mtime=stat.st_mtime)
+                if path in indexed:
+                    report['updated'] += 1
+                else:
+                    report['added'] += 1
+
+        # drop the scenes of removed files
+        for path in set(indexed) - found:
+            self.remove(path)
+            report['removed'] += 1
+
+        self.connection.commit()
+        return report
+
+    def ingest_query(self, query_result):
+        """Add the scenes listed by query_isa, so remote listings can be searched offline
+
+        Scenes whose file is already indexed locally are not added again.
+
+        Parameters
+        ----------
+        query_result : list
+            The list of scene dictionaries returned by query_isa
+
+        Returns
+        -------
+        int
+            The number of scenes ingested
+        """
+        if not isinstance(query_result, list):
+            raise TypeError('The query result is not list type')
+
+        for scene in query_result:
+            self.upsert(scene['filename'], scene)
+        self.connection.commit()
+        return len(query_result)
+
+    def upsert(self, filename, meta, path=None, size=None, mtime=None):
+        """Insert or update a scene
+
+        Local scenes are keyed on their path, so files with the same name in different directories
+        are different scenes. Remote scenes, without a path, are keyed on their file name, and become
+        local when a file of that name is indexed.
+
+        Parameters
+        ----------
+        filename : str
+            The file name of the scene
+        meta : dict
+            Meta data of the scene, including 'instrument','resolution','time','date','xcoords','ycoords'
+        path : str, optional
+            The local path of the file, by default None for a remote scene
+        size : int, optional
+            The file size in bytes, by default None
+        mtime : float, optional
+            The modification time of the file, by default None
+        """
+        row = (filename, path, str(meta['instrument']).lower(), meta['date'], meta['time'],
+               meta['date'] + ' ' + meta['time'], float(meta['resolution']),
+               float(meta['xcoords'][0]), float(meta['xcoords'][1]), float(meta['ycoords'][0]), float(meta['ycoords'][1]),
+               size, mtime)
+
+        if path is not None:
+            found = self.connection.execute('SELECT rowid FROM scenes WHERE path = ?', (path,)).fetchone()
+            # a remote scene of the same name is now a local file
+            if found is None:
+                found = self.connection.execute('SELECT rowid FROM scenes WHERE filename = ? AND path IS NULL', (filename,)).fetchone()
+        else:
+            # the file is already indexed locally
+            if self.connection.execute('SELECT 1 FROM scenes WHERE filename = ? AND path IS NOT NULL', (filename,)).fetchone():
+                return
+            found = self.connection.execute('SELECT rowid FROM scenes WHERE filename = ? AND path IS NULL', (filename,)).fetchone()
+
+        if found is None:
+            rowid = self.connection.execute('''
+                INSERT INTO scenes (filename, path, instrument, date, time, datetime, resolution, x0, x1, y0, y1, size, mtime)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', row).lastrowid
+        else:
+            rowid = found[0]
+            self.connection.execute('''
+                UPDATE scenes SET filename = ?, path = ?, instrument = ?, date = ?, time = ?, datetime = ?, resolution = ?,
+                    x0 = ?, x1 = ?, y0 = ?, y1 = ?, size = ?, mtime = ?
+                WHERE rowid = ?
+            ''', row + (rowid,))
+
+        if self.rtree:
+            self.connection.execute('INSERT OR REPLACE INTO scenes_rtree VALUES (?, ?, ?, ?, ?)', (rowid,) + row[7:11])
+
+    def remove(self, path):
+        """Remove the scene of a local file
+
+        Parameters
+        ----------
+        path : str
+            The local path of the file
+        """
+        if self.rtree:
+            self.connection.execute('DELETE FROM scenes_rtree WHERE id IN (SELECT rowid FROM scenes WHERE path = ?)', (path,))
+        self.connection.execute('DELETE FROM scenes WHERE path = ?', (path,))
+
+    def query(self, bbox=None, start=None, stop=None, instrument=None):
+        """Find the scenes overlapping a bounding box, in a time range, from an instrument
+
+        Parameters
+        ----------
+        bbox : tuple, optional
+            Earth coordinates of the bounding box, (x0, x1, y0, y1), by default None (everywhere)
+        start : str, optional
+            Start of the time range, 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS', by default None
+        stop : str, optional
+            End of the time range, 'YYYY-MM-DD' (the whole day) or 'YYYY-MM-DD HH:MM:SS', by default None
+        instrument : str, optional
+            Instrument name, by default None (all instruments)
+
+        Returns
+        -------
+        list
+            Returns the scene dictionaries, in the query_isa layout plus 'path', 'size' and 'mtime', ordered by time
+        """
+        conditions = []
+        parameters = []
+        table = 'scenes'
+
+        if bbox is not None:
+            if len(bbox) != 4:
+                raise ValueError('The bbox is not (x0, x1, y0, y1)')
+            # the rtree stores rounded bounds, the exact overlap is checked on the scenes table
+            if self.rtree:
+                table = 'scenes JOIN scenes_rtree ON scenes.rowid = scenes_rtree.id'
+                conditions.append('scenes_rtree.x0 <= ? AND scenes_rtree.x1 >= ? AND scenes_rtree.y0 <= ? AND scenes_rtree.y1 >= ?')
+                parameters += [bbox[1], bbox[0], bbox[3], bbox[2]]
+            conditions.append('scenes.x0 < ? AND scenes.x1 > ? AND scenes.y0 < ? AND scenes.y1 > ?')
+            parameters += [bbox[1], bbox[0], bbox[3], bbox[2]]
+
+        if start is not None:
+            conditions.append('scenes.datetime >= ?')
+            parameters.append(start)
+
+        if stop is not None:
+            if len(stop) == 10:
+                stop = stop + ' 23:59:59'
+            conditions.append('scenes.datetime <= ?')
+            parameters.append(stop)
+
+        if instrument is not None:
+            conditions.append('scenes.instrument = ?')
+            parameters.append(instrument.lower())
+
+        sql = 'SELECT scenes.* FROM ' + table
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY scenes.datetime, scenes.filename'
+
+        return [row_to_scene(row) for row in self.connection.execute(sql, parameters)]
+
+
+def row_to_scene(row):
+    """Convert a row of the scenes table to a scene dictionary
+
+    Parameters
+    ----------
+    row : sqlite3.Row
+        A row of the scenes table
+
+    Returns
+    -------
+    dict
+        The scene dictionary, in the query_isa layout plus 'path', 'size' and 'mtime'
+    """
+    return {'date': row['date'],
+            'filename': row['filename'],
+            'instrument': row['instrument'],
+            'resolution': row['resolution'],
+            'time': row['time'],
+            'xcoords': [row['x0'], row['x1']],
+            'ycoords': [row['y0'], row['y1']],
+            'path': row['path'],
+            'size': row['size'],
+            'mtime': row['mtime']}
+
+
+def directory_prefix(directory):
+    """Prefix of every path inside a directory, compared case-sensitively unlike SQL LIKE
+
+    Parameters
+    ----------
+    directory : str
+        The directory
+
+    Returns
+    -------
+    str
+        The directory followed by the path separator
+    """
+    return os.path.join(directory, '')
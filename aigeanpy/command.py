@@ -1,7 +1,8 @@
 from argparse import ArgumentParser
-from aigeanpy.net import download_isa, query_isa
-from aigeanpy.satmap import get_satmap, satmap
+from aigeanpy.net import download_isa, query_isa, download_many
+from aigeanpy.satmap import get_satmap, satmap, mosaic_many, read_meta, load_many, mosaic_to_hdf5, RESAMPLE_METHODS
 import requests
+from functools import partial
 
 def aigean_today_process():
     """Command line function :Download today newest instrument data and generate png figure. If there has flag, save the png figure.
@@ -13,6 +14,9 @@ def aigean_today_process():
     
     --saveplot (or use -s)
         --saveplot is a flag (or use -s), once use it, png figure will be saved.
+
+    --cache-dir <directory> : str
+        Directory of the decoded image cache, by default the AIGEAN_CACHE_DIR environment variable
     
     Output
     -------
@@ -34,6 +38,7 @@ def aigean_today_process():
     parser = ArgumentParser(description="Download instrument data and generate png figure")
     parser.add_argument('--instrument', '-i', default= None, type = str,  help = 'One of the four instrument names (lir, manannan, fand or ecne)')
     parser.add_argument('--saveplot', '-s', action="store_true", default= False)
+    parser.add_argument('--cache-dir', default = None, type = str, help = 'Directory of the decoded image cache (AIGEAN_CACHE_DIR by default)')
     arguments = parser.parse_args()
     
     #Convert to a unified lowercase case
@@ -51,8 +56,8 @@ def aigean_today_process():
     #Get the newest filename
     filename = [x['filename'] for x in text]
     
-    #Download the newest data base on the newest filename
-    download_isa(filename[-1])
+    #Download the newest data base on the newest filename, unless it is already there
+    download_isa(filename[-1], skip_existing = True)
     
     #Check whether it is ence. If it is, output statements that it cannot be visualized
     if arguments.instrument == 'ecne':
@@ -60,7 +65,7 @@ def aigean_today_process():
         exit (0) 
     
     #Chieve the visualise and check if it needs to be saved
-    satmap_0 = get_satmap(filename[-1])
+    satmap_0 = get_satmap(filename[-1], cache_dir = arguments.cache_dir)
     satmap_0.visualise(save = arguments.saveplot)
     
 def aigean_metadata_process():
@@ -88,21 +93,22 @@ def aigean_metadata_process():
     #Initialize flag which will check if needs the filename added before data value
     flag_filename = 0
     
+    #Read the meta data of all the files in parallel
+    meta_list, errors = load_many(arguments.filename_list, loader=read_meta)
+    
     #If one file only or 2 more
     if len(arguments.filename_list) == 1:
-        satmap_nam = get_satmap(arguments.filename_list[0])
-        print_meta(satmap_nam.meta, flag_filename)
+        if errors:
+            raise errors[arguments.filename_list[0]]
+        print_meta(meta_list[0], flag_filename)
     else:
         flag_filename = 1
-        fail_file_list = []
         
         #Print part and fail_file_list created
-        for filenamess in arguments.filename_list:
-            try:
-                satmap_nam = get_satmap(filenamess)
-                print_meta(satmap_nam.meta, flag_filename, filenamess)
-            except:
-                fail_file_list.append(filenamess)
+        for filenamess, meta in zip(arguments.filename_list, meta_list):
+            if filenamess not in errors:
+                print_meta(meta, flag_filename, filenamess)
+        fail_file_list = [filenamess for filenamess in arguments.filename_list if filenamess in errors]
        
         # Print failed files name 
         if len(fail_file_list) != 0:
@@ -115,6 +121,25 @@ def aigean_mosaic_process():
     --------------------------
     --resolution <number> : int
         Enter a non-0 natural number as the resolution of the image
+
+    --method <name> : str
+        Resampling method, one of nearest, bilinear, area or max (bilinear by default)
+
+    --cache-dir <directory> : str
+        Directory of the decoded image cache, by default the AIGEAN_CACHE_DIR environment variable
+
+    --dtype <dtype> : str
+        dtype of the mosaic data, like float32, by default the dtype of the inputs
+
+    --workers <number> : int
+        Number of worker processes making the mosaic, 1 by default
+
+    --download-workers <number> : int
+        Number of files downloaded at the same time, 4 by default
+
+    --hdf5 <filename> : str
+        Stream the mosaic into a chunked hdf5 file instead of memory, for mosaics too large for memory.
+        The inputs are then opened lazily instead of read into memory, and --cache-dir is not used
     
     <filename_i> [<filename_j> ...]: str or str str ...
         Can input a file or list of them
@@ -137,40 +162,58 @@ def aigean_mosaic_process():
     #Read data from the command line
     parser = ArgumentParser(description="Achieve the visualisation of the resulting satmap and return the filename")
     parser.add_argument('--resolution', type = int)
+    parser.add_argument('--cache-dir', default = None, type = str, help = 'Directory of the decoded image cache (AIGEAN_CACHE_DIR by default)')
+    parser.add_argument('--workers', default = 1, type = int, help = 'Number of worker processes making the mosaic')
+    parser.add_argument('--download-workers', default = 4, type = int, help = 'Number of files downloaded at the same time')
+    parser.add_argument('--hdf5', default = None, type = str, help = 'Stream the mosaic into this hdf5 file instead of memory')
+    parser.add_argument('--dtype', default = None, type = str, help = 'dtype of the mosaic data, like float32 (the dtype of the inputs by default)')
+    parser.add_argument('--method', default = 'bilinear', choices = RESAMPLE_METHODS, help = 'How the images are resampled to the resolution')
     parser.add_argument('filename_list',  action = 'extend', nargs='+', type=str)
     arguments = parser.parse_args()
     
-    #Check if all filenames are right
-    for filenames in arguments.filename_list:
-        url_name = 'http://dokku-app.dokku.arc.ucl.ac.uk/isa-archive/download/?filename=' + filenames
+    #Check if the file number is >=2
+    if len(arguments.filename_list) < 2:
+        raise Exception('The file number is: ' + str(len(arguments.filename_list)) +' which is less than 2(min numbers)')
+    
+    #Download the data from web if it is missing, several files at the same time
+    #Files already there with the size of the archive only cost a HEAD request
+    report = download_many(arguments.filename_list, max_workers = arguments.download_workers, skip_existing = True)
+    for filenames in report:
+        error = report[filenames]['error']
         
         #Check if the internet had problem
-        try:
-            response = requests.get(url_name)
-        except:
+        if isinstance(error, requests.RequestException):
             raise TypeError('The internet is wrong, Need internet to check if the file with the filename is inside the web: http://dokku-app.dokku.arc.ucl.ac.uk')
         
         #Check the filename is valid
-        if response.status_code != 200:
+        if error is not None:
             raise TypeError('The filename ('+ filenames +') is wrong')
     
-    #Check if the file number is >=2
-    if len(arguments.filename_list) < 2:
-        raise Exception('The file number is: ' + str(len(arguments.filename_list)) +' which is less than 2(min numbers)')
-    
-    #Download the data from web if it is missing
-    for filename in arguments.filename_list:
-        download_isa(filename)
-    
-    satmap_a = get_satmap(arguments.filename_list[0])
-    
-    #Achieve the mosaic instruments
-    for fielname in arguments.filename_list[1:]:
-        satmap_b = get_satmap(fielname)
-        satmap_a = satmap_a.mosaic(satmap_b, resolution = arguments.resolution)
+    #Achieve the mosaic instruments in a single pass
+    #For a hdf5 mosaic the inputs are opened lazily, so only the pixels being mosaiced are in memory
+    if arguments.hdf5 is not None:
+        loader = partial(get_satmap, lazy = True)
+    else:
+        loader = partial(get_satmap, cache_dir = arguments.cache_dir)
+    satmap_list, errors = load_many(arguments.filename_list, loader = loader)
+    if errors:
+        for satmap_in in satmap_list:
+            if satmap_in is not None:
+                satmap_in.close()
+        raise next(iter(errors.values()))
+    resolution = arguments.resolution if arguments.resolution is not None else ''
+    if arguments.hdf5 is not None:
+        try:
+            satmap_a = mosaic_to_hdf5(satmap_list, arguments.hdf5, resolution = resolution, method = arguments.method, dtype = arguments.dtype)
+        finally:
+            for satmap_in in satmap_list:
+                satmap_in.close()
+    else:
+        satmap_a = mosaic_many(satmap_list, resolution = resolution, method = arguments.method, dtype = arguments.dtype, workers = arguments.workers)
     
     #Achieve visualise(save figure part) and print the filename
     satmap_a.visualise(save = True)
+    satmap_a.close()
     time = satmap_a.meta['time'].replace(':', '')
     date = satmap_a.meta['date'].replace('-', '')
     save_name = satmap_a.meta['observatory'].lower() +'_'+satmap_a.meta['instrument'].lower()[:3]+'_'+ date +'_'+time+'_'+ 'mosaic' +'.png'
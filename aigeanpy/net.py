@@ -1,6 +1,12 @@
+import os
+import copy
 import json
+import hashlib
+import time
+import threading
 import requests
-from pathlib import Path
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import datetime
 
 
@@ -8,18 +14,714 @@ import datetime
 Now = datetime.datetime.now()
 Time_now = Now.strftime("%Y-%m-%d")
 
+# Irish Space Agency archive
+ARCHIVE_URL = 'http://dokku-app.dokku.arc.ucl.ac.uk/isa-archive/'
+
+# size of the chunks downloads are streamed to disk in
+DOWNLOAD_CHUNK_SIZE = 2**20
+
+# client used by query_isa and download_isa, made on first use
+default_client = None
+
+# seconds query results are kept, past date ranges do not change any more
+QUERY_PAST_TTL = 30*24*3600
+QUERY_TODAY_TTL = 300
+
+# cache of query_isa results, None when disabled
+query_cache = None
+
+
+class ArchiveClient():
+
+    def __init__(self, base_url=ARCHIVE_URL, pool_connections=10, pool_maxsize=10, connect_timeout=10, read_timeout=60) -> None:
+        """Client of the Irish Space Agency archive, reusing its connections across requests
+
+        Parameters
+        ----------
+        base_url : str, optional
+            Base url of the archive, by default ARCHIVE_URL
+        pool_connections : int, optional
+            Number of hosts whose connections are kept, by default 10
+        pool_maxsize : int, optional
+            Max number of connections kept to a host, by default 10, at least the number of threads sharing the client
+        connect_timeout : float, optional
+            Seconds to wait for a connection, by default 10
+        read_timeout : float, optional
+            Seconds to wait between bytes of a response, by default 60
+
+        Examples
+        --------
+        >>> from net import ArchiveClient
+        >>> with ArchiveClient(pool_maxsize=32, read_timeout=120) as client:
+        ...     text = client.query('2022-12-05', '2022-12-05', 'Fand')
+        ...     client.download(text[0]['filename'])
+        """
+        if not isinstance(base_url, str):
+            raise TypeError('The base url is not str type')
+        if not isinstance(pool_connections, int) or not isinstance(pool_maxsize, int):
+            raise TypeError('The pool size is not int type')
+
+        self.base_url = base_url if base_url.endswith('/') else base_url + '/'
+        self.timeout = (connect_timeout, read_timeout)
+
+        # keep-alive connections pooled per host
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Close the pooled connections"""
+        self.session.close()
+
+    def get(self, url, **kwargs):
+        """GET a url of the archive through the pooled session
+
+        Parameters
+        ----------
+        url : str
+            The url, relative to the base url of the archive
+        **kwargs
+            Other arguments of requests.Session.get
+
+        Returns
+        -------
+        requests.Response
+            The response
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.get(self.base_url + url, **kwargs)
+
+    def query(self, start_date = None, stop_date = None, instrument= ''):
+        """Query Irish Space Agency data by given start time, end time and date, see query_isa
+
+        Parameters
+        ----------
+        start_date : str, optional
+            The date the query started, by default today, taken when the query is made
+        stop_date : str, optional
+            The date the query ended, by default today, taken when the query is made
+        instrument : str, optional
+            Query device, by default ''
+
+        Returns
+        -------
+        list
+            return query information
+        """
+        # today, taken now rather than when the module was imported
+        if start_date is None:
+            start_date = today_date()
+        if stop_date is None:
+            stop_date = today_date()
+
+        # Check that the start date is in the correct format
+        if not isinstance(start_date, str) or not judge_legal_date(start_date):
+            raise TypeError('Start date has a wrong date formats')
+
+        # Check that the stop date is in the correct format
+        if not isinstance(stop_date, str) or not judge_legal_date(stop_date):
+            raise TypeError('Stop date has a wrong date formats')    
+        
+        # Check the difference between the start date and end date
+        if time_sub(start_date, stop_date)>3:
+            raise ValueError('The difference between the end time and the start time is greater than 3 days')
+
+        # Check if end date is before start date
+        if time_sub(start_date, stop_date)<0:
+            raise ValueError('Start time is greater than end time')   
+
+        # The default input is all instrument
+        if instrument != '':
+            instrument = '&instrument='+instrument.lower()
+        else:
+            instrument = ''
+
+        # the dates are always sent, in the normalised form of query_key
+        start_date, stop_date = normalise_date(start_date), normalise_date(stop_date)
+        stop_date = '&stop_date='+ stop_date
+        start_date = '&start_date='+ start_date
+
+        # check network connection
+        try:
+            response = self.get('query/?'+ start_date  +stop_date+ instrument)
+        except requests.RequestException:
+            raise ConnectionError('No network connection')
+
+        text = response.text
+        text = json.loads(text)
+        return text
+
+    def head(self, filename):
+        """Ask the archive about a file without downloading it
+
+        Parameters
+        ----------
+        filename : str
+            The name of the file
+
+        Returns
+        -------
+        int
+            Returns the size of the file in bytes, None if the archive does not tell it
+
+        Raises
+        ------
+        ValueError
+            File not exists on the network
+        """
+        response = self.session.head(self.base_url + 'download/?filename=' + filename, timeout=self.timeout, allow_redirects=True)
+
+        # The archive does not answer HEAD requests, the size is unknown
+        if response.status_code in (405, 501):
+            return None
+        if response.status_code >= 500:
+            response.raise_for_status()
+        if response.status_code != 200:
+            raise ValueError('File not exists on the network')
+
+        size = response.headers.get('Content-Length')
+        return int(size) if size is not None else None
+
+    def is_current(self, filename, save_dir='', checksum=None):
+        """Check whether a downloaded file is the same as the one of the archive
+
+        The file is current when its size matches the size the archive tells with a HEAD request,
+        and its sha256 matches the checksum if one is given.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the file
+        save_dir : str, optional
+            file save path, by default './'
+        checksum : str, optional
+            Expected sha256 of the file in hex, by default None
+
+        Returns
+        -------
+        bool
+            Returns True if the file does not need to be downloaded
+        """
+        path = save_dir + filename
+        if not os.path.isfile(path):
+            return False
+        if checksum is not None and file_checksum(path) != checksum.lower():
+            return False
+
+        # without a size to compare to, only a checksum can tell the file is current
+        size = self.head(filename)
+        if size is None:
+            return checksum is not None
+        return size == os.path.getsize(path)
+
+    def download(self, filename, save_dir='', chunk_size=DOWNLOAD_CHUNK_SIZE, skip_existing=False, checksum=None):
+        """Download the file according to the file name and save path and save it to the specified location, see download_isa
+
+        The file is streamed in chunks to filename + '.part', which is renamed to the file name once complete,
+        so the file is never left half written. A '.part' file left by an interrupted download is resumed
+        with a Range request when the archive supports it. The ETag or Last-Modified of the file is kept in
+        filename + '.part.validator' and sent as If-Range, so a file changed on the archive is downloaded
+        again from the start instead of being appended to the old part.
+
+        Parameters
+        ----------
+        filename : str
+            The name of the file to be downloaded
+        save_dir : str, optional
+            file save path, by default './'
+        chunk_size : int, optional
+            Bytes read from the network at a time, by default DOWNLOAD_CHUNK_SIZE
+        skip_existing : bool, optional
+            Skip the download when the file is already there and current (see is_current), by default False
+        checksum : str, optional
+            Expected sha256 of the file in hex, checked before the file is put in place, by default None
+
+        Returns
+        -------
+        bool
+            Returns False if the download was skipped, True otherwise
+        """
+        # Determine whether the input file type meets the requirements
+        if 'zip' not in filename and 'asdf' not in filename and 'hdf5' not in filename and 'csv' not in filename:
+            raise TypeError('File is non Aigean file')
+
+        # Check whether the input save path is str type
+        if not isinstance(save_dir, str):
+            raise TypeError('Save path is not of type str')  
+
+        path = save_dir + filename
+        part = path + '.part'
+
+        # The file is already there
+        if skip_existing and self.is_current(filename, save_dir, checksum):
+            return False
+
+        # Resume an interrupted download from where it stopped, only if the version of the file is known
+        validator_path = part + '.validator'
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        validator = read_validator(validator_path) if offset else None
+        headers = {'Range': 'bytes=' + str(offset) + '-', 'If-Range': validator} if validator else {}
+
+        # Get files online
+        with self.get('download/?filename=' + filename, headers=headers, stream=True) as response:
+
+            # The part file is already complete, or the archive lost track of it, start again
+            if response.status_code == 416 and validator:
+                discard_part(part)
+                return self.download(filename, save_dir, chunk_size, checksum=checksum)
+
+            # The archive failed to answer, which is worth trying again
+            if response.status_code >= 500:
+                response.raise_for_status()
+
+            # Check if this file exists on the network
+            if response.status_code not in (200, 206):
+                raise ValueError('File not exists on the network')
+
+            if response.status_code == 206:
+                # the part must carry on exactly where the part file stops
+                start, total = parse_content_range(response.headers.get('Content-Range'))
+                if not validator or start != offset:
+                    response.close()
+                    discard_part(part)
+                    return self.download(filename, save_dir, chunk_size, checksum=checksum)
+                mode = 'ab'
+            else:
+                # a 200 answer holds the whole file, a new version if the If-Range did not match
+                total = None if 'Content-Encoding' in response.headers else response.headers.get('Content-Length')
+                total = int(total) if total is not None else None
+                mode = 'wb'
+                validator = response_validator(response)
+                if validator is not None:
+                    with open(validator_path, 'w') as file:
+                        file.write(validator)
+                elif os.path.exists(validator_path):
+                    os.remove(validator_path)
+
+            with open(part, mode) as file:
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    file.write(chunk)
+
+        # A file whose size is not the size on the archive is not put in place
+        if total is not None and os.path.getsize(part) != total:
+            discard_part(part)
+            raise requests.ConnectionError('The downloaded file does not have the size of the file on the archive')
+
+        # A corrupted file is not put in place
+        if checksum is not None and file_checksum(part) != checksum.lower():
+            discard_part(part)
+            raise ValueError('The checksum of the file does not match')
+
+        # save document    
+        os.replace(part, path)
+        if os.path.exists(part + '.validator'):
+            os.remove(part + '.validator')
+        return True
+
+
+def response_validator(response):
+    """Validator of the version of a downloaded file, for If-Range
+
+    Parameters
+    ----------
+    response : requests.Response
+        The response holding the file
+
+    Returns
+    -------
+    str
+        Returns the strong ETag, or else the Last-Modified date, None if the archive sends neither
+    """
+    etag = response.headers.get('ETag')
+    # weak ETags can not be used in If-Range
+    if etag is not None and not etag.startswith('W/'):
+        return etag
+    return response.headers.get('Last-Modified')
+
+
+def read_validator(validator_path):
+    """Read the validator kept next to a part file
+
+    Parameters
+    ----------
+    validator_path : str
+        The path of the validator file
+
+    Returns
+    -------
+    str
+        Returns the validator, None if there is none
+    """
+    try:
+        with open(validator_path) as file:
+            return file.read().strip() or None
+    except OSError:
+        return None
+
+
+def parse_content_range(content_range):
+    """Parse the Content-Range header of a 206 answer
+
+    Parameters
+    ----------
+    content_range : str
+        The header, like 'bytes 300-999/1000'
+
+    Returns
+    -------
+    int, int
+        Returns the first byte sent and the size of the whole file (None if unknown),
+        or None, None for a header that can not be parsed
+    """
+    try:
+        unit, ranges = content_range.split(' ', 1)
+        byte_range, total = ranges.split('/')
+        if unit != 'bytes':
+            return None, None
+        return int(byte_range.split('-')[0]), None if total == '*' else int(total)
+    except (AttributeError, ValueError):
+        return None, None
+
+
+def discard_part(part):
+    """Remove a part file and its validator
+
+    Parameters
+    ----------
+    part : str
+        The path of the part file
+    """
+    for name in (part, part + '.validator'):
+        if os.path.exists(name):
+            os.remove(name)
+
+
+def get_client():
+    """The client query_isa and download_isa go through, made with the default settings on first use
+
+    Returns
+    -------
+    class
+        Returns the ArchiveClient
+    """
+    global default_client
+    if default_client is None:
+        default_client = ArchiveClient()
+    return default_client
+
+
+def set_client(client):
+    """Set the client query_isa and download_isa go through, like one with larger pools or longer timeouts
+
+    Parameters
+    ----------
+    client : class
+        The ArchiveClient, or None to go back to a default client
+
+    Returns
+    -------
+    class
+        Returns the previous client
+    """
+    global default_client
+    if client is not None and not isinstance(client, ArchiveClient):
+        raise TypeError('The client is not ArchiveClient type')
+    previous = default_client
+    default_client = client
+    return previous
+
+
+class QueryCache():
+
+    def __init__(self, cache_dir=None, past_ttl=QUERY_PAST_TTL, today_ttl=QUERY_TODAY_TTL) -> None:
+        """Cache of query results in memory and optionally on disk, expiring after a time to live
+
+        Ranges ending before today are kept for past_ttl, ranges including today for today_ttl,
+        as new files still arrive in the archive.
+
+        Parameters
+        ----------
+        cache_dir : str, optional
+            Directory the results are also kept in, shared between processes, by default None (memory only)
+        past_ttl : float, optional
+            Seconds the results of a range ending before today are kept, by default QUERY_PAST_TTL
+        today_ttl : float, optional
+            Seconds the results of a range including today are kept, by default QUERY_TODAY_TTL
+        """
+        if cache_dir is not None and not isinstance(cache_dir, str):
+            raise TypeError('The cache directory is not str type')
+        if past_ttl < 0 or today_ttl < 0:
+            raise ValueError('The time to live is negative')
+
+        self.cache_dir = cache_dir
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+        self.past_ttl = past_ttl
+        self.today_ttl = today_ttl
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def ttl(self, key):
+        """Seconds the results of a query are kept
+
+        Parameters
+        ----------
+        key : tuple
+            The query key, see query_key
+
+        Returns
+        -------
+        float
+            Returns past_ttl if the range ends before today, today_ttl otherwise
+        """
+        if key[1] < today_date():
+            return self.past_ttl
+        return self.today_ttl
+
+    def path(self, key):
+        """File of the results of a query in the cache directory
+
+        The file is named after a hash of the key, so no part of the query reaches the file name.
+
+        Parameters
+        ----------
+        key : tuple
+            The query key, see query_key
+
+        Returns
+        -------
+        str
+            Returns the path of the json file
+        """
+        digest = hashlib.sha256(json.dumps(list(key)).encode()).hexdigest()
+        return os.path.join(self.cache_dir, 'query_' + digest + '.json')
+
+    def get(self, key):
+        """Look up the results of a query that have not expired, in memory then on disk
+
+        Parameters
+        ----------
+        key : tuple
+            The query key, see query_key
+
+        Returns
+        -------
+        list
+            A copy of the cached results, or None if they are not cached or expired
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if (entry is None or entry[0] <= time.time()) and self.cache_dir is not None:
+                entry = self.read(key)
+                if entry is not None:
+                    self.entries[key] = entry
+            if entry is None or entry[0] <= time.time():
+                self.misses += 1
+                return None
+            self.hits += 1
+            return copy.deepcopy(entry[1])
+
+    def put(self, key, text):
+        """Cache the results of a query, with the time to live of its range
+
+        Parameters
+        ----------
+        key : tuple
+            The query key, see query_key
+        text : list
+            The query results
+        """
+        entry = (time.time() + self.ttl(key), copy.deepcopy(text))
+        with self.lock:
+            self.entries[key] = entry
+            if self.cache_dir is not None:
+                # written aside then renamed, so other processes never read half a file
+                path = self.path(key)
+                temp = path + '.' + str(os.getpid()) + '.' + str(threading.get_ident()) + '.tmp'
+                with open(temp, 'w') as file:
+                    json.dump({'key': list(key), 'expires': entry[0], 'text': entry[1]}, file)
+                os.replace(temp, path)
+
+    def read(self, key):
+        """Read the results of a query from the cache directory
+
+        Parameters
+        ----------
+        key : tuple
+            The query key, see query_key
+
+        Returns
+        -------
+        tuple
+            Returns the expiry time and the results, or None if the file is missing or broken
+        """
+        try:
+            with open(self.path(key)) as file:
+                entry = json.load(file)
+            if tuple(entry['key']) != key:
+                return None
+            return (entry['expires'], entry['text'])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def clear(self):
+        """Drop all the cached results, in memory and on disk, and reset the counters"""
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+            if self.cache_dir is not None:
+                for name in os.listdir(self.cache_dir):
+                    if name.startswith('query_') and name.endswith('.json'):
+                        os.remove(os.path.join(self.cache_dir, name))
+
+    def stats(self):
+        """Counters of the cache
+
+        Returns
+        -------
+        dict
+            Returns the 'hits', 'misses' and number of 'entries' in memory
+        """
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries)}
+
+
+def set_query_cache(enable=True, cache_dir=None, past_ttl=QUERY_PAST_TTL, today_ttl=QUERY_TODAY_TTL):
+    """Enable or disable the cache of query_isa results
+
+    Parameters
+    ----------
+    enable : bool, optional
+        Whether query results are cached, by default True
+    cache_dir : str, optional
+        Directory the results are also kept in, by default None (memory only)
+    past_ttl : float, optional
+        Seconds the results of a range ending before today are kept, by default QUERY_PAST_TTL
+    today_ttl : float, optional
+        Seconds the results of a range including today are kept, by default QUERY_TODAY_TTL
+
+    Returns
+    -------
+    class
+        Returns the new QueryCache, or None when the cache is disabled
+
+    Examples
+    --------
+    >>> from net import set_query_cache, query_isa
+    >>> cache = set_query_cache(cache_dir='.aigean_queries')
+    >>> text = query_isa('2022-12-05', '2022-12-05', 'Fand')
+    >>> text = query_isa('2022-12-05', '2022-12-05', 'Fand')
+    >>> cache.stats()['hits']
+    1
+    """
+    global query_cache
+    query_cache = QueryCache(cache_dir, past_ttl, today_ttl) if enable else None
+    return query_cache
+
+
+def query_key(start_date, stop_date, instrument):
+    """Normalised key of a query, so that '2023-1-13' and '2023-01-13', or 'Fand' and 'fand', share results
+
+    Parameters
+    ----------
+    start_date : str
+        The date the query started
+    stop_date : str
+        The date the query ended
+    instrument : str
+        Query device, '' for all
 
-def query_isa(start_date = str(Time_now), stop_date = str(Time_now), instrument= ''):
+    Returns
+    -------
+    tuple
+        Returns (start_date, stop_date, instrument), or None for a query that is not valid
+    """
+    if not isinstance(start_date, str) or not isinstance(stop_date, str) or not isinstance(instrument, str):
+        return None
+    if not judge_legal_date(start_date) or not judge_legal_date(stop_date):
+        return None
+    return (normalise_date(start_date), normalise_date(stop_date), instrument.lower())
+
+
+def normalise_date(date):
+    """Write a date as 'YYYY-MM-DD', so '2023-1-13' becomes '2023-01-13'
+
+    Parameters
+    ----------
+    date : str
+        A legal date
+
+    Returns
+    -------
+    str
+        Returns the normalised date
+    """
+    return datetime.datetime.strptime(date, '%Y-%m-%d').strftime('%Y-%m-%d')
+
+
+def today_date():
+    """Today's date, taken on every call so long running processes do not keep the date they started on
+
+    Returns
+    -------
+    str
+        Returns today as 'YYYY-MM-DD'
+    """
+    return datetime.date.today().strftime('%Y-%m-%d')
+
+
+def file_checksum(path, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """sha256 of a file, read in chunks
+
+    Parameters
+    ----------
+    path : str
+        The path of the file
+    chunk_size : int, optional
+        Bytes read at a time, by default DOWNLOAD_CHUNK_SIZE
+
+    Returns
+    -------
+    str
+        Returns the sha256 in hex
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def query_isa(start_date = None, stop_date = None, instrument= '', use_cache=True):
     """Query Irish Space Agency data by given start time, end time and date
 
+    The request goes through the shared ArchiveClient, reusing its connections (see set_client).
+    When the query cache is enabled (see set_query_cache), results that have not expired are not asked again.
+
     Parameters
     ----------
     start_date : str, optional
-        The date the query started, by default str(Time_now)
+        The date the query started, by default today, taken when the query is made
     stop_date : str, optional
-        The date the query ended, by default str(Time_now)
+        The date the query ended, by default today, taken when the query is made
     instrument : str, optional
         Query device, by default ''
+    use_cache : bool, optional
+        Whether cached results may be used, by default True. False always asks the archive,
+        and caches the fresh results.
 
     Returns
     -------
@@ -47,50 +749,26 @@ def query_isa(start_date = str(Time_now), stop_date = str(Time_now), instrument=
     [{'date': '2022-12-05', 'filename': 'aigean_fan_20221205_191610.zip', 'instrument': 'fand', 'resolution': 5, 'time': '19:16:10', 'xcoords': [75.0, 300.0], 'ycoords': [450.0, 500.0]}, {'date': '2022-12-05', 'filename': 'aigean_fan_20221205_192210.zip', 'instrument': 'fand', 'resolution': 5, 'time': '19:22:10', 'xcoords': [300.0, 525.0], 'ycoords': [50.0, 100.0]}, {'date': '2022-12-05', 'filename': 'aigean_fan_20221205_192810.zip', 'instrument': 'fand', 'resolution': 5, 'time': '19:28:10', 'xcoords': [450.0, 675.0], 'ycoords': [100.0, 150.0]}, {'date': '2022-12-05', 'filename': 'aigean_fan_20221205_193510.zip', 'instrument': 'fand', 'resolution': 5, 'time': '19:35:10', 'xcoords': [600.0, 825.0], 'ycoords': [350.0, 400.0]}, {'date': '2022-12-05', 'filename': 'aigean_fan_20221205_194010.zip', 'instrument': 'fand', 'resolution': 5, 'time': '19:40:10', 'xcoords': [675.0, 900.0], 'ycoords': [100.0, 150.0]}, {'date': '2022-12-05', 'filename': 'aigean_fan_20221205_194710.zip', 'instrument': 'fand', 'resolution': 5, 'time': '19:47:10', 'xcoords': [900.0, 1125.0], 'ycoords': [400.0, 450.0]}, {'date': '2022-12-05', 'filename': 'aigean_fan_20221205_195310.zip', 'instrument': 'fand', 'resolution': 5, 'time': '19:53:10', 'xcoords': [975.0, 1200.0], 'ycoords': [400.0, 450.0]}, {'date': '2022-12-05', 'filename': 'aigean_fan_20221205_195810.zip', 'instrument': 'fand', 'resolution': 5, 'time': '19:58:10', 'xcoords': [1050.0, 1275.0], 'ycoords': [250.0, 300.0]}, {'date': '2022-12-05', 'filename': 'aigean_fan_20221205_200510.zip', 'instrument': 'fand', 'resolution': 5, 'time': '20:05:10', 'xcoords': [1125.0, 1350.0], 'ycoords': [150.0, 200.0]}]
 
     """    
-    # Check that the start date is in the correct format
-    if not isinstance(start_date, str) or not judge_legal_date(start_date):
-        raise TypeError('Start date has a wrong date formats')
-
-    # Check that the stop date is in the correct format
-    if not isinstance(stop_date, str) or not judge_legal_date(stop_date):
-        raise TypeError('Stop date has a wrong date formats')    
-    
-    # Check the difference between the start date and end date
-    if time_sub(start_date, stop_date)>3:
-        raise ValueError('The difference between the end time and the start time is greater than 3 days')
-
-    # Check if end date is before start date
-    if time_sub(start_date, stop_date)<0:
-        raise ValueError('Start time is greater than end time')   
-
-    # The default input is all instrument
-    if instrument != '':
-        instrument = '&instrument='+instrument.lower()
-    else:
-        instrument = ''
-
-    # default end date
-    if stop_date != Time_now:
-        stop_date = '&stop_date='+ stop_date
-    else:
-        stop_date = ''
-
-    if start_date != Time_now:
-        start_date = '&start_date='+ start_date
-    else:
-        start_date = ''        
-    
-        
-    url_name = 'http://dokku-app.dokku.arc.ucl.ac.uk/isa-archive/query/?'+ start_date  +stop_date+ instrument
-
-    # check network connection
-    try:
-        response = requests.get(url_name)
-    except:
-        raise ConnectionError('No network connection')
-
-    text = response.text
-    text = json.loads(text)
+    # the same dates make the key and the request
+    if start_date is None:
+        start_date = today_date()
+    if stop_date is None:
+        stop_date = today_date()
+
+    cache = query_cache
+    key = query_key(start_date, stop_date, instrument) if cache is not None else None
+
+    # invalid queries go to the client, which raises the errors
+    if key is None:
+        return get_client().query(start_date, stop_date, instrument)
+
+    if use_cache:
+        text = cache.get(key)
+        if text is not None:
+            return text
+
+    text = get_client().query(start_date, stop_date, instrument)
+    cache.put(key, text)
     return text
 
 def judge_legal_date(date):
@@ -133,15 +811,26 @@ def time_sub(start_time, stop_time):
     return diffd
 
 
-def download_isa(filename, save_dir=''):
+def download_isa(filename, save_dir='', skip_existing=False, checksum=None):
     """Download the file according to the file name and save path and save it to the specified location
 
+    The request goes through the shared ArchiveClient, reusing its connections (see set_client).
+
     Parameters
     ----------
     filename : str
         The name of the file to be downloaded
     save_dir : str, optional
         file save path, by default './'
+    skip_existing : bool, optional
+        Skip the download when the file is already there with the size of the archive, by default False
+    checksum : str, optional
+        Expected sha256 of the file in hex, by default None
+
+    Returns
+    -------
+    bool
+        Returns False if the download was skipped, True otherwise
 
     Raises
     ------
@@ -149,6 +838,10 @@ def download_isa(filename, save_dir=''):
         File is non Aigean file
     ValueError
         File not exists on the network
+    requests.HTTPError
+        The archive failed to answer
+    ValueError
+        The checksum of the file does not match
 
     Examples
     --------
@@ -159,25 +852,113 @@ def download_isa(filename, save_dir=''):
     True
     """    
     
-    # Determine whether the input file type meets the requirements
-    if 'zip' not in filename and 'asdf' not in filename and 'hdf5' not in filename and 'csv' not in filename:
-        raise TypeError('File is non Aigean file')
+    return get_client().download(filename, save_dir, skip_existing=skip_existing, checksum=checksum)
 
-    # Check whether the input save path is str type
-    if not isinstance(save_dir, str):
-        raise TypeError('Save path is not of type str')  
-    
-    # Get files online
-    url_name = 'http://dokku-app.dokku.arc.ucl.ac.uk/isa-archive/download/?filename=' + filename
-    response = requests.get(url_name)
 
-    # Check if this file exists on the network
-    if response.status_code != 200:
-        raise ValueError('File not exists on the network')
+def download_many(filenames, save_dir='', max_workers=4, retries=3, backoff=1.0, progress=None, client=None, skip_existing=False, checksums=None):
+    """Download many files at the same time, trying again the ones that failed on the way
+
+    The files go through one ArchiveClient, whose pool_maxsize should be at least max_workers
+    for every thread to keep its connection alive. A retry resumes the download where it stopped.
+
+    Parameters
+    ----------
+    filenames : list
+        The names of the files to be downloaded
+    save_dir : str, optional
+        file save path, by default './'
+    max_workers : int, optional
+        Max number of files downloaded at the same time, by default 4
+    retries : int, optional
+        Number of times a file is tried again after a network error or a server error, by default 3
+    backoff : float, optional
+        Seconds to wait before the first retry, doubled for each next one, by default 1.0
+    progress : function, optional
+        Called as progress(filename, done, total) each time a file is finished, by default None
+    client : class, optional
+        The ArchiveClient, by default the one of get_client
+    skip_existing : bool, optional
+        Skip the files already there with the size of the archive, by default False
+    checksums : dict, optional
+        Expected sha256 in hex by file name, by default None
+
+    Returns
+    -------
+    dict
+        Returns for each file name a dict of its 'path' (None if it failed), the number of 'attempts',
+        whether it was 'skipped' and the 'error' raised (None if it was downloaded)
+
+    Examples
+    --------
+    >>> from net import query_isa, download_many
+    >>> text = query_isa('2022-12-05', '2022-12-05', 'Fand')
+    >>> report = download_many([x['filename'] for x in text], max_workers=8)
+    >>> [filename for filename in report if report[filename]['error'] is not None]
+    []
+    """
+    if not isinstance(max_workers, int) or max_workers < 1:
+        raise ValueError('The max workers is not a natural number')
+    if not isinstance(retries, int) or retries < 0:
+        raise ValueError('The retries is not a non negative int')
+    if client is None:
+        client = get_client()
+    elif not isinstance(client, ArchiveClient):
+        raise TypeError('The client is not ArchiveClient type')
+
+    filenames = list(dict.fromkeys(filenames))
+    report = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(download_retry, client, filename, save_dir, retries, backoff,
+                                   skip_existing, (checksums or {}).get(filename)): filename for filename in filenames}
+        for future in as_completed(futures):
+            filename = futures[future]
+            report[filename] = future.result()
+            if progress is not None:
+                progress(filename, len(report), len(filenames))
+
+    # the report follows the input order
+    return {filename: report[filename] for filename in filenames}
+
+
+def download_retry(client, filename, save_dir, retries, backoff, skip_existing=False, checksum=None):
+    """Download one file, trying again after network errors and server errors with an exponential backoff
+
+    Parameters
+    ----------
+    client : class
+        The ArchiveClient
+    filename : str
+        The name of the file to be downloaded
+    save_dir : str
+        file save path
+    retries : int
+        Number of times the file is tried again
+    backoff : float
+        Seconds to wait before the first retry, doubled for each next one
+    skip_existing : bool, optional
+        Skip the file if it is already there with the size of the archive, by default False
+    checksum : str, optional
+        Expected sha256 of the file in hex, by default None
 
-    # save document    
-    path = Path(save_dir + filename)
-    path.write_bytes(response.content)
+    Returns
+    -------
+    dict
+        Returns the 'path' of the file (None if it failed), the number of 'attempts', whether it was 'skipped' and the 'error' raised
+    """
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            downloaded = client.download(filename, save_dir, skip_existing=skip_existing, checksum=checksum)
+            return {'path': save_dir + filename, 'attempts': attempts, 'skipped': not downloaded, 'error': None}
+        except requests.RequestException as error:
+            # network errors and server errors may pass, try again
+            if attempts > retries:
+                return {'path': None, 'attempts': attempts, 'skipped': False, 'error': error}
+            time.sleep(backoff * 2 ** (attempts - 1))
+        except Exception as error:
+            # a wrong file name does not get better by trying again
+            return {'path': None, 'attempts': attempts, 'skipped': False, 'error': error}
 
 
 # download_isa('aigean_ecn_20230115_042844.csv')
@@ -3,11 +3,44 @@ import numpy as np
 import asdf
 import h5py
 from zipfile import ZipFile
-from io import BytesIO
 import matplotlib.pyplot as plt
 import math
 from skimage.transform import rescale
 import os
+import struct
+import datetime
+import hashlib
+import threading
+import mmap
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+# max number of pixels along an axis that visualise reads from a lazily loaded map
+DISPLAY_PIXELS = 2048
+
+# ways overlapping pixels are composited by __add__ and mosaic
+BLEND_MODES = ('last', 'first', 'mean', 'max', 'min', 'latest')
+
+# ways images are resampled to a new resolution
+RESAMPLE_METHODS = ('nearest', 'bilinear', 'area', 'max')
+
+# dtype of the image data of results, None keeps the dtype of the inputs where that is lossless
+default_dtype = None
+
+# job shared with the worker processes of mosaic_parallel while it runs
+parallel_job = None
+
+# cache of rescaled images used by mosaic, None until enabled with set_rescale_cache
+rescale_cache = None
+
+# environment variables of the decoded image cache of get_satmap, and its default size limit
+CACHE_DIR_ENV = 'AIGEAN_CACHE_DIR'
+CACHE_MAX_BYTES_ENV = 'AIGEAN_CACHE_MAX_BYTES'
+CACHE_MAX_BYTES = 4*2**30
+
+# side of the tiles scattered points are read by, in pixels, from contiguous hdf5 datasets
+SAMPLE_TILE = 64
 
 class satmap():
     
@@ -19,7 +52,7 @@ class satmap():
         meta : dict
             Meta data, including 'instrument','observatory','resolution','time','date','xcoords','ycoords', 'archive' message
         data : array
-            Image information captured by remote sensing satellites
+            Image information captured by remote sensing satellites, an h5py dataset for lazily loaded maps
         shape : turple
             The shape of the image information
         fov : turple
@@ -39,9 +72,16 @@ class satmap():
         self.fov = fov
         self.centre = centre
 
+        # opened file behind a lazily loaded map
+        self.lazy = False
+        self.source = None
+        # (path, mtime, size) of the file the map was read from, the content key of the rescale cache
+        self.origin = None
+        self._transform = None
+
         if not isinstance(meta, dict):
             raise TypeError('The data type of meta is wrong')
-        if not isinstance(data, np.ndarray):
+        if not isinstance(data, (np.ndarray, h5py.Dataset)):
             raise TypeError('The data type of data is wrong')    
         if not isinstance(fov, tuple):
             raise TypeError('The data type of fov is wrong')      
@@ -50,6 +90,71 @@ class satmap():
         if data.shape != self.shape:
             raise ValueError('The data shape does not match the input shape')    
 
+    @property
+    def transform(self):
+        """GeoTransform between the earth and pixel coordinates of the map, cached until the meta coordinates change"""
+        meta = self.meta
+        key = (meta['xcoords'][0], meta['xcoords'][1], meta['ycoords'][0], meta['ycoords'][1], meta['resolution'])
+        if self._transform is None or self._transform.key() != key:
+            self._transform = GeoTransform.from_meta(meta)
+        return self._transform
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Close the file kept open by a lazily loaded map
+
+        Examples
+        --------
+        >>> from satmap import get_satmap
+        >>> with get_satmap('aigean_man_20221205_194510.hdf5', lazy=True) as man_map:
+        ...     man_map.data[2, 2]
+        """
+        if self.source is not None:
+            if isinstance(self.source, mmap.mmap):
+                # the image is a view of the mapping, it can not be read once unmapped
+                self.data = None
+                try:
+                    self.source.close()
+                except BufferError:
+                    # crops still view the mapping, it is unmapped with the last of them
+                    pass
+            else:
+                self.source.close()
+            self.source = None
+
+    def crop(self, bbox):
+        """Crop the map to an earth coordinate bounding box
+
+        Only the pixels inside the bounding box are read from a lazily loaded map.
+
+        Parameters
+        ----------
+        bbox : tuple
+            Earth coordinates of the bounding box, (x0, x1, y0, y1)
+
+        Returns
+        -------
+        class
+            Returns the satmap class of the cropped map, with the cropped 'xcoords' and 'ycoords'
+
+        Examples
+        --------
+        >>> from satmap import get_satmap
+        >>> fand_map = get_satmap('aigean_fan_20221205_191610.zip')
+        >>> fand_map.crop((100, 200, 450, 480)).meta['xcoords']
+        (100, 200)
+        """
+        window, meta = pixel_window(self.meta, bbox, self.shape)
+        data = self.data[window]
+        SatMap = type(self)(meta, data, data.shape, cal_fov(meta), cal_centre(meta))
+        SatMap.origin = self.origin
+        return SatMap
+
     def __sub__(self, another_lirmap):
         """ - image 
 
@@ -84,79 +189,137 @@ class satmap():
         >>> SatMap.data[0,0] 
         0.0
         """        
+        return self.subtract(another_lirmap)
+
+    def subtract(self, another_lirmap, out=None, dtype=None):
+        """ - image, writing the difference into a caller-provided buffer
+
+        The overlap of the two maps is read through views, and the difference is
+        written straight into its output, so a loop over many pairs of maps can reuse one buffer.
+
+        Parameters
+        ----------
+        another_lirmap : class
+            another class of input
+        out : np.array, optional
+            Buffer the difference is written into, by default None (a new array).
+            Buffers larger than the overlap are written from their upper left corner.
+        dtype : np.dtype, optional
+            dtype the difference is computed in, by default the dtype policy (see set_dtype),
+            with unsigned images giving a signed difference. out must hold it.
+
+        Returns
+        -------
+        class
+            Returns the new class after - two classes, its data is a view of out
+
+        Raises
+        ------
+        ValueError
+            The two maps are from same date and from same instrument, can not -
+        ValueError
+            The two maps is not overlap, can not -
+        ValueError
+            The out buffer is smaller than the overlap
+        ValueError
+            The out buffer dtype can not hold the difference, like an integer narrower than it
+
+        Examples
+        --------
+        >>> from satmap import get_satmap
+        >>> import numpy as np
+        >>> lir_map1 = get_satmap('aigean_fan_20221208_170852.zip')
+        >>> lir_map2 = get_satmap('aigean_fan_20221210_150420.zip')
+        >>> buffer = np.empty((100, 100))
+        >>> SatMap = lir_map1.subtract(lir_map2, out=buffer)
+        >>> np.shares_memory(SatMap.data, buffer)
+        True
+        """
         # judge type
         if not isinstance(another_lirmap, satmap):
             raise TypeError('The input is not of satmap class type')
+        if out is not None and not isinstance(out, np.ndarray):
+            raise TypeError('The out is not np.ndarray type')
 
         # when they are taken on different days, but still from the same instrument.
         if self.meta['date'] == another_lirmap.meta['date'] and self.meta['instrument'] == another_lirmap.meta['instrument']:
             raise ValueError('The two maps are from same date and from same instrument, can not - ')
+        if isoverlap(self.meta, another_lirmap.meta) != True:
+            raise ValueError('The two maps is not overlap, can not -')
+
+        meta = self.meta.copy()
+
+        # Get the sub coords
+        meta['xcoords'] = [max(self.meta['xcoords'][0], another_lirmap.meta['xcoords'][0]), min(self.meta['xcoords'][1], another_lirmap.meta['xcoords'][1])]
+        meta['ycoords'] = [max(self.meta['ycoords'][0], another_lirmap.meta['ycoords'][0]), min(self.meta['ycoords'][1], another_lirmap.meta['ycoords'][1])]
+
+        # earth coords to pixel coords 
+        shape = earth_to_pixel(meta, meta['xcoords'][1], meta['ycoords'][0])
+
+        # creat sub data, signed so differences of unsigned images do not wrap around
+        dtype = result_dtype([self.data.dtype, another_lirmap.data.dtype], dtype, signed=True)
+        if out is None:
+            data = np.empty(shape, dtype=dtype)
         else:
-            if isoverlap(self.meta, another_lirmap.meta) == True:
-                meta = self.meta.copy()
-                
-                # Get the earth coordinates of the edge
-                x11 = self.meta['xcoords'][0]
-                x12 = self.meta['xcoords'][1]
-                y11 = self.meta['ycoords'][0]
-                y12 = self.meta['ycoords'][1]
-                x21 = another_lirmap.meta['xcoords'][0]
-                x22 = another_lirmap.meta['xcoords'][1]
-                y21 = another_lirmap.meta['ycoords'][0]
-                y22 = another_lirmap.meta['ycoords'][1]
-
-                # Get the sub coords
-                meta['xcoords'] = [max(x11, x21), min(x12, x22)]
-                meta['ycoords'] = [max(y11, y21), min(y12, y22)]
-
-                # save coords
-                x = meta['xcoords']
-                y = meta['ycoords']
+            if out.ndim != 2 or out.shape[0] < shape[0] or out.shape[1] < shape[1]:
+                raise ValueError('The out buffer is smaller than the overlap')
+            if not can_hold(dtype, out.dtype):
+                raise ValueError('The out buffer dtype can not hold the difference')
+            data = out[:shape[0], :shape[1]]
 
-                
-                # earth coords to pixel coords 
-                pixel_xy = earth_to_pixel(meta, meta['xcoords'][1], meta['ycoords'][0])
-
-                # creat sub data 
-                data = np.zeros([pixel_xy[0], pixel_xy[1]])
-
-                # get the coordinates of the upper left point
-                meta['xcoords'] = [x21, x22]
-                meta['ycoords'] = [y21, y22]
-                pixel_start_2 = earth_to_pixel(meta,x[0], y[1])
-                pixel_end_2 = earth_to_pixel(meta,x[1], y[0])
-
-                # get the coordinates of the lower right point
-                meta['xcoords'] = [x11, x12]
-                meta['ycoords'] = [y11, y12]
-                pixel_start_1 = earth_to_pixel(meta,x[0], y[1])
-                pixel_end_1 = earth_to_pixel(meta, x[1], y[0])
-
-                # assign value to data
-                data[:,:] = self.data[pixel_start_1[0]:pixel_end_1[0], pixel_start_1[1]:pixel_end_1[1]] - another_lirmap.data[pixel_start_2[0]:pixel_end_2[0], pixel_start_2[1]:pixel_end_2[1]]
-                
-                # assign values to other elements of the satmap class
-                meta['xcoords'] = x
-                meta['ycoords'] = y
+        # only read the overlap of the two maps, overlaps narrower than a pixel are empty
+        if shape[0] > 0 and shape[1] > 0:
+            bbox = (meta['xcoords'][0], meta['xcoords'][1], meta['ycoords'][0], meta['ycoords'][1])
+            np.subtract(self.crop(bbox).data, another_lirmap.crop(bbox).data, out=data, dtype=dtype, casting='same_kind')
 
-                fov = (meta['xcoords'][1] - meta['xcoords'][0], meta['ycoords'][1] - meta['ycoords'][0])
-                centre = ((meta['xcoords'][1] + meta['xcoords'][0])/2, (meta['ycoords'][1] + meta['ycoords'][0])/2)
-                shape = data.shape
+        # create new satmap class
+        return type(self)(meta, data, data.shape, cal_fov(meta), cal_centre(meta))
 
-                # create new satmap class
-                map_sub = type(self)(meta, data, shape, fov, centre)
-                return  map_sub
-            else:
-                raise ValueError('The two maps is not overlap, can not -')    
+    def __isub__(self, another_lirmap):
+        """ -= image, writing the difference into the overlap of this map
 
+        The map is cropped to the overlap like with -, but its own data is reused.
+        Maps whose data can not hold the difference, like read-only or unsigned images,
+        get a new array instead.
 
-    def __add__(self, another_lirmap):
+        Parameters
+        ----------
+        another_lirmap : class
+            another class of input
+
+        Returns
+        -------
+        class
+            Returns this class after - another class
+        """
+        if not isinstance(another_lirmap, satmap):
+            raise TypeError('The input is not of satmap class type')
+        if not self.writable(result_dtype([self.data.dtype, another_lirmap.data.dtype], signed=True)):
+            return self - another_lirmap
+
+        # the window of this map inside the overlap, as a view
+        bbox = (max(self.meta['xcoords'][0], another_lirmap.meta['xcoords'][0]), min(self.meta['xcoords'][1], another_lirmap.meta['xcoords'][1]),
+                max(self.meta['ycoords'][0], another_lirmap.meta['ycoords'][0]), min(self.meta['ycoords'][1], another_lirmap.meta['ycoords'][1]))
+        try:
+            window = self.crop(bbox).data
+        except ValueError:
+            return self - another_lirmap
+        SatMap = self.subtract(another_lirmap, out=window)
+        self.meta, self.data, self.shape, self.fov, self.centre = SatMap.meta, SatMap.data, SatMap.shape, SatMap.fov, SatMap.centre
+        self.origin = None
+        return self
+
+    def __add__(self, another_lirmap, blend='last', dtype=None):
         """ - image
 
         Parameters
         ----------
         another_lirmap : class
             another class of input
+        blend : str, optional
+            How overlapping pixels are composited, one of BLEND_MODES, by default 'last' (the second map wins)
+        dtype : np.dtype, optional
+            dtype of the result data, by default the dtype policy (see set_dtype)
 
         Returns
         -------
@@ -185,6 +348,8 @@ class satmap():
 
         if not isinstance(another_lirmap, satmap):
             raise TypeError('Input is not satmap class')
+        if blend not in BLEND_MODES:
+            raise ValueError('The blend mode is wrong')
         # same instrument (and with the same resolution) taken on the same day
         # Determine whether it is the same device on the same day
         if self.meta['resolution'] == another_lirmap.meta['resolution']:
@@ -207,27 +372,18 @@ class satmap():
             # earth coords to pixel coords 
             pixel_xy = earth_to_pixel(meta, meta['xcoords'][1], meta['ycoords'][0])
 
-            # create add map data
-            data = np.zeros([pixel_xy[0], pixel_xy[1]])
-
-            # get the upper right and lower left point of the pixel array
-            pixel_start_1 = np.array(earth_to_pixel(meta, x11, y12))
-            pixel_end_1 = np.array(earth_to_pixel(meta, x12, y11))
-            pixel_start_2 = np.array(earth_to_pixel(meta, x21, y22))
-            pixel_end_2 = np.array(earth_to_pixel(meta, x22, y21))
+            # create add map data, in a dtype holding both images
+            dtype = result_dtype([self.data.dtype, another_lirmap.data.dtype], dtype, exact=blend != 'mean')
+            data = np.zeros([pixel_xy[0], pixel_xy[1]], dtype=dtype)
+            compositor = Compositor(data, blend)
 
-            # assign the value to the data
-            pixel_start_1[0], pixel_end_1[0] = handle_edge(pixel_start_1[0], pixel_end_1[0], self.data.shape[0])
-            pixel_start_1[1], pixel_end_1[1] = handle_edge(pixel_start_1[1], pixel_end_1[1], self.data.shape[1])
+            # get the upper right and lower left point of the pixel array, handle edge
+            pixel_start_1, pixel_end_1 = paste_window(meta, self.meta, self.data.shape)
+            pixel_start_2, pixel_end_2 = paste_window(meta, another_lirmap.meta, another_lirmap.data.shape)
 
-            pixel_start_2[0], pixel_end_2[0] = handle_edge(pixel_start_2[0], pixel_end_2[0], another_lirmap.data.shape[0])
-            pixel_start_2[1], pixel_end_2[1] = handle_edge(pixel_start_2[1], pixel_end_2[1], another_lirmap.data.shape[1])            
-
-
-            # handle edge
-
-            data[pixel_start_1[0]:pixel_end_1[0], pixel_start_1[1]:pixel_end_1[1]] = self.data[:,:]
-            data[pixel_start_2[0]:pixel_end_2[0],pixel_start_2[1]:pixel_end_2[1]] = another_lirmap.data[:,:]
+            compositor.add(self.data, pixel_start_1, pixel_end_1, meta_timestamp(self.meta))
+            compositor.add(another_lirmap.data, pixel_start_2, pixel_end_2, meta_timestamp(another_lirmap.meta))
+            data = compositor.finish()
  
             # assign values to other elements of the satmap class
             fov = (meta['xcoords'][1] - meta['xcoords'][0], meta['ycoords'][1] - meta['ycoords'][0])
@@ -243,7 +399,53 @@ class satmap():
 
 
 
-    def mosaic(self, another_satmap, resolution='', padding=True):
+    def __iadd__(self, another_lirmap):
+        """ += image, writing another map into the data of this map
+
+        Maps lying inside this map are pasted into its own data. Other maps, and maps
+        whose data can not hold the sum, give a new map like with +.
+
+        Parameters
+        ----------
+        another_lirmap : class
+            another class of input
+
+        Returns
+        -------
+        class
+            Returns this class after + another class
+        """
+        if not isinstance(another_lirmap, satmap):
+            raise TypeError('Input is not satmap class')
+
+        inside = (self.meta['xcoords'][0] <= another_lirmap.meta['xcoords'][0] and another_lirmap.meta['xcoords'][1] <= self.meta['xcoords'][1]
+                  and self.meta['ycoords'][0] <= another_lirmap.meta['ycoords'][0] and another_lirmap.meta['ycoords'][1] <= self.meta['ycoords'][1])
+        if (not inside or self.meta['resolution'] != another_lirmap.meta['resolution']
+                or not self.writable(result_dtype([self.data.dtype, another_lirmap.data.dtype]))):
+            return self + another_lirmap
+
+        pixel_start, pixel_end = paste_window(self.meta, another_lirmap.meta, another_lirmap.data.shape)
+        paste(self.data, another_lirmap.data, pixel_start, pixel_end)
+        self.origin = None
+        return self
+
+    def writable(self, dtype):
+        """Whether results of the given dtype can be written into the data of the map
+
+        Parameters
+        ----------
+        dtype : np.dtype
+            dtype of the results
+
+        Returns
+        -------
+        bool
+            True for writable arrays whose dtype holds the results
+        """
+        return (isinstance(self.data, np.ndarray) and self.data.flags.writeable
+                and can_hold(dtype, self.data.dtype))
+
+    def mosaic(self, another_satmap, resolution='', padding=True, blend='last', method='bilinear', dtype=None):
         """mosaic operation on two classes
 
         Parameters
@@ -254,6 +456,12 @@ class satmap():
             image resolution, by default ''
         padding : bool, optional
             Whether to perform padding operation, by default True
+        blend : str, optional
+            How overlapping pixels are composited, one of BLEND_MODES, by default 'last' (another_satmap wins)
+        method : str, optional
+            Resampling method, one of RESAMPLE_METHODS, by default 'bilinear'
+        dtype : np.dtype, optional
+            dtype of the mosaic data, by default the dtype policy (see set_dtype)
 
         Returns
         -------
@@ -286,85 +494,24 @@ class satmap():
             raise TypeError('The padding is not bool type')
 
  
-        map_self_meta = self.meta.copy()
-        map_another_meta = another_satmap.meta.copy()
-        
-        # use the min resolution as both resolution
-        if resolution == '':
-            resolution = min(self.meta['resolution'], another_satmap.meta['resolution'])
-            map_self_meta['resolution'] = resolution
-            map_another_meta['resolution'] = resolution
-            map_self_data = rescale(self.data, self.meta['resolution']/resolution)
-            map_another_data = rescale(another_satmap.data, another_satmap.meta['resolution']/resolution)
-
-        # use the given resolution    
-        else:
-            # judge the value of resolution
-            if resolution<=0:
-                raise ValueError('resolution less than 0')   
-            map_self_data = rescale(self.data, self.meta['resolution']/resolution)
-            map_another_data = rescale(another_satmap.data, another_satmap.meta['resolution']/resolution)
-            map_self_meta['resolution'] = resolution
-            map_another_meta['resolution'] = resolution
-
-        # assign the value to other elements of satmap class
-        map_self_fov = (map_self_meta['xcoords'][1] - map_self_meta['xcoords'][0], map_self_meta['ycoords'][1] - map_self_meta['ycoords'][0])
-        map_self_shape = map_self_data.shape
-        map_self_centre = ((map_self_meta['xcoords'][1] + map_self_meta['xcoords'][0])/2, (map_self_meta['ycoords'][1] + map_self_meta['ycoords'][0])/2)
-
-        map_another_fov = (map_another_meta['xcoords'][1] - map_another_meta['xcoords'][0], map_another_meta['ycoords'][1] - map_another_meta['ycoords'][0])
-        map_another_shape = map_another_data.shape
-        map_another_centre = ((map_another_meta['xcoords'][1] + map_another_meta['xcoords'][0])/2, (map_another_meta['ycoords'][1] + map_another_meta['ycoords'][0])/2)
-
-        # creat new satmap class
-        map_self = type(self)(map_self_meta, map_self_data, map_self_shape, map_self_fov, map_self_centre)
-        map_another = type(self)(map_another_meta, map_another_data, map_another_shape, map_another_fov, map_another_centre) 
-
-        # get the mosaic satmap class
-        map_mosaic = map_self + map_another
+        # judge the value of resolution
+        if resolution != '' and resolution<=0:
+            raise ValueError('resolution less than 0')
+
+        # get the mosaic satmap class in a single pass
+        map_mosaic = mosaic_many([self, another_satmap], resolution=resolution, blend=blend, method=method, dtype=dtype)
         if padding:    
             return map_mosaic   
             
         else:
-            # judge 4 area1
-            # satmap 1 area
-            area1 = map_self.data.shape[0]*map_self.data.shape[1]
-            # satmap 2 area
-            area2 = map_another.data.shape[0]*map_another.data.shape[1]
-     
-            data_process = np.copy(map_mosaic.data).astype(float)
-            
-            # row area
-            data_row = []
-            for i in range(data_process.shape[0]):
-                if 0 not in data_process[i,:]:
-                    data_row.append(data_process[i,:])
-            data_row = np.array(data_row)
-            area3 = data_row.shape[0]*data_row.shape[1]
-            
-            # column area
-            data_column = []
-            for i in range(data_process.shape[1]):
-                if 0 not in data_process[:,i]:
-                    data_column.append(data_process[:,i])
-            data_column = np.array(data_column)
-            area4 = data_column.shape[0]*data_column.shape[1]
-            
-            # get the index of max area
-            area_list = [area1, area2, area3, area4]
-            area_index = area_list.index(max(area_list))
-            
-            # return different data according to the index
-            if area_index == 0:
-                map_mosaic.data = self.data
-            if area_index == 1:
-                map_mosaic.data = another_satmap.data
-            if area_index == 2:
-                map_mosaic.data = data_row
-            if area_index == 3:
-                map_mosaic.data = data_column        
-            
-            return map_mosaic
+            # crop to the largest rectangle without padding pixels, as a view of the mosaic data
+            rows, columns = largest_valid_window(map_mosaic.data != 0)
+            meta = map_mosaic.meta
+            earth_x, earth_y = map_mosaic.transform.to_earth([rows.stop, rows.start], [columns.start, columns.stop])
+            meta['xcoords'] = [int(earth_x[0]), int(earth_x[1])]
+            meta['ycoords'] = [int(earth_y[0]), int(earth_y[1])]
+            data = map_mosaic.data[rows, columns]
+            return type(self)(meta, data, data.shape, cal_fov(meta), cal_centre(meta))
                         
 
     def visualise(self, save=False, savepath=''):
@@ -393,24 +540,119 @@ class satmap():
         if not isinstance(savepath, str):
             raise TypeError('The saved path is not str type')    
 
+        # a lazily loaded map only reads the pixels shown on screen
+        step = 1
+        if self.lazy:
+            step = max(1, max(self.shape) // DISPLAY_PIXELS)
+
         # plot array in earth coordinates
-        plt.imshow(self.data, origin='lower', 
+        plt.imshow(self.data[::step, ::step], origin='lower', 
         extent=[self.meta['xcoords'][0], self.meta['xcoords'][1], 
         self.meta['ycoords'][0], self.meta['ycoords'][1]])
         
-        # save image
-        if save:
-            time = self.meta['time'].replace(':', '')
-            date = self.meta['date'].replace('-', '')
-            instrument = self.meta['instrument'].lower()[:3]
-            save_name = self.meta['observatory'] +'_'+instrument+'_'+date+'_'+time+'_'+'mosaic'+'.png'
-            full_name = os.path.join(savepath, save_name)
-            plt.savefig(full_name)
-
-        # plot image    
-        else:
-            plt.show()   
-  
+        show_or_save(self.meta, save, savepath)
+
+class GeoTransform():
+
+    def __init__(self, xcoords, ycoords, resolution) -> None:
+        """Affine transform between earth coordinates and pixel coordinates of an image
+
+        Pixel x is the row, counted down from the top edge ycoords[1],
+        pixel y is the column, counted right from the left edge xcoords[0].
+
+        Parameters
+        ----------
+        xcoords : tuple
+            Earth x-coordinates of the left and right edges
+        ycoords : tuple
+            Earth y-coordinates of the bottom and top edges
+        resolution : int
+            Earth units per pixel
+
+        Examples
+        --------
+        >>> from satmap import GeoTransform
+        >>> transform = GeoTransform((75, 300), (450, 500), 5)
+        >>> transform.to_pixel([100, 120], [470, 490])
+        (array([6, 2]), array([5, 9]))
+        """
+        self.xcoords = (xcoords[0], xcoords[1])
+        self.ycoords = (ycoords[0], ycoords[1])
+        self.resolution = resolution
+
+    @classmethod
+    def from_meta(cls, meta):
+        """Build the transform of an image from its meta data
+
+        Parameters
+        ----------
+        meta : dict
+            Meta data, including 'resolution','xcoords','ycoords'
+
+        Returns
+        -------
+        class
+            The GeoTransform of the image
+        """
+        return cls(meta['xcoords'], meta['ycoords'], meta['resolution'])
+
+    def key(self):
+        return self.xcoords + self.ycoords + (self.resolution,)
+
+    def to_pixel(self, earth_x, earth_y, clip=False):
+        """Conversion from earth coordinates to pixel coordinates
+
+        Parameters
+        ----------
+        earth_x : float or array
+            input earth x-coordinates
+        earth_y : float or array
+            input earth y-coordinates
+        clip : bool, optional
+            Whether to clip coordinates out of range to the image edges instead of raising, by default False
+
+        Returns
+        -------
+        np.array, np.array
+            returns the pixel x-coordinates and pixel y-coordinates
+
+        Raises
+        ------
+        ValueError
+            Earth coordinates out of range
+        """
+        earth_x = np.asarray(earth_x)
+        earth_y = np.asarray(earth_y)
+        if clip:
+            earth_x = np.clip(earth_x, self.xcoords[0], self.xcoords[1])
+            earth_y = np.clip(earth_y, self.ycoords[0], self.ycoords[1])
+        elif np.any((earth_x < self.xcoords[0]) | (earth_x > self.xcoords[1]) | (earth_y < self.ycoords[0]) | (earth_y > self.ycoords[1])):
+            raise ValueError('Earth coordinates out of range')
+
+        pixel_x = np.rint(np.abs((earth_y - self.ycoords[1])/self.resolution)).astype(int)
+        pixel_y = np.rint((earth_x - self.xcoords[0])/self.resolution).astype(int)
+        return pixel_x, pixel_y
+
+    def to_earth(self, pixel_x, pixel_y):
+        """Conversion from pixel coordinates to earth coordinates
+
+        Parameters
+        ----------
+        pixel_x : int or array
+            input pixel x-coordinates
+        pixel_y : int or array
+            input pixel y-coordinates
+
+        Returns
+        -------
+        np.array, np.array
+            returns the earth x-coordinates and earth y-coordinates
+        """
+        earth_x = self.xcoords[0] + np.asarray(pixel_y) * self.resolution
+        earth_y = self.ycoords[1] - np.asarray(pixel_x) * self.resolution
+        return earth_x, earth_y
+
+
 def pixel_to_earth(meta, pixel_x, pixel_y):
     """Conversion from pixel coordinates to earth coordinates
 
@@ -428,9 +670,9 @@ def pixel_to_earth(meta, pixel_x, pixel_y):
     turple
         returns an earth coordinate pair
     """        
-    earth_x = int (meta['xcoords'][0] + pixel_y * meta['resolution']/2)
-    earth_y = int (meta['ycoords'][1] - pixel_x * meta['resolution']/2)
-    earth = (earth_x, earth_y)
+    # keep the half resolution step of this function
+    earth_x, earth_y = GeoTransform.from_meta(meta).to_earth(pixel_x/2, pixel_y/2)
+    earth = (int(earth_x), int(earth_y))
     return earth
 
 
@@ -451,15 +693,8 @@ def earth_to_pixel(meta, earth_x, earth_y):
     turple
         returns an pixel coordinate pair
     """        
-    
-    # Value check
-    if earth_x < meta['xcoords'][0] or earth_x > meta['xcoords'][1] or earth_y < meta['ycoords'][0] or earth_y > meta['ycoords'][1]:
-        raise ValueError('Earth coordinates out of range') 
-    
-    # Get the pixel coordinates
-    pixel_x = round(abs((earth_y-meta['ycoords'][1])/meta['resolution']))
-    pixel_y= round((earth_x-meta['xcoords'][0])/meta['resolution'])
-    pixel = (pixel_x, pixel_y)
+    pixel_x, pixel_y = GeoTransform.from_meta(meta).to_pixel(earth_x, earth_y)
+    pixel = (int(pixel_x), int(pixel_y))
     return pixel   
 
 def handle_edge(start, end, shape):
@@ -468,119 +703,2330 @@ def handle_edge(start, end, shape):
             start = end - shape
         else:
             end = start + shape    
-    return start, end        
+    return start, end
 
-def isoverlap(meta1, meta2):
-    """Determine whether two images overlap
+class Compositor():
 
-    Parameters
-    ----------
-    meta1 : dict
-        Meta data in a file
-    meta2 : dict
-        Meta data in another file
+    def __init__(self, canvas, blend='last', buffer=None) -> None:
+        """Composite images into a canvas with vectorized slice updates
 
-    Returns
-    -------
-    bool
-        Returns a bool value to determine whether it overlaps
-    """    
-    if meta1['xcoords'][0] >= meta2['xcoords'][1] or meta1['xcoords'][1] <= meta2['xcoords'][0] or meta1['ycoords'][1]<= meta2['ycoords'][0] or meta1['ycoords'][0] >= meta2['ycoords'][1]:
-        return False
-    else:
-        return True
+        'last' and 'first' keep the pixels of the last or first image written,
+        'mean', 'max' and 'min' combine the overlapping pixels, and 'latest'
+        keeps the pixels of the image with the latest observation time.
+        Only one extra buffer the size of the canvas is kept: a float64 sum and a count for 'mean',
+        so integer canvases do not overflow, a written mask for 'first', 'max' and 'min',
+        and a timestamp buffer for 'latest'.
 
+        Parameters
+        ----------
+        canvas : np.array
+            The array written into, pixels no image is written to keep their value
+        blend : str, optional
+            One of BLEND_MODES, by default 'last'
+        buffer : np.array, optional
+            The buffer of an earlier composite into the canvas, to carry on with it, by default a new buffer
 
+        Raises
+        ------
+        ValueError
+            The blend mode is wrong
+        """
+        if blend not in BLEND_MODES:
+            raise ValueError('The blend mode is wrong')
+
+        self.canvas = canvas
+        self.blend = blend
+        self.buffer = buffer
+        spec = self.buffer_spec(blend)
+        if buffer is None and spec is not None:
+            self.buffer = np.full(canvas.shape, spec[1], dtype=spec[0])
+
+    @staticmethod
+    def buffer_spec(blend):
+        """dtype and initial value of the buffer of a blend mode
 
-def get_satmap(filename):
-    """read different files
+        Parameters
+        ----------
+        blend : str
+            One of BLEND_MODES
 
-    Parameters
-    ----------
-    filename : str
-        input file name
+        Returns
+        -------
+        tuple
+            Returns the dtype and the initial value, or None for 'last', which needs no buffer
+        """
+        if blend == 'mean':
+            dtype = np.dtype([('sum', np.float64), ('count', np.uint32)])
+            return dtype, np.zeros((), dtype=dtype)
+        elif blend in ('first', 'max', 'min'):
+            return bool, False
+        elif blend == 'latest':
+            return np.float64, -np.inf
+        return None
+
+    def add(self, data, pixel_start, pixel_end, timestamp=0.0):
+        """Composite an image into a window of the canvas
 
-    Returns
-    -------
-    class
-        Return satmap class, including meta, data, shape, fov, centre
-    """    
-    if 'hdf5' in filename:
-        meta, data = read_hdf5(filename)         
+        Parameters
+        ----------
+        data : array
+            Image data, an array or an h5py dataset
+        pixel_start : tuple
+            The upper left pixel coordinates of the window
+        pixel_end : tuple
+            The lower right pixel coordinates of the window
+        timestamp : float, optional
+            Observation time of the image, used by 'latest', by default 0.0
+        """
+        if self.blend == 'last':
+            paste(self.canvas, data, pixel_start, pixel_end)
+            return
+
+        window = np.s_[pixel_start[0]:pixel_end[0], pixel_start[1]:pixel_end[1]]
+        target = self.canvas[window]
+        buffer = self.buffer[window]
+        data = data[:, :]
+
+        if self.blend == 'mean':
+            # the buffer keeps the sum until finish
+            buffer['sum'] += data
+            buffer['count'] += 1
+        elif self.blend == 'latest':
+            newer = buffer <= timestamp
+            np.copyto(target, data, where=newer)
+            np.copyto(buffer, timestamp, where=newer)
+        else:
+            if self.blend == 'first':
+                write = ~buffer
+            elif self.blend == 'max':
+                write = ~buffer | (data > target)
+            else:
+                write = ~buffer | (data < target)
+            np.copyto(target, data, where=write)
+            buffer[...] = True
 
-    elif 'asdf' in filename:
-        meta,data = read_asdf(filename)
+    def finish(self):
+        """Finish the composite
 
-    elif 'zip' in filename:
-        meta, data = read_zip(filename)
-    else:
-        raise ValueError('The input file type is wrong')    
+        Returns
+        -------
+        np.array
+            The canvas
+        """
+        if self.blend == 'mean':
+            self.write_mean(self.canvas, self.buffer)
+        self.buffer = None
+        return self.canvas
+
+    @staticmethod
+    def write_mean(canvas, buffer):
+        """Write the means of a 'mean' buffer into the pixels of a canvas written to
 
-    shape = data.shape
-    fov = cal_fov(meta)
-    centre = cal_centre(meta)
-    SatMap = satmap(meta, data, shape, fov, centre)    
-    return SatMap
+        Parameters
+        ----------
+        canvas : np.array
+            The array written into, integer means are rounded
+        buffer : np.array
+            The sum and count buffer of the canvas
 
+        Returns
+        -------
+        np.array
+            The canvas
+        """
+        written = buffer['count'] > 0
+        mean = np.divide(buffer['sum'], buffer['count'], out=np.zeros(canvas.shape), where=written)
+        if canvas.dtype.kind in 'biu':
+            np.rint(mean, out=mean)
+        np.copyto(canvas, mean, where=written, casting='unsafe')
+        return canvas
 
-def process_meta(meta_file):
-    """read meta from different files
+
+def meta_timestamp(meta):
+    """Observation time of an image as a POSIX timestamp
 
     Parameters
     ----------
-    meta_file : dict
-        Dictionary file containing meta data
+    meta : dict
+        Meta data, including 'date' and 'time'
 
     Returns
     -------
-    dict
-        Return meta dictionary data
-    """    
-    meta_list = ['instrument','observatory','resolution','time','date','xcoords','ycoords', 'archive']
-    meta = {}
-    for key in meta_list:
-        try:
-            meta[key] = meta_file[key]
-        except:
-            meta[key] = ''
-        if 'coords' in key:
-            meta[key] = tuple(map(int,meta[key]))
-    return meta
-
+    float
+        The observation time, 0.0 when the date or time is missing
+    """
+    try:
+        return datetime.datetime.strptime(meta['date'] + ' ' + meta['time'], '%Y-%m-%d %H:%M:%S').replace(tzinfo=datetime.timezone.utc).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return 0.0
 
-def read_hdf5(filename):
-    """read hdf5 file
+def paste_window(meta, sub_meta, shape):
+    """Pixel window of an image inside a larger canvas
 
     Parameters
     ----------
-    filename : str
-        file name
+    meta : dict
+        Meta data of the canvas
+    sub_meta : dict
+        Meta data of the image pasted into the canvas
+    shape : tuple
+        The shape of the image pixel array
 
     Returns
     -------
-    dict, np.array 
-        Returns the read image data and meta dictionary
-    """    
-    f = h5py.File(filename, 'r')
-    group = f[list(f.keys())[0]]
-    data = group['data']
-    data = np.array(data)
-    meta = process_meta(group.attrs)
-    f.close()
-    return meta, data
+    np.array, np.array
+        The upper left (start) and lower right (end) pixel coordinates of the image in the canvas
+    """
+    pixel_x, pixel_y = GeoTransform.from_meta(meta).to_pixel(sub_meta['xcoords'], sub_meta['ycoords'][::-1])
+    pixel_start = np.array([pixel_x[0], pixel_y[0]])
+    pixel_end = np.array([pixel_x[1], pixel_y[1]])
+    pixel_start[0], pixel_end[0] = handle_edge(pixel_start[0], pixel_end[0], shape[0])
+    pixel_start[1], pixel_end[1] = handle_edge(pixel_start[1], pixel_end[1], shape[1])
+    return pixel_start, pixel_end
 
+def paste(canvas, data, pixel_start, pixel_end):
+    """Write image data into a window of a canvas
 
-def read_asdf(filename):
-    """read asdf file
+    An h5py dataset is read straight into the canvas, without an intermediate array.
 
     Parameters
     ----------
-    filename : str
-        file name
+    canvas : np.array
+        The array written into
+    data : array
+        Image data, an array or an h5py dataset
+    pixel_start : tuple
+        The upper left pixel coordinates of the window
+    pixel_end : tuple
+        The lower right pixel coordinates of the window
+    """
+    window = np.s_[pixel_start[0]:pixel_end[0], pixel_start[1]:pixel_end[1]]
+    if isinstance(data, h5py.Dataset) and canvas.flags.c_contiguous:
+        data.read_direct(canvas, np.s_[:, :], window)
+    else:
+        canvas[window] = data[:, :]
+
+def pixel_window(meta, bbox, shape):
+    """Pixel window of an earth coordinate bounding box inside an image
+
+    The bounding box is clipped to the image.
+
+    Parameters
+    ----------
+    meta : dict
+        Meta data of the image
+    bbox : tuple
+        Earth coordinates of the bounding box, (x0, x1, y0, y1)
+    shape : tuple
+        The shape of the image pixel array
 
     Returns
     -------
-    dict, np.array 
+    tuple, dict
+        Returns the (rows, columns) slices of the window and the meta data of the window
+
+    Raises
+    ------
+    ValueError
+        The bbox is not overlap with the map
+    """
+    # clip the bbox to the image
+    x0 = max(bbox[0], meta['xcoords'][0])
+    x1 = min(bbox[1], meta['xcoords'][1])
+    y0 = max(bbox[2], meta['ycoords'][0])
+    y1 = min(bbox[3], meta['ycoords'][1])
+    if x0 >= x1 or y0 >= y1:
+        raise ValueError('The bbox is not overlap with the map')
+
+    # earth coords to pixel coords
+    pixel_x, pixel_y = GeoTransform.from_meta(meta).to_pixel([x0, x1], [y1, y0])
+    rows = slice(int(pixel_x[0]), min(int(pixel_x[1]), shape[0]))
+    columns = slice(int(pixel_y[0]), min(int(pixel_y[1]), shape[1]))
+    if rows.start >= rows.stop or columns.start >= columns.stop:
+        raise ValueError('The bbox is not overlap with the map')
+
+    # earth coords of the window edges
+    resolution = meta['resolution']
+    window_meta = meta.copy()
+    window_meta['xcoords'] = (int(meta['xcoords'][0] + columns.start*resolution), int(meta['xcoords'][0] + columns.stop*resolution))
+    window_meta['ycoords'] = (int(meta['ycoords'][1] - rows.stop*resolution), int(meta['ycoords'][1] - rows.start*resolution))
+    return (rows, columns), window_meta
+
+def largest_valid_window(valid):
+    """Largest axis-aligned rectangle where every pixel is valid
+
+    Runs of identical rows and columns are merged first, a mosaic mask being a union
+    of a few rectangles, then a histogram-stack search runs over the merged grid
+    in O(rows x columns).
+
+    Parameters
+    ----------
+    valid : np.array
+        2D bool mask of the valid pixels
+
+    Returns
+    -------
+    slice, slice
+        The rows and columns of the rectangle, empty when no pixel is valid
+    """
+    if valid.size == 0 or not valid.any():
+        return slice(0, 0), slice(0, 0)
+
+    # merge runs of identical rows and columns
+    row_starts = np.flatnonzero(np.r_[True, np.any(valid[1:] != valid[:-1], axis=1)])
+    column_starts = np.flatnonzero(np.r_[True, np.any(valid[:, 1:] != valid[:, :-1], axis=0)])
+    grid = valid[np.ix_(row_starts, column_starts)]
+    row_ends = np.r_[row_starts[1:], valid.shape[0]]
+    column_edges = np.r_[column_starts, valid.shape[1]].tolist()
+
+    best = (0, 0, 0, 0, 0)
+    heights = np.zeros(len(column_starts), dtype=np.int64)
+    for i in range(len(row_starts)):
+        # pixel height of the valid run ending at this row block, for each column block
+        heights = np.where(grid[i], heights + (row_ends[i] - row_starts[i]), 0)
+
+        # largest rectangle under the histogram
+        stack = []
+        for j, height in enumerate(heights.tolist() + [0]):
+            start = j
+            while stack and stack[-1][1] >= height:
+                start, top = stack.pop()
+                area = top * (column_edges[j] - column_edges[start])
+                if area > best[0]:
+                    best = (area, int(row_ends[i]) - top, int(row_ends[i]), column_edges[start], column_edges[j])
+            stack.append((start, height))
+
+    _, row_start, row_end, column_start, column_end = best
+    return slice(row_start, row_end), slice(column_start, column_end)
+
+def resample(data, scale, method='bilinear', dtype=None):
+    """Resample image data by a scale factor
+
+    Nothing is done for a factor of 1. Integer upsampling with 'nearest', 'area' or 'max'
+    repeats the pixels, integer downsampling averages ('area') or takes the max ('max')
+    of the pixel blocks, or picks the block centres ('nearest'). Everything else,
+    including 'bilinear' at any factor other than 1, falls back to skimage rescale,
+    bilinear for 'area' and 'max' at factors that are not integers, so the result
+    dtype follows the interpolation (see resample_exact).
+
+    Parameters
+    ----------
+    data : array
+        Image data, an array or an h5py dataset
+    scale : float
+        Scale factor, the resolution of the data divided by the target resolution
+    method : str, optional
+        One of RESAMPLE_METHODS, by default 'bilinear'
+    dtype : np.dtype, optional
+        dtype of the result, by default the dtype policy (see set_dtype)
+
+    Returns
+    -------
+    array
+        The resampled data, the input itself for a factor of 1 if its dtype is kept
+
+    Raises
+    ------
+    ValueError
+        The resampling method is wrong
+    """
+    if method not in RESAMPLE_METHODS:
+        raise ValueError('The resampling method is wrong')
+    dtype = result_dtype([data.dtype], dtype, exact=resample_exact(scale, method))
+    if scale == 1 and data.dtype == dtype:
+        return data
+    data = data[:, :].astype(dtype, copy=False)
+    if scale == 1:
+        return data
+
+    # integer upsampling repeats the pixels
+    factor = round(scale)
+    if scale > 1 and integer_factor(scale) and method != 'bilinear':
+        height, width = data.shape
+        repeated = np.broadcast_to(data[:, None, :, None], (height, factor, width, factor))
+        return repeated.reshape(height*factor, width*factor)
+
+    # integer downsampling reduces the pixel blocks
+    factor = round(1/scale)
+    if scale < 1 and integer_factor(scale) and method != 'bilinear':
+        shape = resampled_shape(data.shape, scale, method)
+        if method == 'nearest':
+            rows = np.minimum(np.arange(shape[0])*factor + factor//2, data.shape[0] - 1)
+            columns = np.minimum(np.arange(shape[1])*factor + factor//2, data.shape[1] - 1)
+            return data[np.ix_(rows, columns)]
+        reduce = np.mean if method == 'area' else np.max
+        if data.shape[0] != shape[0]*factor or data.shape[1] != shape[1]*factor:
+            # blocks cut by the edges only use the pixels inside the image
+            if method == 'area':
+                fill, reduce = np.nan, np.nanmean
+            elif dtype.kind == 'f':
+                fill = -np.inf
+            else:
+                fill = np.iinfo(dtype).min
+            padded = np.full((shape[0]*factor, shape[1]*factor), fill, dtype=dtype)
+            height, width = min(data.shape[0], padded.shape[0]), min(data.shape[1], padded.shape[1])
+            padded[:height, :width] = data[:height, :width]
+            data = padded
+        return reduce(data.reshape(shape[0], factor, shape[1], factor), axis=(1, 3)).astype(dtype, copy=False)
+
+    order = 0 if method == 'nearest' else 1
+    return rescale(data, scale, order=order, preserve_range=True).astype(dtype, copy=False)
+
+
+def set_dtype(dtype=None):
+    """Set the dtype of the image data of results, for the whole package
+
+    Readers cast the images they read, and arithmetic, resampling and mosaic
+    compute their results, in this dtype. Functions taking a dtype argument
+    use it instead when it is given.
+
+    Parameters
+    ----------
+    dtype : np.dtype, optional
+        A numeric dtype like np.float32, by default None, which keeps the dtype of
+        the inputs where that is lossless
+
+    Returns
+    -------
+    np.dtype
+        Returns the previous dtype
+
+    Examples
+    --------
+    >>> from satmap import set_dtype, get_satmap
+    >>> set_dtype('float32')
+    >>> get_satmap('aigean_lir_20221205_191610.asdf').data.dtype
+    dtype('float32')
+    """
+    global default_dtype
+    if dtype is not None:
+        dtype = np.dtype(dtype)
+        if dtype.kind not in 'iuf':
+            raise ValueError('The dtype is not numeric')
+    previous = default_dtype
+    default_dtype = dtype
+    return previous
+
+
+def get_dtype():
+    """Get the dtype of the image data of results, None when the dtype of the inputs is kept
+
+    Returns
+    -------
+    np.dtype
+        The dtype set by set_dtype
+    """
+    return default_dtype
+
+
+def can_hold(dtype, out_dtype):
+    """Whether results of a dtype can be written into arrays of another without wrapping around
+
+    Floats can be narrowed to smaller floats, integers only go to dtypes holding all their values.
+
+    Parameters
+    ----------
+    dtype : np.dtype
+        dtype of the results
+    out_dtype : np.dtype
+        dtype of the array written into
+
+    Returns
+    -------
+    bool
+        True if the results fit
+    """
+    out_dtype = np.dtype(out_dtype)
+    return np.can_cast(dtype, out_dtype, 'safe' if out_dtype.kind in 'biu' else 'same_kind')
+
+
+def result_dtype(dtypes, dtype=None, exact=True, signed=False):
+    """dtype of a result computed from images of the given dtypes
+
+    Parameters
+    ----------
+    dtypes : list
+        dtypes of the input images
+    dtype : np.dtype, optional
+        dtype asked for by the caller, by default the dtype policy (see set_dtype)
+    exact : bool, optional
+        Whether the result values are input values, by default True. Otherwise, like
+        for means and interpolation, integer inputs give a float result.
+    signed : bool, optional
+        Whether the result holds differences, by default False. Unsigned integer inputs
+        then give a signed result wide enough for them.
+
+    Returns
+    -------
+    np.dtype
+        The dtype of the result
+    """
+    if dtype is None:
+        dtype = default_dtype
+    if dtype is not None:
+        return np.dtype(dtype)
+
+    dtype = np.result_type(*dtypes)
+    if signed and dtype.kind in 'bu':
+        dtype = np.result_type(dtype, np.int8)
+    if not exact and dtype.kind in 'biu':
+        dtype = np.result_type(dtype, np.float32)
+    return dtype
+
+
+class RescaleCache():
+
+    def __init__(self, max_bytes=256*2**20) -> None:
+        """Least recently used cache of rescaled images, bounded in bytes
+
+        Parameters
+        ----------
+        max_bytes : int, optional
+            Max total size of the cached images in bytes, by default 256 MiB
+        """
+        if not isinstance(max_bytes, int):
+            raise TypeError('The max_bytes is not int type')
+        if max_bytes <= 0:
+            raise ValueError('The max_bytes is not positive')
+
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Look up a rescaled image, marking it as the most recently used
+
+        Parameters
+        ----------
+        key : tuple
+            The cache key
+
+        Returns
+        -------
+        array
+            The cached image, or None if it is not cached
+        """
+        with self.lock:
+            data = self.entries.get(key)
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        """Cache a rescaled image, evicting the least recently used images that no longer fit
+
+        Images larger than the whole cache are not cached.
+
+        Parameters
+        ----------
+        key : tuple
+            The cache key
+        data : array
+            The rescaled image, made read-only
+        """
+        if data.nbytes > self.max_bytes:
+            return
+        data.flags.writeable = False
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key).nbytes
+            self.entries[key] = data
+            self.nbytes += data.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self):
+        """Drop all the cached images and reset the counters"""
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        """Counters of the cache
+
+        Returns
+        -------
+        dict
+            Returns the 'hits', 'misses', 'evictions', number of 'entries', 'nbytes' and 'max_bytes'
+        """
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self.entries), 'nbytes': self.nbytes, 'max_bytes': self.max_bytes}
+
+
+def set_rescale_cache(max_bytes=256*2**20):
+    """Enable, resize or disable the cache of rescaled images used by mosaic
+
+    Parameters
+    ----------
+    max_bytes : int, optional
+        Max total size of the cached images in bytes, by default 256 MiB. None disables the cache.
+
+    Returns
+    -------
+    class
+        Returns the new RescaleCache, or None when the cache is disabled
+
+    Examples
+    --------
+    >>> from satmap import set_rescale_cache
+    >>> cache = set_rescale_cache(512*2**20)
+    >>> cache.stats()['hits']
+    0
+    """
+    global rescale_cache
+    rescale_cache = None if max_bytes is None else RescaleCache(max_bytes)
+    return rescale_cache
+
+
+def content_key(map_in):
+    """Stable key of the image of a map, for the rescale cache
+
+    Maps read from a file are keyed on the file path, modification time and size, so maps
+    whose data is changed in place should set origin to None. Other maps are keyed on a
+    hash of their data.
+
+    Parameters
+    ----------
+    map_in : class
+        The satmap
+
+    Returns
+    -------
+    tuple
+        The content key
+    """
+    if map_in.origin is not None:
+        return ('file',) + tuple(map_in.origin)
+    data = np.ascontiguousarray(map_in.data[:, :])
+    digest = hashlib.blake2b(data.view(np.uint8), digest_size=16).hexdigest()
+    return ('data', digest, data.dtype.str, data.shape)
+
+
+def cached_resample(map_in, resolution, method='bilinear', dtype=None):
+    """Resample the image of a map to a resolution, through the rescale cache when it is enabled
+
+    Parameters
+    ----------
+    map_in : class
+        The satmap
+    resolution : int
+        The target resolution
+    method : str, optional
+        One of RESAMPLE_METHODS, by default 'bilinear'
+    dtype : np.dtype, optional
+        dtype of the result, by default the dtype policy (see set_dtype)
+
+    Returns
+    -------
+    array
+        The resampled image, read-only when it comes from the cache
+    """
+    scale = map_in.meta['resolution']/resolution
+    cache = rescale_cache
+    if cache is None or scale == 1:
+        return resample(map_in.data, scale, method, dtype)
+
+    dtype = result_dtype([map_in.data.dtype], dtype, exact=resample_exact(scale, method))
+    key = rescale_key(map_in, resolution, method, dtype)
+    data = cache.get(key)
+    if data is None:
+        data = np.asarray(resample(map_in.data, scale, method, dtype))
+        cache.put(key, data)
+    return data
+
+
+def rescale_key(map_in, resolution, method, dtype):
+    """Key of the rescaled image of a map in the rescale cache
+
+    Parameters
+    ----------
+    map_in : class
+        The satmap
+    resolution : int
+        The target resolution
+    method : str
+        One of RESAMPLE_METHODS
+    dtype : np.dtype
+        dtype of the rescaled image
+
+    Returns
+    -------
+    tuple
+        The cache key
+    """
+    meta = map_in.meta
+    return (content_key(map_in), tuple(meta['xcoords']), tuple(meta['ycoords']), meta['resolution'], resolution, method, np.dtype(dtype).str)
+
+
+def integer_factor(scale):
+    """Whether a scale factor is an integer upsampling or downsampling factor
+
+    Parameters
+    ----------
+    scale : float
+        Scale factor, the resolution of the data divided by the target resolution
+
+    Returns
+    -------
+    bool
+        True if the scale or its inverse is an integer
+    """
+    if scale >= 1:
+        return round(scale) == scale
+    return math.isclose(round(1/scale)*scale, 1)
+
+
+def resample_exact(scale, method='bilinear'):
+    """Whether resample only gives values of the input, so integer images keep their dtype
+
+    Parameters
+    ----------
+    scale : float
+        Scale factor, the resolution of the data divided by the target resolution
+    method : str, optional
+        One of RESAMPLE_METHODS, by default 'bilinear'
+
+    Returns
+    -------
+    bool
+        True for a factor of 1, 'nearest', and 'max' at integer factors, which is
+        interpolated at other factors
+    """
+    return scale == 1 or method == 'nearest' or (method == 'max' and integer_factor(scale))
+
+
+def resampled_shape(shape, scale, method='bilinear'):
+    """Shape of image data resampled by a scale factor, without resampling it
+
+    Parameters
+    ----------
+    shape : tuple
+        The shape of the image data
+    scale : float
+        Scale factor, the resolution of the data divided by the target resolution
+    method : str, optional
+        One of RESAMPLE_METHODS, by default 'bilinear'
+
+    Returns
+    -------
+    tuple
+        The shape resample returns
+    """
+    if scale == 1:
+        return tuple(shape)
+    factor = round(scale)
+    if scale > 1 and integer_factor(scale) and method != 'bilinear':
+        return (shape[0]*factor, shape[1]*factor)
+    factor = round(1/scale)
+    if scale < 1 and integer_factor(scale) and method != 'bilinear':
+        return tuple(int(n) for n in np.maximum(np.round(np.array(shape)/factor), 1))
+    return tuple(int(n) for n in np.maximum(np.round(scale*np.array(shape)), 1))
+
+
+def mosaic_meta(satmaps, resolution='', blend='last', method='bilinear'):
+    """Meta data of the mosaic of satmaps, computed from their meta data only
+
+    Parameters
+    ----------
+    satmaps : list
+        satmap classes to mosaic
+    resolution : int, optional
+        image resolution, by default '' (the min resolution of the inputs)
+    blend : str, optional
+        How overlapping pixels are composited, one of BLEND_MODES, by default 'last'
+    method : str, optional
+        Resampling method, one of RESAMPLE_METHODS, by default 'bilinear'
+
+    Returns
+    -------
+    dict
+        The meta data of the first map, with the resolution and the bounding box of the mosaic
+
+    Raises
+    ------
+    ValueError
+        No satmap to mosaic
+    ValueError
+        resolution less than 0
+    """
+    # judge type
+    if len(satmaps) == 0:
+        raise ValueError('No satmap to mosaic')
+    for map_in in satmaps:
+        if not isinstance(map_in, satmap):
+            raise TypeError('The input is not of satmap class type')
+
+    if not isinstance(resolution, int) and resolution!='':
+        raise TypeError('The resolution is not int type')
+
+    if blend not in BLEND_MODES:
+        raise ValueError('The blend mode is wrong')
+
+    if method not in RESAMPLE_METHODS:
+        raise ValueError('The resampling method is wrong')
+
+    # use the min resolution of all the inputs by default
+    if resolution == '':
+        resolution = min(map_in.meta['resolution'] for map_in in satmaps)
+    elif resolution<=0:
+        raise ValueError('resolution less than 0')
+
+    # global bounding box from the meta data only
+    bounds = np.array([list(map_in.meta['xcoords']) + list(map_in.meta['ycoords']) for map_in in satmaps])
+    meta = satmaps[0].meta.copy()
+    meta['resolution'] = resolution
+    meta['xcoords'] = [int(bounds[:, 0].min()), int(bounds[:, 1].max())]
+    meta['ycoords'] = [int(bounds[:, 2].min()), int(bounds[:, 3].max())]
+    return meta
+
+
+def mosaic_dtype(satmaps, resolution, blend='last', method='bilinear', dtype=None):
+    """dtype of the mosaic of satmaps, holding every rescaled input
+
+    Parameters
+    ----------
+    satmaps : list
+        satmap classes to mosaic
+    resolution : int
+        image resolution of the mosaic
+    blend : str, optional
+        One of BLEND_MODES, by default 'last'
+    method : str, optional
+        One of RESAMPLE_METHODS, by default 'bilinear'
+    dtype : np.dtype, optional
+        dtype asked for by the caller, by default the dtype policy (see set_dtype)
+
+    Returns
+    -------
+    np.dtype
+        The dtype of the mosaic data
+    """
+    exact = blend != 'mean' and all(resample_exact(map_in.meta['resolution']/resolution, method) for map_in in satmaps)
+    return result_dtype([map_in.data.dtype for map_in in satmaps], dtype, exact=exact)
+
+
+def mosaic_many(satmaps, resolution='', blend='last', method='bilinear', dtype=None, workers=1):
+    """mosaic operation on any number of satmaps in a single pass
+
+    The bounding box of the mosaic is computed from the meta data of all the
+    inputs first, so the output canvas is allocated once and every input is
+    rescaled once and written into place. Where inputs overlap, the later one
+    in the list wins by default, as with chained ``mosaic`` calls.
+
+    Parameters
+    ----------
+    satmaps : list
+        satmap classes to mosaic
+    resolution : int, optional
+        image resolution, by default '' (the min resolution of the inputs)
+    blend : str, optional
+        How overlapping pixels are composited, one of BLEND_MODES, by default 'last'
+    method : str, optional
+        Resampling method, one of RESAMPLE_METHODS, by default 'bilinear'
+    dtype : np.dtype, optional
+        dtype of the mosaic data, by default the dtype policy (see set_dtype)
+    workers : int, optional
+        Number of worker processes, by default 1 (see mosaic_parallel)
+
+    Returns
+    -------
+    class
+        Returns the class that completes the mosaic operation
+
+    Raises
+    ------
+    ValueError
+        No satmap to mosaic
+    ValueError
+        resolution less than 0
+
+    Examples
+    --------
+    >>> from satmap import get_satmap, mosaic_many
+    >>> lir_map1 = get_satmap('aigean_lir_20221205_191610.asdf')
+    >>> lir_map2 = get_satmap('aigean_man_20221205_194510.hdf5')
+    >>> SatMap = mosaic_many([lir_map1, lir_map2])
+    >>> SatMap.meta['xcoords'], SatMap.meta['ycoords']
+    ([500, 1200], [200, 500])
+    """
+    if not isinstance(workers, int):
+        raise TypeError('The workers is not int type')
+    if workers > 1:
+        return mosaic_parallel(satmaps, resolution, blend, method, dtype, workers)
+
+    satmaps = list(satmaps)
+    meta = mosaic_meta(satmaps, resolution, blend, method)
+    resolution = meta['resolution']
+
+    # create the mosaic data once, in a dtype holding every rescaled input
+    dtype = mosaic_dtype(satmaps, resolution, blend, method, dtype)
+    pixel_xy = earth_to_pixel(meta, meta['xcoords'][1], meta['ycoords'][0])
+    data = np.zeros([pixel_xy[0], pixel_xy[1]], dtype=dtype)
+    compositor = Compositor(data, blend)
+
+    # rescale each input once and write it into place
+    for map_in in satmaps:
+        map_data = cached_resample(map_in, resolution, method, dtype)
+        pixel_start, pixel_end = paste_window(meta, map_in.meta, map_data.shape)
+        compositor.add(map_data, pixel_start, pixel_end, meta_timestamp(map_in.meta))
+    data = compositor.finish()
+
+    return type(satmaps[0])(meta, data, data.shape, cal_fov(meta), cal_centre(meta))
+
+
+def mosaic_parallel(satmaps, resolution='', blend='last', method='bilinear', dtype=None, workers=None, band_rows=None):
+    """mosaic operation on worker processes, giving the same pixels as mosaic_many
+
+    The inputs are rescaled in parallel, each on one worker, into memory shared with the
+    workers. Then the mosaic is split into bands of rows, and each worker composites the
+    parts of the rescaled inputs falling in its bands, in the input order, straight into the
+    shared mosaic data. Inputs are rescaled whole, exactly like mosaic_many does, so the result
+    is the same bit for bit. Rescaled images already in the rescale cache are not rescaled again.
+
+    Worker processes are forked, so they share the inputs without copying them. Where fork
+    is not available, or for a single worker, mosaic_many is used instead. Inputs lazily
+    loaded from hdf5 files are read into memory first, and the workers only see those
+    arrays, as hdf5 files opened before a fork can not be read from the forked processes.
+
+    Parameters
+    ----------
+    satmaps : list
+        satmap classes to mosaic
+    resolution : int, optional
+        image resolution, by default '' (the min resolution of the inputs)
+    blend : str, optional
+        How overlapping pixels are composited, one of BLEND_MODES, by default 'last'
+    method : str, optional
+        Resampling method, one of RESAMPLE_METHODS, by default 'bilinear'
+    dtype : np.dtype, optional
+        dtype of the mosaic data, by default the dtype policy (see set_dtype)
+    workers : int, optional
+        Number of worker processes, by default the number of CPUs
+    band_rows : int, optional
+        Number of rows in a band, by default enough for four bands per worker
+
+    Returns
+    -------
+    class
+        Returns the class that completes the mosaic operation
+
+    Examples
+    --------
+    >>> from satmap import get_satmap, mosaic_parallel
+    >>> lir_map1 = get_satmap('aigean_lir_20221205_191610.asdf')
+    >>> lir_map2 = get_satmap('aigean_man_20221205_194510.hdf5')
+    >>> SatMap = mosaic_parallel([lir_map1, lir_map2], resolution=5, workers=4)
+    """
+    global parallel_job
+    satmaps = list(satmaps)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if not isinstance(workers, int):
+        raise TypeError('The workers is not int type')
+    if band_rows is not None and (not isinstance(band_rows, int) or band_rows <= 0):
+        raise ValueError('The band_rows is not a positive int')
+
+    meta = mosaic_meta(satmaps, resolution, blend, method)
+    resolution = meta['resolution']
+    dtype = mosaic_dtype(satmaps, resolution, blend, method, dtype)
+    shape = earth_to_pixel(meta, meta['xcoords'][1], meta['ycoords'][0])
+    if workers <= 1 or shape[0]*shape[1] == 0 or 'fork' not in multiprocessing.get_all_start_methods():
+        return mosaic_many(satmaps, resolution, blend, method, dtype)
+
+    # the input arrays, and the rescaled inputs, shared memory for the ones rescaled by the workers
+    inputs = []
+    rescaled = []
+    tasks = []
+    for index, map_in in enumerate(satmaps):
+        scale = map_in.meta['resolution']/resolution
+        data = map_in.data
+        if isinstance(data, h5py.Dataset):
+            data = data[:, :]
+        inputs.append(data)
+        if scale == 1 and data.dtype == dtype:
+            rescaled.append(data)
+            continue
+        if rescale_cache is not None:
+            cached = rescale_cache.get(rescale_key(map_in, resolution, method, dtype))
+            if cached is not None:
+                rescaled.append(cached)
+                continue
+        rescaled.append(shared_array(resampled_shape(data.shape, scale, method), dtype))
+        tasks.append(index)
+
+    data = shared_array(shape, dtype)
+    windows = [paste_window(meta, map_in.meta, map_data.shape) for map_in, map_data in zip(satmaps, rescaled)]
+    timestamps = [meta_timestamp(map_in.meta) for map_in in satmaps]
+    if band_rows is None:
+        band_rows = max(1, -(-shape[0]//(4*workers)))
+
+    # the forked workers see the job without it being copied to them
+    parallel_job = {'inputs': inputs, 'scales': [map_in.meta['resolution']/resolution for map_in in satmaps],
+                    'rescaled': rescaled, 'data': data, 'windows': windows, 'timestamps': timestamps,
+                    'method': method, 'blend': blend}
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+            for future in [pool.submit(rescale_task, index) for index in tasks]:
+                future.result()
+            bands = [(row, min(row + band_rows, shape[0])) for row in range(0, shape[0], band_rows)]
+            for future in [pool.submit(composite_task, start, stop) for start, stop in bands]:
+                future.result()
+    finally:
+        parallel_job = None
+
+    if rescale_cache is not None:
+        for index in tasks:
+            rescale_cache.put(rescale_key(satmaps[index], resolution, method, dtype), rescaled[index])
+
+    return type(satmaps[0])(meta, data, data.shape, cal_fov(meta), cal_centre(meta))
+
+
+def shared_array(shape, dtype):
+    """Array in anonymous shared memory, shared with the worker processes forked after it is made
+
+    Parameters
+    ----------
+    shape : tuple
+        Shape of the array
+    dtype : np.dtype
+        dtype of the array
+
+    Returns
+    -------
+    np.array
+        The zeroed array
+    """
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape))*dtype.itemsize
+    if size == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.frombuffer(mmap.mmap(-1, size), dtype=dtype).reshape(shape)
+
+
+def rescale_task(index):
+    """Rescale an input of the parallel mosaic into its shared array, run by the workers
+
+    Parameters
+    ----------
+    index : int
+        Index of the input
+    """
+    job = parallel_job
+    out = job['rescaled'][index]
+    # the array read before the fork, never the file of a lazily loaded map
+    data = resample(job['inputs'][index], job['scales'][index], job['method'], out.dtype)
+    out[...] = data
+
+
+def composite_task(start, stop):
+    """Composite the inputs of the parallel mosaic into a band of rows, run by the workers
+
+    Parameters
+    ----------
+    start : int
+        First row of the band
+    stop : int
+        Row after the last row of the band
+    """
+    job = parallel_job
+    compositor = Compositor(job['data'][start:stop], job['blend'])
+    for map_data, (pixel_start, pixel_end), timestamp in zip(job['rescaled'], job['windows'], job['timestamps']):
+        row_start, row_stop = max(pixel_start[0], start), min(pixel_end[0], stop)
+        if row_start >= row_stop:
+            continue
+        window = map_data[row_start - pixel_start[0]:row_stop - pixel_start[0], :]
+        compositor.add(window, (row_start - start, pixel_start[1]), (row_stop - start, pixel_end[1]), timestamp)
+    compositor.finish()
+
+
+def mosaic_to_hdf5(satmaps, filename, resolution='', blend='last', method='bilinear', dtype=None, chunk_size=256, compression='gzip'):
+    """mosaic operation streamed into a chunked hdf5 file, for mosaics too large for memory
+
+    Each input is rescaled and written into its window of the dataset on its own, so only
+    one rescaled input and one row of chunks are in memory at a time, never the whole mosaic.
+    Blend modes other than 'last' keep their buffer in a temporary hdf5 file next to the output.
+    The file has the same layout as the Aigean hdf5 files, a group holding the 'data' dataset
+    with the meta data in its attributes.
+
+    Parameters
+    ----------
+    satmaps : list
+        satmap classes to mosaic
+    filename : str
+        hdf5 file name of the mosaic, ending with '.hdf5', overwritten if it exists
+    resolution : int, optional
+        image resolution, by default '' (the min resolution of the inputs)
+    blend : str, optional
+        How overlapping pixels are composited, one of BLEND_MODES, by default 'last'
+    method : str, optional
+        Resampling method, one of RESAMPLE_METHODS, by default 'bilinear'
+    dtype : np.dtype, optional
+        dtype of the mosaic data, by default the dtype policy (see set_dtype)
+    chunk_size : int, optional
+        Number of pixels along a side of a chunk, by default 256
+    compression : str, optional
+        hdf5 compression filter, by default 'gzip', None for no compression
+
+    Returns
+    -------
+    class
+        Returns the lazily loaded satmap class of the file
+
+    Examples
+    --------
+    >>> from satmap import get_satmap, mosaic_to_hdf5
+    >>> lir_map1 = get_satmap('aigean_lir_20221205_191610.asdf')
+    >>> lir_map2 = get_satmap('aigean_man_20221205_194510.hdf5')
+    >>> with mosaic_to_hdf5([lir_map1, lir_map2], 'mosaic.hdf5', resolution=5) as SatMap:
+    ...     SatMap.visualise(save=True)
+    """
+    if not isinstance(filename, str):
+        raise TypeError('The filename is not str type')
+    if not filename.endswith('.hdf5'):
+        raise ValueError('The filename is not a hdf5 file name')
+    if not isinstance(chunk_size, int):
+        raise TypeError('The chunk_size is not int type')
+    if chunk_size <= 0:
+        raise ValueError('The chunk_size is not positive')
+
+    satmaps = list(satmaps)
+    meta = mosaic_meta(satmaps, resolution, blend, method)
+    resolution = meta['resolution']
+    dtype = mosaic_dtype(satmaps, resolution, blend, method, dtype)
+    shape = earth_to_pixel(meta, meta['xcoords'][1], meta['ycoords'][0])
+    chunks = (min(chunk_size, shape[0]), min(chunk_size, shape[1])) if shape[0] and shape[1] else None
+    if chunks is None:
+        compression = None
+
+    # the chunk cache holds a row of chunks, so a window is not compressed again for every row it crosses
+    cache_bytes = max(chunk_size*shape[1]*dtype.itemsize, 2**20)
+    spec = Compositor.buffer_spec(blend)
+    buffer_name = filename + '.blend.tmp'
+    with h5py.File(filename, 'w', rdcc_nbytes=cache_bytes, rdcc_nslots=10007) as f:
+        group = f.create_group(str(meta['instrument']).lower() or 'mosaic')
+        dataset = group.create_dataset('data', shape=shape, dtype=dtype, chunks=chunks, compression=compression, fillvalue=0)
+        group.attrs.update(meta)
+
+        buffer_file = None
+        try:
+            if spec is not None:
+                buffer_file = h5py.File(buffer_name, 'w', rdcc_nbytes=cache_bytes, rdcc_nslots=10007)
+                buffer = buffer_file.create_dataset('buffer', shape=shape, dtype=spec[0], chunks=chunks, fillvalue=spec[1])
+
+            # rescale each input once and write it into its window
+            for map_in in satmaps:
+                map_data = cached_resample(map_in, resolution, method, dtype)
+                pixel_start, pixel_end = paste_window(meta, map_in.meta, map_data.shape)
+                window = np.s_[pixel_start[0]:pixel_end[0], pixel_start[1]:pixel_end[1]]
+                if spec is None:
+                    dataset[window] = map_data[:, :]
+                    continue
+                compositor = Compositor(dataset[window], blend, buffer[window])
+                compositor.add(map_data, (0, 0), compositor.canvas.shape, meta_timestamp(map_in.meta))
+                dataset[window] = compositor.canvas
+                buffer[window] = compositor.buffer
+
+            # the mean is taken one row of chunks at a time
+            if blend == 'mean':
+                for row in range(0, shape[0], chunks[0]):
+                    band = np.s_[row:row + chunks[0], :]
+                    dataset[band] = Compositor(dataset[band], blend, buffer[band]).finish()
+        finally:
+            if buffer_file is not None:
+                buffer_file.close()
+                os.remove(buffer_name)
+
+    return get_satmap(filename, lazy=True)
+
+
+class TiledMap():
+
+    def __init__(self, meta, tile_size=256, dtype=None, blend='last') -> None:
+        """Sparse raster of fixed-size square tiles, only the tiles written to are allocated
+
+        Mosaics of widely spaced footprints, like Fand strips, keep only the tiles under
+        the footprints in memory instead of a dense canvas of the whole bounding box.
+        The bounding box grows with every map written, and pixels no map is written to are 0.
+
+        Parameters
+        ----------
+        meta : dict
+            Meta data of the raster, its 'resolution' is kept and its 'xcoords' and 'ycoords' grow with the maps written
+        tile_size : int, optional
+            Number of pixels along a side of a tile, by default 256
+        dtype : np.dtype, optional
+            dtype of the tiles, by default the dtype policy (see set_dtype), or float64
+        blend : str, optional
+            How overlapping pixels are composited, one of BLEND_MODES, by default 'last'
+
+        Examples
+        --------
+        >>> from satmap import get_satmap, TiledMap
+        >>> fand_map1 = get_satmap('aigean_fan_20221205_191610.zip')
+        >>> fand_map2 = get_satmap('aigean_fan_20221205_192210.zip')
+        >>> tiled_map = TiledMap.from_satmaps([fand_map1, fand_map2], tile_size=64)
+        >>> tiled_map.allocated_bytes < tiled_map.logical_bytes
+        True
+        """
+        if not isinstance(meta, dict):
+            raise TypeError('The data type of meta is wrong')
+        if not isinstance(tile_size, int):
+            raise TypeError('The tile_size is not int type')
+        if tile_size <= 0:
+            raise ValueError('The tile_size is not positive')
+        if blend not in BLEND_MODES:
+            raise ValueError('The blend mode is wrong')
+
+        self.meta = meta.copy()
+        self.meta['xcoords'] = list(meta['xcoords'])
+        self.meta['ycoords'] = list(meta['ycoords'])
+        self.tile_size = tile_size
+        self.dtype = result_dtype([np.float64], dtype)
+        self.blend = blend
+
+        # tiles by (tile row, tile column), and the compositor writing into each of them
+        self.tiles = {}
+        self.compositors = {}
+
+        # earth coordinates of the upper left corner of the tile grid
+        self.corner = (self.meta['xcoords'][0], self.meta['ycoords'][1])
+
+    @classmethod
+    def from_satmaps(cls, satmaps, resolution='', tile_size=256, blend='last', method='bilinear', dtype=None):
+        """Tiled mosaic of any number of satmaps, the sparse counterpart of mosaic_many
+
+        Parameters
+        ----------
+        satmaps : list
+            satmap classes to mosaic
+        resolution : int, optional
+            image resolution, by default '' (the min resolution of the inputs)
+        tile_size : int, optional
+            Number of pixels along a side of a tile, by default 256
+        blend : str, optional
+            How overlapping pixels are composited, one of BLEND_MODES, by default 'last'
+        method : str, optional
+            Resampling method, one of RESAMPLE_METHODS, by default 'bilinear'
+        dtype : np.dtype, optional
+            dtype of the tiles, by default the dtype policy (see set_dtype)
+
+        Returns
+        -------
+        class
+            Returns the TiledMap of the mosaic
+        """
+        # the tile grid starts at the upper left of the whole bounding box, like the canvas of mosaic_many
+        satmaps = list(satmaps)
+        meta = mosaic_meta(satmaps, resolution, blend, method)
+        tiled_map = cls(meta, tile_size, mosaic_dtype(satmaps, meta['resolution'], blend, method, dtype), blend)
+        for map_in in satmaps:
+            tiled_map.write(map_in, method)
+        return tiled_map
+
+    @property
+    def shape(self):
+        """Logical shape of the raster, as if it was dense"""
+        return earth_to_pixel(self.meta, self.meta['xcoords'][1], self.meta['ycoords'][0])
+
+    @property
+    def fov(self):
+        """Field of View of the raster"""
+        return cal_fov(self.meta)
+
+    @property
+    def centre(self):
+        """Centre point of the raster"""
+        return cal_centre(self.meta)
+
+    @property
+    def allocated_bytes(self):
+        """Bytes of the allocated tiles"""
+        return sum(tile.nbytes for tile in self.tiles.values())
+
+    @property
+    def logical_bytes(self):
+        """Bytes of the raster if it was dense"""
+        shape = self.shape
+        return shape[0]*shape[1]*self.dtype.itemsize
+
+    def offset(self):
+        """Pixel coordinates of the upper left of the bounding box in the tile grid
+
+        Returns
+        -------
+        tuple
+            The row and column of the upper left pixel
+        """
+        resolution = self.meta['resolution']
+        return (int(np.rint((self.corner[1] - self.meta['ycoords'][1])/resolution)),
+                int(np.rint((self.meta['xcoords'][0] - self.corner[0])/resolution)))
+
+    def write(self, map_in, method='bilinear'):
+        """Write a map into the tiles under its footprint, growing the bounding box to it
+
+        Maps are placed on the pixel grid of the tiles, so a map whose edges are off the
+        grid is moved to the nearest pixel.
+
+        Parameters
+        ----------
+        map_in : class
+            The satmap written
+        method : str, optional
+            Resampling method used when the resolution of the map is different, one of RESAMPLE_METHODS, by default 'bilinear'
+        """
+        if not isinstance(map_in, satmap):
+            raise TypeError('The input is not of satmap class type')
+
+        data = cached_resample(map_in, self.meta['resolution'], method, self.dtype)
+        self.meta['xcoords'] = [min(self.meta['xcoords'][0], map_in.meta['xcoords'][0]), max(self.meta['xcoords'][1], map_in.meta['xcoords'][1])]
+        self.meta['ycoords'] = [min(self.meta['ycoords'][0], map_in.meta['ycoords'][0]), max(self.meta['ycoords'][1], map_in.meta['ycoords'][1])]
+
+        # window of the map in the tile grid
+        pixel_start, pixel_end = paste_window(self.meta, map_in.meta, data.shape)
+        pixel_start = pixel_start + self.offset()
+        pixel_end = pixel_end + self.offset()
+        timestamp = meta_timestamp(map_in.meta)
+
+        size = self.tile_size
+        for tile_row in range(pixel_start[0]//size, (pixel_end[0] - 1)//size + 1):
+            for tile_column in range(pixel_start[1]//size, (pixel_end[1] - 1)//size + 1):
+                key = (tile_row, tile_column)
+                if key not in self.tiles:
+                    self.tiles[key] = np.zeros((size, size), dtype=self.dtype)
+                    self.compositors[key] = Compositor(self.tiles[key], self.blend)
+
+                # the part of the window inside the tile
+                start = np.maximum(pixel_start, (tile_row*size, tile_column*size))
+                end = np.minimum(pixel_end, ((tile_row + 1)*size, (tile_column + 1)*size))
+                window = np.s_[start[0] - pixel_start[0]:end[0] - pixel_start[0], start[1] - pixel_start[1]:end[1] - pixel_start[1]]
+                tile_start = start - (tile_row*size, tile_column*size)
+                self.compositors[key].add(data[window], tile_start, tile_start + (end - start), timestamp)
+
+    def tile(self, key):
+        """Pixel values of a tile
+
+        Parameters
+        ----------
+        key : tuple
+            The (tile row, tile column) of the tile
+
+        Returns
+        -------
+        np.array
+            The tile, with the overlapping pixels averaged for 'mean'
+        """
+        tile = self.tiles[key]
+        if self.blend == 'mean':
+            tile = Compositor.write_mean(tile.copy(), self.compositors[key].buffer)
+        return tile
+
+    def tile_windows(self):
+        """Allocated tiles and where they are in the bounding box
+
+        Yields
+        ------
+        tuple
+            The tile key, its window inside the tile, and its window inside the bounding box
+        """
+        size = self.tile_size
+        offset = self.offset()
+        shape = self.shape
+        for tile_row, tile_column in sorted(self.tiles):
+            start = np.maximum((tile_row*size - offset[0], tile_column*size - offset[1]), 0)
+            end = np.minimum(((tile_row + 1)*size - offset[0], (tile_column + 1)*size - offset[1]), shape)
+            if (end <= start).any():
+                continue
+            tile_start = start + offset - (tile_row*size, tile_column*size)
+            tile_end = tile_start + (end - start)
+            yield ((tile_row, tile_column), np.s_[tile_start[0]:tile_end[0], tile_start[1]:tile_end[1]],
+                   np.s_[start[0]:end[0], start[1]:end[1]])
+
+    def densify(self):
+        """Dense satmap of the raster
+
+        Returns
+        -------
+        class
+            Returns the satmap class of the whole bounding box
+        """
+        data = np.zeros(self.shape, dtype=self.dtype)
+        for key, tile_window, window in self.tile_windows():
+            data[window] = self.tile(key)[tile_window]
+        meta = self.meta.copy()
+        return satmap(meta, data, data.shape, cal_fov(meta), cal_centre(meta))
+
+    def __add__(self, another_lirmap):
+        """ + image, into a copy of the raster
+
+        Parameters
+        ----------
+        another_lirmap : class
+            another satmap class with the same resolution
+
+        Returns
+        -------
+        class
+            Returns the new TiledMap
+        """
+        if not isinstance(another_lirmap, satmap):
+            raise TypeError('Input is not satmap class')
+        if self.meta['resolution'] != another_lirmap.meta['resolution']:
+            raise ValueError('The two maps are from different date or from different instrument, can not +')
+        tiled_map = self.copy()
+        tiled_map.write(another_lirmap)
+        return tiled_map
+
+    def __iadd__(self, another_lirmap):
+        """ += image, writing into the tiles of this raster"""
+        if not isinstance(another_lirmap, satmap):
+            raise TypeError('Input is not satmap class')
+        if self.meta['resolution'] != another_lirmap.meta['resolution']:
+            raise ValueError('The two maps are from different date or from different instrument, can not +')
+        self.write(another_lirmap)
+        return self
+
+    def mosaic(self, another_satmap, method='bilinear'):
+        """mosaic operation, into a copy of the raster, rescaling the map to the resolution of the raster
+
+        Parameters
+        ----------
+        another_satmap : class
+            another satmap class
+        method : str, optional
+            Resampling method, one of RESAMPLE_METHODS, by default 'bilinear'
+
+        Returns
+        -------
+        class
+            Returns the new TiledMap
+        """
+        tiled_map = self.copy()
+        tiled_map.write(another_satmap, method)
+        return tiled_map
+
+    def copy(self):
+        """Copy of the raster, with copies of the tiles
+
+        Returns
+        -------
+        class
+            Returns the new TiledMap
+        """
+        tiled_map = type(self)(self.meta, self.tile_size, self.dtype, self.blend)
+        tiled_map.corner = self.corner
+        for key, tile in self.tiles.items():
+            tiled_map.tiles[key] = tile.copy()
+            buffer = self.compositors[key].buffer
+            tiled_map.compositors[key] = Compositor(tiled_map.tiles[key], self.blend, None if buffer is None else buffer.copy())
+        return tiled_map
+
+    def visualise(self, save=False, savepath=''):
+        """Visual operation, drawing the allocated tiles only
+
+        Parameters
+        ----------
+        save : bool, optional
+            Whether to save the image, by default False
+        savepath : str, optional
+            saved path, by default './'
+        """
+        if not isinstance(save, bool):
+            raise TypeError('the input save is not bool type')
+        if not isinstance(savepath, str):
+            raise TypeError('The saved path is not str type')
+
+        tiles = [(self.tile(key)[tile_window], window) for key, tile_window, window in self.tile_windows()]
+        shape = self.shape
+        vmin = min([tile.min() for tile, _ in tiles if tile.size] + [0])
+        vmax = max([tile.max() for tile, _ in tiles if tile.size] + [0])
+
+        # each tile is drawn where its pixels would be in the dense image, the gaps in the colour of 0
+        x0, y0 = self.meta['xcoords'][0], self.meta['ycoords'][0]
+        width = (self.meta['xcoords'][1] - x0)/shape[1]
+        height = (self.meta['ycoords'][1] - y0)/shape[0]
+        axes = plt.gca()
+        for tile, window in tiles:
+            axes.imshow(tile, origin='lower', vmin=vmin, vmax=vmax,
+            extent=[x0 + window[1].start*width, x0 + window[1].stop*width,
+            y0 + window[0].start*height, y0 + window[0].stop*height])
+        axes.set_facecolor(plt.get_cmap()((0 - vmin)/(vmax - vmin) if vmax > vmin else 0))
+        axes.set_xlim(self.meta['xcoords'][0], self.meta['xcoords'][1])
+        axes.set_ylim(self.meta['ycoords'][0], self.meta['ycoords'][1])
+
+        show_or_save(self.meta, save, savepath)
+
+
+def show_or_save(meta, save=False, savepath=''):
+    """Show the current figure, or save it named after the meta data
+
+    Parameters
+    ----------
+    meta : dict
+        Meta data of the image shown
+    save : bool, optional
+        Whether to save the image, by default False
+    savepath : str, optional
+        saved path, by default './'
+    """
+    # save image
+    if save:
+        time = meta['time'].replace(':', '')
+        date = meta['date'].replace('-', '')
+        instrument = meta['instrument'].lower()[:3]
+        save_name = meta['observatory'] +'_'+instrument+'_'+date+'_'+time+'_'+'mosaic'+'.png'
+        full_name = os.path.join(savepath, save_name)
+        plt.savefig(full_name)
+
+    # plot image    
+    else:
+        plt.show()
+
+
+def isoverlap(meta1, meta2):
+    """Determine whether two images overlap
+
+    Parameters
+    ----------
+    meta1 : dict
+        Meta data in a file
+    meta2 : dict
+        Meta data in another file
+
+    Returns
+    -------
+    bool
+        Returns a bool value to determine whether it overlaps
+    """    
+    if meta1['xcoords'][0] >= meta2['xcoords'][1] or meta1['xcoords'][1] <= meta2['xcoords'][0] or meta1['ycoords'][1]<= meta2['ycoords'][0] or meta1['ycoords'][0] >= meta2['ycoords'][1]:
+        return False
+    else:
+        return True
+
+
+def footprint_bounds(footprint):
+    """Earth coordinate bounds of a satmap or a meta dictionary
+
+    Parameters
+    ----------
+    footprint : class or dict
+        satmap class, meta dictionary or query_isa scene dictionary
+
+    Returns
+    -------
+    tuple
+        Returns (x0, x1, y0, y1)
+    """
+    meta = footprint.meta if isinstance(footprint, satmap) else footprint
+    return (meta['xcoords'][0], meta['xcoords'][1], meta['ycoords'][0], meta['ycoords'][1])
+
+
+class FootprintIndex():
+
+    # max number of candidate pairs checked at once by all_overlapping_pairs
+    chunk_pairs = 1 << 22
+
+    def __init__(self, footprints=()) -> None:
+        """Spatial index over the footprints of satmaps
+
+        The bounds are kept in a NumPy array, so queries check every footprint at once
+        and overlapping pairs are found with a vectorized sort and sweep.
+        Overlap follows isoverlap, footprints that only touch do not overlap.
+
+        Parameters
+        ----------
+        footprints : list, optional
+            satmap classes or meta dictionaries to bulk load, by default ()
+
+        Examples
+        --------
+        >>> from satmap import get_satmap, FootprintIndex
+        >>> index = FootprintIndex([get_satmap('aigean_lir_20221205_191610.asdf'), get_satmap('aigean_lir_20221206_181924.asdf')])
+        >>> index.all_overlapping_pairs()
+        array([[0, 1]])
+        """
+        self.bounds = np.zeros((0, 4))
+        self.alive = np.zeros(0, dtype=bool)
+        self.items = []
+        self.extend(footprints)
+
+    def __len__(self):
+        return int(self.alive[:len(self.items)].sum())
+
+    def __getitem__(self, footprint_id):
+        return self.items[footprint_id]
+
+    def reserve(self, size):
+        """Grow the bounds array to hold at least size footprints"""
+        if size > len(self.alive):
+            capacity = max(size, 2*len(self.alive), 16)
+            bounds = np.zeros((capacity, 4))
+            bounds[:len(self.items)] = self.bounds[:len(self.items)]
+            alive = np.zeros(capacity, dtype=bool)
+            alive[:len(self.items)] = self.alive[:len(self.items)]
+            self.bounds, self.alive = bounds, alive
+
+    def extend(self, footprints):
+        """Bulk load footprints
+
+        Parameters
+        ----------
+        footprints : list
+            satmap classes or meta dictionaries
+
+        Returns
+        -------
+        np.array
+            The ids of the footprints
+        """
+        footprints = list(footprints)
+        start = len(self.items)
+        self.reserve(start + len(footprints))
+        if footprints:
+            self.bounds[start:start + len(footprints)] = [footprint_bounds(footprint) for footprint in footprints]
+            self.alive[start:start + len(footprints)] = True
+        self.items.extend(footprints)
+        return np.arange(start, len(self.items))
+
+    def insert(self, footprint):
+        """Insert a footprint
+
+        Parameters
+        ----------
+        footprint : class or dict
+            satmap class or meta dictionary
+
+        Returns
+        -------
+        int
+            The id of the footprint
+        """
+        return int(self.extend([footprint])[0])
+
+    def remove(self, footprint_id):
+        """Remove a footprint
+
+        Parameters
+        ----------
+        footprint_id : int
+            The id returned when the footprint was inserted
+
+        Raises
+        ------
+        KeyError
+            The footprint is not in the index
+        """
+        if not 0 <= footprint_id < len(self.items) or not self.alive[footprint_id]:
+            raise KeyError('The footprint is not in the index')
+        self.alive[footprint_id] = False
+        self.items[footprint_id] = None
+
+    def query(self, bbox):
+        """Find the footprints overlapping a bounding box
+
+        Parameters
+        ----------
+        bbox : tuple
+            Earth coordinates of the bounding box, (x0, x1, y0, y1)
+
+        Returns
+        -------
+        np.array
+            The ids of the overlapping footprints
+        """
+        n = len(self.items)
+        bounds = self.bounds[:n]
+        overlap = self.alive[:n] & (bounds[:, 0] < bbox[1]) & (bounds[:, 1] > bbox[0]) & (bounds[:, 2] < bbox[3]) & (bounds[:, 3] > bbox[2])
+        return np.flatnonzero(overlap)
+
+    def query_points(self, earth_x, earth_y):
+        """Find the footprints covering each point, edges included
+
+        Parameters
+        ----------
+        earth_x : array
+            earth x-coordinates of the points
+        earth_y : array
+            earth y-coordinates of the points
+
+        Returns
+        -------
+        np.array, np.array
+            The point indices and the ids of the footprints covering them, pair by pair
+        """
+        earth_x = np.asarray(earth_x, dtype=float).ravel()
+        earth_y = np.asarray(earth_y, dtype=float).ravel()
+        ids = np.flatnonzero(self.alive[:len(self.items)])
+        bounds = self.bounds[ids]
+        points = [np.zeros(0, dtype=np.intp)]
+        footprints = [np.zeros(0, dtype=np.intp)]
+
+        # check the points in chunks to bound memory
+        step = max(1, self.chunk_pairs // max(len(ids), 1))
+        for start in range(0, len(earth_x), step):
+            x = earth_x[start:start + step, None]
+            y = earth_y[start:start + step, None]
+            cover = (bounds[:, 0] <= x) & (bounds[:, 1] >= x) & (bounds[:, 2] <= y) & (bounds[:, 3] >= y)
+            point_index, footprint_index = np.nonzero(cover)
+            points.append(point_index + start)
+            footprints.append(ids[footprint_index])
+        return np.concatenate(points), np.concatenate(footprints)
+
+    def all_overlapping_pairs(self):
+        """Find every pair of overlapping footprints
+
+        Returns
+        -------
+        np.array
+            (pairs, 2) array of footprint ids, with the smaller id first in each pair, sorted
+        """
+        ids = np.flatnonzero(self.alive[:len(self.items)])
+        bounds = self.bounds[ids]
+        pairs = [np.zeros((0, 2), dtype=np.intp)]
+
+        # sweep along the axis with fewer candidate pairs
+        best = None
+        for axis in (0, 2):
+            order = np.argsort(bounds[:, axis], kind='stable')
+            low = bounds[order, axis]
+            # candidates of i are the footprints after it that start before it ends
+            counts = np.maximum(np.searchsorted(low, bounds[order, axis + 1], side='left') - np.arange(len(ids)) - 1, 0)
+            if best is None or counts.sum() < best[2].sum():
+                best = (axis, order, counts)
+        if best is None:
+            return pairs[0]
+        axis, order, counts = best
+        sorted_bounds = bounds[order]
+        other = 2 - axis
+
+        # expand the candidates in chunks to bound memory
+        ends = np.cumsum(counts)
+        start = 0
+        while start < len(ids):
+            stop = int(np.searchsorted(ends, ends[start] - counts[start] + self.chunk_pairs, side='right'))
+            stop = max(stop, start + 1)
+            chunk_counts = counts[start:stop]
+            first = np.repeat(np.arange(start, stop), chunk_counts)
+            offsets = np.arange(chunk_counts.sum()) - np.repeat(np.cumsum(chunk_counts) - chunk_counts, chunk_counts)
+            second = first + 1 + offsets
+
+            # strict overlap on both axes
+            overlap = (sorted_bounds[second, axis + 1] > sorted_bounds[first, axis]) \
+                & (sorted_bounds[first, other] < sorted_bounds[second, other + 1]) \
+                & (sorted_bounds[second, other] < sorted_bounds[first, other + 1])
+            found = ids[order[np.stack([first[overlap], second[overlap]], axis=1)]]
+            pairs.append(np.sort(found, axis=1))
+            start = stop
+
+        pairs = np.concatenate(pairs)
+        return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+
+
+
+def sample_points(maps, earth_x, earth_y, workers=4):
+    """Sample the image values at earth points across many maps
+
+    A footprint lookup decides which maps cover which points, then each map
+    only reads the pixels it needs. Files are opened lazily, and the maps are
+    sampled in parallel.
+
+    Parameters
+    ----------
+    maps : list
+        satmap classes or file names
+    earth_x : array
+        earth x-coordinates of the points
+    earth_y : array
+        earth y-coordinates of the points
+    workers : int, optional
+        Number of maps sampled at the same time, by default 4
+
+    Returns
+    -------
+    np.array
+        (points, maps) array of the values, NaN where a map does not cover a point
+
+    Raises
+    ------
+    ValueError
+        The earth x and y coordinates have different lengths
+
+    Examples
+    --------
+    >>> from satmap import sample_points
+    >>> sample_points(['aigean_fan_20221205_191610.zip', 'aigean_lir_20221205_191610.asdf'], [100, 600], [470, 300]).shape
+    (2, 2)
+    """
+    maps = list(maps)
+    earth_x = np.asarray(earth_x, dtype=float).ravel()
+    earth_y = np.asarray(earth_y, dtype=float).ravel()
+    if earth_x.shape != earth_y.shape:
+        raise ValueError('The earth x and y coordinates have different lengths')
+    if not isinstance(workers, int) or workers < 1:
+        raise ValueError('The workers should be a positive int')
+
+    # footprint lookup of the points covered by each map
+    footprints = [read_meta(map_in) if isinstance(map_in, str) else map_in.meta for map_in in maps]
+    point_index, map_index = FootprintIndex(footprints).query_points(earth_x, earth_y)
+    order = np.argsort(map_index, kind='stable')
+    point_index, map_index = point_index[order], map_index[order]
+    splits = np.searchsorted(map_index, np.arange(len(maps) + 1))
+
+    values = np.full((len(earth_x), len(maps)), np.nan)
+
+    def sample(index):
+        points = point_index[splits[index]:splits[index + 1]]
+        if len(points) == 0:
+            return
+        if isinstance(maps[index], str):
+            with get_satmap(maps[index], lazy=True) as map_in:
+                values[points, index] = sample_map(map_in, earth_x[points], earth_y[points])
+        else:
+            values[points, index] = sample_map(maps[index], earth_x[points], earth_y[points])
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(sample, range(len(maps))))
+    return values
+
+
+def sample_map(map_in, earth_x, earth_y):
+    """Sample the image values of one map at earth points inside it
+
+    An h5py dataset reads the windows around clusters of nearby points (see sample_dataset),
+    arrays and memory-mapped arrays read the pixels directly.
+
+    Parameters
+    ----------
+    map_in : class
+        satmap class
+    earth_x : array
+        earth x-coordinates of the points
+    earth_y : array
+        earth y-coordinates of the points
+
+    Returns
+    -------
+    np.array
+        The values at the points
+    """
+    # the pixel containing each point, points on the far edges belong to the last pixels
+    transform = map_in.transform
+    pixel_x = np.floor((transform.ycoords[1] - np.asarray(earth_y))/transform.resolution).astype(int)
+    pixel_y = np.floor((np.asarray(earth_x) - transform.xcoords[0])/transform.resolution).astype(int)
+    pixel_x = np.clip(pixel_x, 0, map_in.shape[0] - 1)
+    pixel_y = np.clip(pixel_y, 0, map_in.shape[1] - 1)
+    if isinstance(map_in.data, h5py.Dataset):
+        return sample_dataset(map_in.data, pixel_x, pixel_y)
+    return map_in.data[pixel_x, pixel_y]
+
+def sample_dataset(dataset, pixel_x, pixel_y):
+    """Read the pixels of an h5py dataset, one window per cluster of nearby pixels
+
+    Pixels are clustered by the chunks of the dataset, or by SAMPLE_TILE sized tiles for
+    contiguous datasets, and each cluster reads the window around its pixels. When the windows
+    cover at least half of the window around all the pixels, that one window is read instead.
+
+    Parameters
+    ----------
+    dataset : h5py.Dataset
+        The image dataset
+    pixel_x : np.array
+        pixel x-coordinates (rows)
+    pixel_y : np.array
+        pixel y-coordinates (columns)
+
+    Returns
+    -------
+    np.array
+        The values of the pixels
+    """
+    values = np.empty(len(pixel_x), dtype=dataset.dtype)
+    if len(pixel_x) == 0:
+        return values
+    tile = dataset.chunks or (SAMPLE_TILE, SAMPLE_TILE)
+
+    # the bounds of the pixels of each tile
+    tiles = np.stack([pixel_x//tile[0], pixel_y//tile[1]], axis=1)
+    _, cluster = np.unique(tiles, axis=0, return_inverse=True)
+    cluster = cluster.ravel()
+    count = cluster.max() + 1
+    x0 = np.full(count, pixel_x.max())
+    y0 = np.full(count, pixel_y.max())
+    x1 = np.zeros(count, dtype=pixel_x.dtype)
+    y1 = np.zeros(count, dtype=pixel_y.dtype)
+    np.minimum.at(x0, cluster, pixel_x)
+    np.minimum.at(y0, cluster, pixel_y)
+    np.maximum.at(x1, cluster, pixel_x)
+    np.maximum.at(y1, cluster, pixel_y)
+
+    # dense pixels, one read of the whole window
+    area = int(np.sum((x1 - x0 + 1)*(y1 - y0 + 1)))
+    bounding = (pixel_x.max() - pixel_x.min() + 1)*(pixel_y.max() - pixel_y.min() + 1)
+    if 2*area >= bounding:
+        bx, by = pixel_x.min(), pixel_y.min()
+        window = dataset[bx:pixel_x.max() + 1, by:pixel_y.max() + 1]
+        return window[pixel_x - bx, pixel_y - by]
+
+    for index in range(count):
+        points = np.flatnonzero(cluster == index)
+        window = dataset[x0[index]:x1[index] + 1, y0[index]:y1[index] + 1]
+        values[points] = window[pixel_x[points] - x0[index], pixel_y[points] - y0[index]]
+    return values
+
+def get_satmap(filename, lazy=False, bbox=None, cache_dir=None, dtype=None):
+    """read different files
+
+    Parameters
+    ----------
+    filename : str
+        input file name
+    lazy : bool, optional
+        Whether to keep the file open and only read the pixels that are used, by default False.
+        The data is an h5py dataset for hdf5 files and a memory-mapped array for asdf and zip files.
+        Close the map, or use it as a context manager, to close the file.
+    bbox : tuple, optional
+        Earth coordinates of a bounding box, (x0, x1, y0, y1), by default None.
+        Only the pixels inside the bounding box are read from the file, and the map is cropped to it.
+    cache_dir : str, optional
+        Directory of the decoded image cache, by default the AIGEAN_CACHE_DIR environment variable,
+        or no cache if it is not set. The first load of a file stores the decoded image there and
+        later loads memory-map it. Lazily loaded maps do not use the cache.
+    dtype : np.dtype, optional
+        dtype the image is cast to, by default the dtype policy (see set_dtype).
+        Lazily loaded maps keep the dtype of the file.
+
+    Returns
+    -------
+    class
+        Return satmap class, including meta, data, shape, fov, centre
+    """    
+    if not isinstance(lazy, bool):
+        raise TypeError('The lazy is not bool type')
+    if cache_dir is None:
+        cache_dir = os.environ.get(CACHE_DIR_ENV) or None
+    if dtype is None:
+        dtype = default_dtype
+
+    # read the window through a lazily opened file, or through the cache
+    if bbox is not None:
+        if lazy:
+            raise ValueError('A bbox can not be read lazily')
+        with get_satmap(filename, lazy=cache_dir is None, cache_dir=cache_dir, dtype=dtype) as full_map:
+            SatMap = full_map.crop(bbox)
+            if not SatMap.data.flags.owndata or (dtype is not None and SatMap.data.dtype != dtype):
+                SatMap.data = np.array(SatMap.data, dtype=dtype)
+        return SatMap
+
+    source = None
+    if lazy:
+        if 'hdf5' in filename:
+            meta, data, source = open_hdf5(filename)
+        elif 'asdf' in filename:
+            meta, data, source = open_asdf(filename)
+        elif 'zip' in filename:
+            meta, data, source = open_zip(filename)
+        else:
+            raise ValueError('The input file type is wrong')
+    elif cache_dir is not None:
+        meta, data = read_cached(filename, cache_dir)
+    else:
+        meta, data = read_file(filename)
+
+    if dtype is not None and not lazy:
+        data = data.astype(dtype, copy=False)
+
+    shape = data.shape
+    fov = cal_fov(meta)
+    centre = cal_centre(meta)
+    SatMap = satmap(meta, data, shape, fov, centre)    
+    SatMap.lazy = lazy
+    SatMap.source = source
+    stat = os.stat(filename)
+    SatMap.origin = (os.path.abspath(filename), stat.st_mtime_ns, stat.st_size)
+    return SatMap
+
+
+def read_file(filename):
+    """Read the meta data and the whole image of a file
+
+    Parameters
+    ----------
+    filename : str
+        input file name
+
+    Returns
+    -------
+    tuple
+        Returns the meta dictionary and the image array
+    """
+    if 'hdf5' in filename:
+        return read_hdf5(filename)
+    elif 'asdf' in filename:
+        return read_asdf(filename)
+    elif 'zip' in filename:
+        return read_zip(filename)
+    raise ValueError('The input file type is wrong')
+
+
+def cache_path(filename, cache_dir):
+    """Path of the cache entry of a file, without the extension
+
+    The entry name is a hash of the absolute path, size and modification time of the file,
+    so a changed file gets a new entry.
+
+    Parameters
+    ----------
+    filename : str
+        input file name
+    cache_dir : str
+        Directory of the decoded image cache
+
+    Returns
+    -------
+    str
+        The path of the entry, '.npy' holds the image and '.json' the meta data
+    """
+    stat = os.stat(filename)
+    key = '{}\0{}\0{}'.format(os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+    name = os.path.basename(filename) + '.' + hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+    return os.path.join(cache_dir, name)
+
+
+def read_cached(filename, cache_dir):
+    """Read a file through the decoded image cache
+
+    The image of a cached file is memory-mapped copy-on-write, so the map can still be changed
+    without changing the cache. Files that are not cached yet are decoded and stored, and the
+    least recently used entries are evicted once the cache is larger than its limit.
+
+    Parameters
+    ----------
+    filename : str
+        input file name
+    cache_dir : str
+        Directory of the decoded image cache
+
+    Returns
+    -------
+    tuple
+        Returns the meta dictionary and the image array
+    """
+    path = cache_path(filename, cache_dir)
+    try:
+        with open(path + '.json') as meta_file:
+            meta = json.load(meta_file)
+        data = np.load(path + '.npy', mmap_mode='c')
+    except (OSError, ValueError):
+        # not cached yet, or evicted or partly written by another process
+        meta, data = read_file(filename)
+        write_cached(path, meta, data)
+        evict_cache(cache_dir)
+        return meta, data
+
+    # the modification time of the image orders the entries for eviction
+    os.utime(path + '.npy')
+    meta['xcoords'] = tuple(meta['xcoords'])
+    meta['ycoords'] = tuple(meta['ycoords'])
+    return meta, data
+
+
+def write_cached(path, meta, data):
+    """Store a cache entry, replacing the files atomically so readers never see a partial entry
+
+    Parameters
+    ----------
+    path : str
+        The path of the entry, without the extension
+    meta : dict
+        The meta dictionary
+    data : array
+        The image array
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+    with open(temporary, 'wb') as data_file:
+        np.save(data_file, np.ascontiguousarray(data))
+    os.replace(temporary, path + '.npy')
+    with open(temporary, 'w') as meta_file:
+        json.dump(meta, meta_file, default=lambda value: value.item())
+    os.replace(temporary, path + '.json')
+
+
+def evict_cache(cache_dir, max_bytes=None):
+    """Remove the least recently used entries until the cache fits in its limit
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory of the decoded image cache
+    max_bytes : int, optional
+        Max size of the cache in bytes, by default the AIGEAN_CACHE_MAX_BYTES environment variable,
+        or CACHE_MAX_BYTES if it is not set
+
+    Returns
+    -------
+    int
+        The number of entries removed
+    """
+    if max_bytes is None:
+        max_bytes = int(os.environ.get(CACHE_MAX_BYTES_ENV, CACHE_MAX_BYTES))
+
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.npy'):
+            path = os.path.join(cache_dir, name[:-4])
+            try:
+                stat = os.stat(path + '.npy')
+            except OSError:
+                continue
+            size = stat.st_size
+            if os.path.exists(path + '.json'):
+                size += os.path.getsize(path + '.json')
+            entries.append((stat.st_mtime_ns, path, size))
+
+    total = sum(size for _, _, size in entries)
+    removed = 0
+    for _, path, size in sorted(entries):
+        if total <= max_bytes:
+            break
+        for extension in ('.npy', '.json'):
+            try:
+                os.remove(path + extension)
+            except FileNotFoundError:
+                pass
+        total -= size
+        removed += 1
+    return removed
+
+
+def read_meta(filename):
+    """read only the meta data of different files, without the image data
+
+    Parameters
+    ----------
+    filename : str
+        input file name
+
+    Returns
+    -------
+    dict
+        Return meta dictionary data
+
+    Examples
+    --------
+    >>> from satmap import read_meta
+    >>> read_meta('aigean_fan_20221205_191610.zip')
+    {'instrument': 'Fand', 'observatory': 'Aigean', 'resolution': 5, 'time': '19:16:10', 'date': '2022-12-05', 'xcoords': (75, 300), 'ycoords': (450, 500), 'archive': 'ISA'}
+    """
+    if 'hdf5' in filename:
+        with h5py.File(filename, 'r') as f:
+            meta = process_meta(f[list(f.keys())[0]].attrs)
+
+    elif 'asdf' in filename:
+        # the data block is only read when it is accessed
+        with asdf.open(filename, lazy_load=True) as af:
+            meta = process_meta(af)
+
+    elif 'zip' in filename:
+        with ZipFile(filename, 'r') as zfile:
+            meta_info, _ = zip_members(zfile)
+            meta = process_meta(json.loads(zfile.read(meta_info)))
+    else:
+        raise ValueError('The input file type is wrong')
+    return meta
+
+
+def iter_load_many(filenames, workers=4, executor='thread', max_in_flight=None, loader=get_satmap):
+    """Load many files in parallel, yielding them as they finish
+
+    Parameters
+    ----------
+    filenames : list
+        input file names
+    workers : int, optional
+        Number of files loaded at the same time, by default 4
+    executor : str, optional
+        'thread' or 'process', by default 'thread'. Decoding hdf5, zip and asdf spends most
+        of its time in C code that releases the GIL, so threads are usually enough.
+    max_in_flight : int, optional
+        Max number of files being loaded or waiting to be consumed, by default 2*workers.
+        This caps the memory held by results that were not consumed yet.
+    loader : function, optional
+        Function reading one file, by default get_satmap. Use read_meta to only read the meta data.
+
+    Yields
+    ------
+    int, str, object, Exception
+        The index and name of the file, and either the loaded result or the error raised while loading it (the other is None)
+
+    Raises
+    ------
+    ValueError
+        The executor is not 'thread' or 'process'
+    ValueError
+        The workers or max_in_flight is less than 1
+    """
+    # check the arguments before any pool is started
+    if executor not in ('thread', 'process'):
+        raise ValueError("The executor is not 'thread' or 'process'")
+    if workers < 1:
+        raise ValueError('The workers should be at least 1')
+    if max_in_flight is None:
+        max_in_flight = 2*workers
+    if max_in_flight < 1:
+        raise ValueError('The max_in_flight should be at least 1')
+
+    if executor == 'thread':
+        pool = ThreadPoolExecutor(max_workers=workers)
+    else:
+        pool = ProcessPoolExecutor(max_workers=workers)
+
+    filenames = list(filenames)
+    with pool:
+        pending = {}
+        next_index = 0
+        while next_index < len(filenames) or pending:
+            # keep at most max_in_flight files loading
+            while next_index < len(filenames) and len(pending) < max_in_flight:
+                pending[pool.submit(loader, filenames[next_index])] = next_index
+                next_index += 1
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                error = future.exception()
+                result = None if error is not None else future.result()
+                yield index, filenames[index], result, error
+
+
+def load_many(filenames, workers=4, executor='thread', max_in_flight=None, loader=get_satmap):
+    """Load many files in parallel
+
+    Parameters
+    ----------
+    filenames : list
+        input file names
+    workers : int, optional
+        Number of files loaded at the same time, by default 4
+    executor : str, optional
+        'thread' or 'process', by default 'thread'
+    max_in_flight : int, optional
+        Max number of files being loaded at the same time, by default 2*workers
+    loader : function, optional
+        Function reading one file, by default get_satmap. Use read_meta to only read the meta data.
+
+    Returns
+    -------
+    list, dict
+        Returns the loaded results in the input order (None for files that failed),
+        and the errors raised while loading, by file name
+
+    Examples
+    --------
+    >>> from satmap import load_many
+    >>> satmaps, errors = load_many(['aigean_fan_20221205_191610.zip', 'aigean_lir_20221205_191610.asdf'])
+    >>> errors
+    {}
+    """
+    filenames = list(filenames)
+    results = [None] * len(filenames)
+    errors = {}
+    for index, filename, result, error in iter_load_many(filenames, workers, executor, max_in_flight, loader):
+        if error is not None:
+            errors[filename] = error
+        else:
+            results[index] = result
+    return results, errors
+
+def process_meta(meta_file):
+    """read meta from different files
+
+    Parameters
+    ----------
+    meta_file : dict
+        Dictionary file containing meta data
+
+    Returns
+    -------
+    dict
+        Return meta dictionary data
+    """    
+    meta_list = ['instrument','observatory','resolution','time','date','xcoords','ycoords', 'archive']
+    meta = {}
+    for key in meta_list:
+        try:
+            meta[key] = meta_file[key]
+        except:
+            meta[key] = ''
+        if 'coords' in key:
+            meta[key] = tuple(map(int,meta[key]))
+    return meta
+
+
+def read_hdf5(filename):
+    """read hdf5 file
+
+    Parameters
+    ----------
+    filename : str
+        file name
+
+    Returns
+    -------
+    dict, np.array 
+        Returns the read image data and meta dictionary
+    """    
+    meta, data, f = open_hdf5(filename)
+    data = np.array(data)
+    f.close()
+    return meta, data
+
+
+def open_hdf5(filename):
+    """open hdf5 file without reading the image data
+
+    Parameters
+    ----------
+    filename : str
+        file name
+
+    Returns
+    -------
+    dict, h5py.Dataset, h5py.File
+        Returns the meta dictionary, the image dataset and the opened file
+    """
+    f = h5py.File(filename, 'r')
+    group = f[list(f.keys())[0]]
+    meta = process_meta(group.attrs)
+    return meta, group['data'], f
+
+
+def read_asdf(filename):
+    """read asdf file
+
+    Parameters
+    ----------
+    filename : str
+        file name
+
+    Returns
+    -------
+    dict, np.array 
         Returns the read image data and meta dictionary
     """    
     af = asdf.open(filename)
@@ -590,9 +3036,31 @@ def read_asdf(filename):
     return meta, data
 
 
+def open_asdf(filename):
+    """open asdf file with the image data memory-mapped
+
+    Parameters
+    ----------
+    filename : str
+        file name
+
+    Returns
+    -------
+    dict, np.array, asdf.AsdfFile
+        Returns the meta dictionary, the memory-mapped image data and the opened file
+    """
+    af = asdf.open(filename, memmap=True)
+    meta = process_meta(af)
+    data = np.asarray(af['data'])
+    return meta, data, af
+
+
 def read_zip(filename):
     """read zip file
 
+    The npy image data is streamed, and decompressed if needed, straight into its array,
+    so no other copy of the image is held in memory.
+
     Parameters
     ----------
     filename : str
@@ -603,12 +3071,159 @@ def read_zip(filename):
     dict, np.array 
         Returns the read image data and meta dictionary
     """     
-    zfile = ZipFile(filename, 'r')
-    jsonf = json.load(BytesIO(zfile.read(zfile.namelist()[0])))
-    meta = process_meta(jsonf)
-    data = np.load(BytesIO(zfile.read(zfile.namelist()[1])))
+    with ZipFile(filename, 'r') as zfile:
+        meta_info, data_info = zip_members(zfile)
+        meta = process_meta(json.loads(zfile.read(meta_info)))
+        with zfile.open(data_info) as stream:
+            data = read_npy_stream(stream)
     return meta, data
 
+
+def open_zip(filename):
+    """open zip file with the npy image data memory-mapped
+
+    Only members stored without compression can be memory-mapped,
+    compressed members are streamed into memory.
+
+    Parameters
+    ----------
+    filename : str
+        file name
+
+    Returns
+    -------
+    dict, np.array, mmap.mmap
+        Returns the meta dictionary, the memory-mapped image data and the mapping of the file
+        (None for compressed members)
+    """
+    with ZipFile(filename, 'r') as zfile:
+        meta_info, data_info = zip_members(zfile)
+        meta = process_meta(json.loads(zfile.read(meta_info)))
+        if data_info.compress_type != 0:
+            with zfile.open(data_info) as stream:
+                data = read_npy_stream(stream)
+            return meta, data, None
+
+    data, mapping = zip_memmap(filename, data_info)
+    return meta, data, mapping
+
+
+def zip_members(zfile):
+    """Find the json meta data and npy image data members of a zip file
+
+    Members are found by their extensions, falling back to the order of the archive
+    (meta data first) for members named otherwise.
+
+    Parameters
+    ----------
+    zfile : zipfile.ZipFile
+        The opened zip file
+
+    Returns
+    -------
+    zipfile.ZipInfo, zipfile.ZipInfo
+        Returns the meta data member and the image data member
+    """
+    members = zfile.infolist()
+    meta_info = next((info for info in members if info.filename.endswith('.json')), None)
+    data_info = next((info for info in members if info.filename.endswith('.npy')), None)
+    if meta_info is None:
+        meta_info = members[0]
+    if data_info is None:
+        data_info = members[1]
+    return meta_info, data_info
+
+
+def read_npy_header(f):
+    """Read the header of npy data
+
+    Parameters
+    ----------
+    f : file
+        File object positioned at the start of the npy data
+
+    Returns
+    -------
+    tuple, bool, np.dtype
+        Returns the shape, whether the data is in fortran order and the dtype
+    """
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        return np.lib.format.read_array_header_1_0(f)
+    return np.lib.format.read_array_header_2_0(f)
+
+
+def read_npy_stream(stream, chunk_size=2**22):
+    """Read npy data from a stream straight into a preallocated array
+
+    Parameters
+    ----------
+    stream : file
+        Readable stream of npy data, like an opened zip member
+    chunk_size : int, optional
+        Number of bytes read at a time, by default 4 MiB
+
+    Returns
+    -------
+    np.array
+        The image data
+
+    Raises
+    ------
+    ValueError
+        The npy data holds python objects, or is shorter than its header says
+    """
+    shape, fortran_order, dtype = read_npy_header(stream)
+    if dtype.hasobject:
+        raise ValueError('The npy data holds python objects')
+
+    data = np.empty(shape, dtype=dtype, order='F' if fortran_order else 'C')
+    # the transpose of a fortran ordered array is C contiguous, with the same bytes
+    buffer = (data.T if fortran_order else data).reshape(-1).view(np.uint8)
+    position = 0
+    while position < buffer.size:
+        chunk = stream.read(min(chunk_size, buffer.size - position))
+        if not chunk:
+            raise ValueError('The npy data is shorter than its header')
+        buffer[position:position + len(chunk)] = np.frombuffer(chunk, dtype=np.uint8)
+        position += len(chunk)
+    return data
+
+
+def zip_memmap(filename, info):
+    """Memory-map a npy member stored without compression in a zip file
+
+    Parameters
+    ----------
+    filename : str
+        file name of the zip file
+    info : zipfile.ZipInfo
+        The zip member holding the npy data
+
+    Returns
+    -------
+    np.memmap, mmap.mmap
+        The memory-mapped image data, and the mapping of the file, whose close releases it
+    """
+    with open(filename, 'rb') as f:
+        # skip the local file header to the start of the npy data
+        f.seek(info.header_offset)
+        local_header = f.read(30)
+        name_length, extra_length = struct.unpack('<HH', local_header[26:30])
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+
+        shape, fortran_order, dtype = read_npy_header(f)
+        offset = f.tell()
+
+        # the mapping keeps its own handle of the file
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    # the array exports the mapping, so it can not be unmapped under the array
+    order = 'F' if fortran_order else 'C'
+    count = int(np.prod(shape))
+    data = np.frombuffer(mapping, dtype=dtype, count=count, offset=offset).reshape(shape, order=order)
+    return data.view(np.memmap), mapping
+
 def cal_fov(meta):
     """Calculate the field of view of an image
 
@@ -0,0 +1,130 @@
+import pytest
+from aigeanpy.catalog import Catalog
+from aigeanpy.testing import write_file, make_satmap
+import os
+
+query_result = [{'date': '2022-12-05',
+    'filename': 'aigean_lir_20221205_191610.asdf',
+    'instrument': 'lir',
+    'resolution': 30,
+    'time': '19:16:10',
+    'xcoords': [500.0, 1100.0],
+    'ycoords': [200.0, 500.0]},
+    {'date': '2022-12-05',
+    'filename': 'aigean_lir_20221205_194510.asdf',
+    'instrument': 'lir',
+    'resolution': 30,
+    'time': '19:45:10',
+    'xcoords': [800.0, 1400.0],
+    'ycoords': [100.0, 400.0]}]
+
+def test_refresh(tmp_path):
+    write_file(tmp_path / 'aigean_fan_20221205_191610.zip', make_satmap((75, 300), (450, 500), 5, instrument='Fand'))
+    write_file(tmp_path / 'aigean_fan_20221205_192210.zip', make_satmap((300, 525), (50, 100), 5, instrument='Fand', time='19:22:10'))
+    with Catalog() as catalog:
+        report = catalog.refresh(str(tmp_path))
+        assert report['added'] == 2 and len(catalog) == 2
+        # nothing changed, so nothing is read again
+        report = catalog.refresh(str(tmp_path))
+        assert report['unchanged'] == 2 and report['added'] == 0
+
+def test_refresh_changed(tmp_path):
+    filename = tmp_path / 'aigean_fan_20221205_191610.zip'
+    write_file(filename, make_satmap((75, 300), (450, 500), 5, instrument='Fand'))
+    write_file(tmp_path / 'aigean_fan_20221205_192210.zip', make_satmap((300, 525), (50, 100), 5, instrument='Fand', time='19:22:10'))
+    with Catalog() as catalog:
+        catalog.refresh(str(tmp_path))
+        write_file(filename, make_satmap((100, 325), (450, 500), 5, instrument='Fand'))
+        os.utime(filename, (1, 1))
+        os.remove(tmp_path / 'aigean_fan_20221205_192210.zip')
+        report = catalog.refresh(str(tmp_path))
+        assert report['updated'] == 1 and report['removed'] == 1
+        assert catalog.query()[0]['xcoords'] == [100, 325]
+
+def test_refresh_same_name(tmp_path):
+    # files with the same name in different directories are different scenes
+    os.makedirs(tmp_path / 'a' / 'b')
+    write_file(tmp_path / 'a' / 'aigean_fan_20221205_191610.zip', make_satmap((75, 300), (450, 500), 5, instrument='Fand'))
+    write_file(tmp_path / 'a' / 'b' / 'aigean_fan_20221205_191610.zip', make_satmap((300, 525), (50, 100), 5, instrument='Fand'))
+    other = tmp_path / 'other'
+    os.makedirs(other)
+    write_file(other / 'aigean_fan_20221205_191610.zip', make_satmap((100, 325), (450, 500), 5, instrument='Fand'))
+    with Catalog() as catalog:
+        assert catalog.refresh(str(tmp_path / 'a'))['added'] == 2 and len(catalog) == 2
+        report = catalog.refresh(str(tmp_path / 'a'))
+        assert report['unchanged'] == 2 and report['added'] == 0
+        # refreshing another tree leaves the scenes of the first one where they are
+        assert catalog.refresh(str(other))['added'] == 1 and len(catalog) == 3
+        assert sorted(scene['path'] for scene in catalog.query()) == sorted([str(tmp_path / 'a' / 'aigean_fan_20221205_191610.zip'),
+            str(tmp_path / 'a' / 'b' / 'aigean_fan_20221205_191610.zip'), str(other / 'aigean_fan_20221205_191610.zip')])
+
+def test_refresh_case(tmp_path):
+    # directories whose names only differ by case are different directories
+    os.makedirs(tmp_path / 'a')
+    os.makedirs(tmp_path / 'A')
+    write_file(tmp_path / 'a' / 'aigean_fan_20221205_191610.zip', make_satmap((75, 300), (450, 500), 5, instrument='Fand'))
+    write_file(tmp_path / 'A' / 'aigean_fan_20221205_191610.zip', make_satmap((300, 525), (50, 100), 5, instrument='Fand'))
+    with Catalog() as catalog:
+        catalog.refresh(str(tmp_path / 'A'))
+        report = catalog.refresh(str(tmp_path / 'a'))
+        assert report['added'] == 1 and report['removed'] == 0 and len(catalog) == 2
+
+def test_refresh_vanished(tmp_path, monkeypatch):
+    write_file(tmp_path / 'aigean_fan_20221205_191610.zip', make_satmap((75, 300), (450, 500), 5, instrument='Fand'))
+    write_file(tmp_path / 'aigean_fan_20221205_192210.zip', make_satmap((300, 525), (50, 100), 5, instrument='Fand'))
+    vanished = str(tmp_path / 'aigean_fan_20221205_192210.zip')
+    stat = os.stat
+    def stat_vanished(path, *args, **kwargs):
+        # the file is removed between the walk and its stat
+        if str(path) == vanished:
+            raise FileNotFoundError(path)
+        return stat(path, *args, **kwargs)
+    monkeypatch.setattr(os, 'stat', stat_vanished)
+    with Catalog() as catalog:
+        report = catalog.refresh(str(tmp_path))
+        assert report['added'] == 1 and report['failed'] == [vanished]
+
+def test_refresh_failed(tmp_path):
+    (tmp_path / 'aigean_fan_20221205_191610.zip').write_text('not a zip file')
+    with Catalog() as catalog:
+        report = catalog.refresh(str(tmp_path))
+        assert len(report['failed']) == 1 and len(catalog) == 0
+
+def test_refresh_directory():
+    with pytest.raises(ValueError):
+        Catalog().refresh('directory_not_exists')
+#The directory does not exist, so it should raise ValueError
+
+def test_query(tmp_path):
+    write_file(tmp_path / 'aigean_fan_20221205_191610.zip', make_satmap((75, 300), (450, 500), 5, instrument='Fand'))
+    write_file(tmp_path / 'aigean_fan_20221206_192210.zip', make_satmap((300, 525), (50, 100), 5, instrument='Fand', date='2022-12-06'))
+    with Catalog(str(tmp_path / 'catalog.sqlite')) as catalog:
+        catalog.refresh(str(tmp_path))
+        assert [scene['filename'] for scene in catalog.query(bbox=(250, 350, 0, 460))] == ['aigean_fan_20221205_191610.zip', 'aigean_fan_20221206_192210.zip']
+        assert [scene['filename'] for scene in catalog.query(start='2022-12-06')] == ['aigean_fan_20221206_192210.zip']
+        assert catalog.query(bbox=(300, 310, 0, 460), stop='2022-12-05') == []
+        assert len(catalog.query(instrument='Fand')) == 2
+        assert catalog.query(instrument='lir') == []
+
+def test_ingest_query():
+    with Catalog() as catalog:
+        assert catalog.ingest_query(query_result) == 2
+        scenes = catalog.query(bbox=(1100, 1200, 100, 150), instrument='lir')
+        assert [scene['filename'] for scene in scenes] == ['aigean_lir_20221205_194510.asdf']
+        assert scenes[0]['path'] is None
+
+def test_ingest_query_type():
+    with pytest.raises(TypeError):
+        Catalog().ingest_query(query_result[0])
+#The query result is a dict, not a list, so it should raise TypeError
+
+def test_ingest_query_local(tmp_path):
+    write_file(tmp_path / 'aigean_lir_20221205_191610.asdf', make_satmap((500, 1100), (200, 500), 30))
+    with Catalog() as catalog:
+        catalog.ingest_query(query_result)
+        # the remote scene becomes local once its file is indexed
+        catalog.refresh(str(tmp_path))
+        assert len(catalog) == 2
+        catalog.ingest_query(query_result)
+        assert len(catalog) == 2
+        assert [scene['path'] is None for scene in catalog.query()] == [False, True]
@@ -1,6 +1,8 @@
 import pytest
-from aigeanpy.net import query_isa, judge_legal_date, time_sub, download_isa
+from aigeanpy.net import query_isa, judge_legal_date, time_sub, download_isa, ArchiveClient, get_client, set_client, download_many, file_checksum, set_query_cache, query_key, QueryCache
 import os
+import hashlib
+import datetime
 import requests
 import responses
 
@@ -86,3 +88,276 @@ def test_download_isa():
     download_isa('aigean_fan_20221208_170852.zip',save_dir='./')
     os.path.exists('aigean_fan_20221208_170852.zip')
 
+
+@responses.activate
+def test_archive_client_query():
+    responses.add(responses.GET, 'http://archive.test/isa-archive/query/?&start_date=2022-12-05&stop_date=2022-12-05&instrument=lir',
+        json=[{'filename': 'aigean_lir_20221205_191610.asdf'}])
+    with ArchiveClient('http://archive.test/isa-archive', connect_timeout=3, read_timeout=30) as client:
+        assert client.query('2022-12-05', '2022-12-05', 'Lir') == [{'filename': 'aigean_lir_20221205_191610.asdf'}]
+        assert client.query('2022-12-05', '2022-12-05', 'Lir') == [{'filename': 'aigean_lir_20221205_191610.asdf'}]
+    # both requests went through the same session, with the timeouts of the client
+    assert len(responses.calls) == 2
+    assert responses.calls[0].request.req_kwargs['timeout'] == (3, 30)
+
+@responses.activate
+def test_archive_client_download(tmp_path):
+    responses.add(responses.GET, 'http://archive.test/isa-archive/download/?filename=aigean_fan_20221205_191610.zip', body=b'zip data')
+    client = ArchiveClient('http://archive.test/isa-archive/')
+    previous = set_client(client)
+    try:
+        # download_isa goes through the client that is set
+        assert get_client() is client
+        download_isa('aigean_fan_20221205_191610.zip', save_dir=str(tmp_path) + '/')
+        assert (tmp_path / 'aigean_fan_20221205_191610.zip').read_bytes() == b'zip data'
+    finally:
+        set_client(previous)
+
+@responses.activate
+def test_archive_client_missing():
+    responses.add(responses.GET, 'http://archive.test/isa-archive/download/?filename=aigean_fan_20221205_191610.zip', status=404)
+    with pytest.raises(ValueError):
+        ArchiveClient('http://archive.test/isa-archive').download('aigean_fan_20221205_191610.zip')
+#The file does not exist on the archive, so it should raise ValueError
+
+@responses.activate
+def test_archive_client_connection():
+    responses.add(responses.GET, 'http://archive.test/isa-archive/query/?&start_date=2022-12-05&stop_date=2022-12-05',
+        body=requests.ConnectionError())
+    with pytest.raises(ConnectionError):
+        ArchiveClient('http://archive.test/isa-archive').query('2022-12-05', '2022-12-05')
+#The archive can not be reached, so it should raise ConnectionError
+
+def test_set_client_type():
+    with pytest.raises(TypeError):
+        set_client('http://archive.test/isa-archive')
+#The client is a str, not an ArchiveClient, so it should raise TypeError
+
+@responses.activate
+def test_download_many(tmp_path):
+    url = 'http://archive.test/isa-archive/download/?filename='
+    responses.add(responses.GET, url + 'aigean_fan_20221205_191610.zip', body=b'first')
+    # the second file fails once on the server side, then is downloaded
+    responses.add(responses.GET, url + 'aigean_fan_20221205_192210.zip', status=503)
+    responses.add(responses.GET, url + 'aigean_fan_20221205_192210.zip', body=b'second')
+    responses.add(responses.GET, url + 'aigean_fan_20221205_192810.zip', status=404)
+    filenames = ['aigean_fan_20221205_191610.zip', 'aigean_fan_20221205_192210.zip', 'aigean_fan_20221205_192810.zip']
+    progress = []
+    with ArchiveClient('http://archive.test/isa-archive') as client:
+        report = download_many(filenames, save_dir=str(tmp_path) + '/', max_workers=3, backoff=0,
+                               progress=lambda *args: progress.append(args), client=client)
+    assert list(report) == filenames
+    assert (tmp_path / filenames[0]).read_bytes() == b'first' and report[filenames[0]]['attempts'] == 1
+    assert (tmp_path / filenames[1]).read_bytes() == b'second' and report[filenames[1]]['attempts'] == 2
+    # a missing file is not tried again
+    assert isinstance(report[filenames[2]]['error'], ValueError) and report[filenames[2]]['attempts'] == 1
+    assert report[filenames[2]]['path'] is None
+    assert sorted(done for _, done, _ in progress) == [1, 2, 3]
+
+@responses.activate
+def test_download_many_retries(tmp_path):
+    responses.add(responses.GET, 'http://archive.test/isa-archive/download/?filename=aigean_fan_20221205_191610.zip',
+        body=requests.ConnectionError())
+    with ArchiveClient('http://archive.test/isa-archive') as client:
+        report = download_many(['aigean_fan_20221205_191610.zip'], save_dir=str(tmp_path) + '/', retries=2, backoff=0, client=client)
+    assert report['aigean_fan_20221205_191610.zip']['attempts'] == 3
+    assert isinstance(report['aigean_fan_20221205_191610.zip']['error'], requests.ConnectionError)
+
+def test_download_many_workers():
+    with pytest.raises(ValueError):
+        download_many(['aigean_fan_20221205_191610.zip'], max_workers=0)
+#The max workers is 0, so it should raise ValueError
+
+def archive_file(content, etag, start_shift=0):
+    # answer Range requests like the archive, only when If-Range matches the ETag of the file
+    def answer(request):
+        headers = {'ETag': etag}
+        if 'Range' in request.headers and request.headers.get('If-Range') == etag:
+            start = int(request.headers['Range'][6:-1]) + start_shift
+            headers['Content-Range'] = 'bytes ' + str(start) + '-' + str(len(content) - 1) + '/' + str(len(content))
+            return 206, headers, content[start:]
+        return 200, headers, content
+    return answer
+
+@responses.activate
+def test_download_resume(tmp_path):
+    content = b'0123456789' * 100
+    responses.add_callback(responses.GET, 'http://archive.test/isa-archive/download/?filename=aigean_fan_20221205_191610.zip',
+        callback=archive_file(content, '"v1"'))
+    # an interrupted download left the first 300 bytes, and the ETag of the file
+    (tmp_path / 'aigean_fan_20221205_191610.zip.part').write_bytes(content[:300])
+    (tmp_path / 'aigean_fan_20221205_191610.zip.part.validator').write_text('"v1"')
+    with ArchiveClient('http://archive.test/isa-archive') as client:
+        client.download('aigean_fan_20221205_191610.zip', save_dir=str(tmp_path) + '/', chunk_size=64)
+    assert responses.calls[0].request.headers['Range'] == 'bytes=300-'
+    assert responses.calls[0].request.headers['If-Range'] == '"v1"'
+    assert (tmp_path / 'aigean_fan_20221205_191610.zip').read_bytes() == content
+    assert os.listdir(tmp_path) == ['aigean_fan_20221205_191610.zip']
+
+@responses.activate
+def test_download_resume_changed(tmp_path):
+    content = b'abcdefghij' * 100
+    responses.add_callback(responses.GET, 'http://archive.test/isa-archive/download/?filename=aigean_fan_20221205_191610.zip',
+        callback=archive_file(content, '"v2"'))
+    # the part was written from an older version of the file
+    (tmp_path / 'aigean_fan_20221205_191610.zip.part').write_bytes(b'0123456789' * 30)
+    (tmp_path / 'aigean_fan_20221205_191610.zip.part.validator').write_text('"v1"')
+    with ArchiveClient('http://archive.test/isa-archive') as client:
+        client.download('aigean_fan_20221205_191610.zip', save_dir=str(tmp_path) + '/')
+    assert (tmp_path / 'aigean_fan_20221205_191610.zip').read_bytes() == content
+
+@responses.activate
+def test_download_resume_wrong_range(tmp_path):
+    content = b'0123456789' * 100
+    responses.add_callback(responses.GET, 'http://archive.test/isa-archive/download/?filename=aigean_fan_20221205_191610.zip',
+        callback=archive_file(content, '"v1"', start_shift=10))
+    (tmp_path / 'aigean_fan_20221205_191610.zip.part').write_bytes(content[:300])
+    (tmp_path / 'aigean_fan_20221205_191610.zip.part.validator').write_text('"v1"')
+    with ArchiveClient('http://archive.test/isa-archive') as client:
+        client.download('aigean_fan_20221205_191610.zip', save_dir=str(tmp_path) + '/')
+    # the part does not carry on where the part file stops, the file is downloaded again
+    assert len(responses.calls) == 2 and 'Range' not in responses.calls[1].request.headers
+    assert (tmp_path / 'aigean_fan_20221205_191610.zip').read_bytes() == content
+
+@responses.activate
+def test_download_no_range(tmp_path):
+    # the archive ignores the Range and sends the whole file again
+    responses.add(responses.GET, 'http://archive.test/isa-archive/download/?filename=aigean_fan_20221205_191610.zip', body=b'whole file')
+    (tmp_path / 'aigean_fan_20221205_191610.zip.part').write_bytes(b'whole')
+    with ArchiveClient('http://archive.test/isa-archive') as client:
+        client.download('aigean_fan_20221205_191610.zip', save_dir=str(tmp_path) + '/')
+    assert (tmp_path / 'aigean_fan_20221205_191610.zip').read_bytes() == b'whole file'
+
+@responses.activate
+def test_download_failed(tmp_path):
+    responses.add(responses.GET, 'http://archive.test/isa-archive/download/?filename=aigean_fan_20221205_191610.zip', status=404)
+    (tmp_path / 'aigean_fan_20221205_191610.zip').write_bytes(b'old file')
+    with pytest.raises(ValueError):
+        ArchiveClient('http://archive.test/isa-archive').download('aigean_fan_20221205_191610.zip', save_dir=str(tmp_path) + '/')
+    # the file already there is left as it was
+    assert (tmp_path / 'aigean_fan_20221205_191610.zip').read_bytes() == b'old file'
+
+@responses.activate
+def test_download_skip_existing(tmp_path):
+    url = 'http://archive.test/isa-archive/download/?filename=aigean_fan_20221205_191610.zip'
+    responses.add(responses.HEAD, url, headers={'Content-Length': '10'})
+    responses.add(responses.GET, url, body=b'new file!!')
+    (tmp_path / 'aigean_fan_20221205_191610.zip').write_bytes(b'old file!!')
+    with ArchiveClient('http://archive.test/isa-archive') as client:
+        # same size, only the HEAD request is made
+        assert client.download('aigean_fan_20221205_191610.zip', save_dir=str(tmp_path) + '/', skip_existing=True) is False
+        assert [call.request.method for call in responses.calls] == ['HEAD']
+        # same size but not the same checksum, the file is downloaded again
+        checksum = hashlib.sha256(b'new file!!').hexdigest()
+        assert client.download('aigean_fan_20221205_191610.zip', save_dir=str(tmp_path) + '/', skip_existing=True, checksum=checksum) is True
+    assert (tmp_path / 'aigean_fan_20221205_191610.zip').read_bytes() == b'new file!!'
+    assert file_checksum(str(tmp_path / 'aigean_fan_20221205_191610.zip')) == checksum
+
+@responses.activate
+def test_download_many_skip_existing(tmp_path):
+    url = 'http://archive.test/isa-archive/download/?filename='
+    responses.add(responses.HEAD, url + 'aigean_fan_20221205_191610.zip', headers={'Content-Length': '5'})
+    responses.add(responses.HEAD, url + 'aigean_fan_20221205_192210.zip', headers={'Content-Length': '6'})
+    responses.add(responses.GET, url + 'aigean_fan_20221205_192210.zip', body=b'second')
+    (tmp_path / 'aigean_fan_20221205_191610.zip').write_bytes(b'first')
+    with ArchiveClient('http://archive.test/isa-archive') as client:
+        report = download_many(['aigean_fan_20221205_191610.zip', 'aigean_fan_20221205_192210.zip'],
+                               save_dir=str(tmp_path) + '/', skip_existing=True, client=client)
+    assert report['aigean_fan_20221205_191610.zip']['skipped'] is True
+    assert report['aigean_fan_20221205_192210.zip']['skipped'] is False
+    assert (tmp_path / 'aigean_fan_20221205_192210.zip').read_bytes() == b'second'
+
+@responses.activate
+def test_download_checksum(tmp_path):
+    responses.add(responses.GET, 'http://archive.test/isa-archive/download/?filename=aigean_fan_20221205_191610.zip', body=b'corrupted')
+    with pytest.raises(ValueError):
+        ArchiveClient('http://archive.test/isa-archive').download('aigean_fan_20221205_191610.zip', save_dir=str(tmp_path) + '/',
+                                                                  checksum=hashlib.sha256(b'file').hexdigest())
+#The checksum of the downloaded file does not match, so it should raise ValueError
+
+@responses.activate
+def test_query_cache(tmp_path):
+    responses.add(responses.GET, 'http://archive.test/isa-archive/query/?&start_date=2022-12-05&stop_date=2022-12-05&instrument=fand',
+        json=[{'filename': 'aigean_fan_20221205_191610.zip'}])
+    previous = set_client(ArchiveClient('http://archive.test/isa-archive'))
+    cache = set_query_cache(cache_dir=str(tmp_path))
+    try:
+        assert query_isa('2022-12-05', '2022-12-05', 'Fand') == [{'filename': 'aigean_fan_20221205_191610.zip'}]
+        # the same query with another spelling is answered by the cache
+        assert query_isa('2022-12-5', '2022-12-05', 'fand') == [{'filename': 'aigean_fan_20221205_191610.zip'}]
+        assert len(responses.calls) == 1
+        assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+        # bypassing the cache asks the archive again
+        query_isa('2022-12-05', '2022-12-05', 'Fand', use_cache=False)
+        assert len(responses.calls) == 2
+        # another process finds the results on disk
+        assert QueryCache(str(tmp_path)).get(('2022-12-05', '2022-12-05', 'fand')) == [{'filename': 'aigean_fan_20221205_191610.zip'}]
+    finally:
+        set_query_cache(False)
+        get_client().close()
+        set_client(previous)
+
+@responses.activate
+def test_query_cache_today(tmp_path, monkeypatch):
+    import aigeanpy.net
+    responses.add(responses.GET, 'http://archive.test/isa-archive/query/?&start_date=2022-12-05&stop_date=2022-12-05&instrument=fand',
+        json=[{'filename': 'aigean_fan_20221205_191610.zip'}])
+    responses.add(responses.GET, 'http://archive.test/isa-archive/query/?&start_date=2022-12-06&stop_date=2022-12-06&instrument=fand',
+        json=[{'filename': 'aigean_fan_20221206_191610.zip'}])
+    previous = set_client(ArchiveClient('http://archive.test/isa-archive'))
+    cache = set_query_cache(cache_dir=str(tmp_path), past_ttl=3600, today_ttl=0)
+    try:
+        monkeypatch.setattr(aigeanpy.net, 'today_date', lambda: '2022-12-05')
+        assert query_isa(instrument='Fand') == [{'filename': 'aigean_fan_20221205_191610.zip'}]
+        # the day changes while the process runs, the default dates follow it
+        monkeypatch.setattr(aigeanpy.net, 'today_date', lambda: '2022-12-06')
+        assert query_isa(instrument='Fand') == [{'filename': 'aigean_fan_20221206_191610.zip'}]
+        assert query_isa(instrument='Fand') == [{'filename': 'aigean_fan_20221206_191610.zip'}]
+        # the dates are sent even when they are today, and today's results are not kept
+        assert len(responses.calls) == 3
+        assert all('start_date=' in call.request.url and 'stop_date=' in call.request.url for call in responses.calls)
+        # yesterday is now in the past, its results are fetched once more and then kept
+        assert cache.ttl(query_key('2022-12-05', '2022-12-05', 'fand')) == 3600
+        query_isa('2022-12-05', '2022-12-05', 'Fand')
+        query_isa('2022-12-05', '2022-12-05', 'Fand')
+        assert len(responses.calls) == 4
+    finally:
+        set_query_cache(False)
+        get_client().close()
+        set_client(previous)
+
+def test_query_cache_path(tmp_path):
+    cache = QueryCache(str(tmp_path / 'queries'))
+    # the instrument does not reach the file name
+    key = query_key('2022-12-05', '2022-12-05', '../../escape')
+    cache.put(key, [])
+    assert os.listdir(tmp_path) == ['queries']
+    assert os.path.dirname(cache.path(key)) == str(tmp_path / 'queries')
+    assert QueryCache(str(tmp_path / 'queries')).get(key) == []
+
+def test_query_cache_ttl():
+    cache = QueryCache(past_ttl=3600, today_ttl=0)
+    today = str(datetime.date.today())
+    # the past does not change, today does
+    assert cache.ttl(query_key('2022-12-05', '2022-12-05', '')) == 3600
+    assert cache.ttl(query_key(today, today, '')) == 0
+    cache.put(query_key(today, today, ''), [])
+    assert cache.get(query_key(today, today, '')) is None
+
+def test_query_key():
+    assert query_key('2023-1-13', '2023-01-13', 'ECNE') == ('2023-01-13', '2023-01-13', 'ecne')
+    assert query_key('12-05-2022', '2022-12-05', 'Fand') is None
+
+@responses.activate
+def test_download_resume_size(tmp_path):
+    content = b'0123456789' * 100
+    def answer(request):
+        # the archive says the file is larger than what it sends
+        return 206, {'ETag': '"v1"', 'Content-Range': 'bytes 300-1999/2000'}, content[300:]
+    responses.add_callback(responses.GET, 'http://archive.test/isa-archive/download/?filename=aigean_fan_20221205_191610.zip', callback=answer)
+    (tmp_path / 'aigean_fan_20221205_191610.zip.part').write_bytes(content[:300])
+    (tmp_path / 'aigean_fan_20221205_191610.zip.part.validator').write_text('"v1"')
+    with pytest.raises(requests.ConnectionError):
+        ArchiveClient('http://archive.test/isa-archive').download('aigean_fan_20221205_191610.zip', save_dir=str(tmp_path) + '/')
+    assert os.listdir(tmp_path) == []
+#The downloaded file is shorter than the file on the archive, so it should raise ConnectionError and drop the part
@@ -1,8 +1,16 @@
 import pytest
-from  aigeanpy.satmap import get_satmap, satmap, pixel_to_earth, earth_to_pixel, isoverlap, read_zip, read_asdf, read_hdf5, cal_fov, cal_centre
+from  aigeanpy.satmap import get_satmap, satmap, pixel_to_earth, earth_to_pixel, isoverlap, read_zip, read_asdf, read_hdf5, cal_fov, cal_centre, mosaic_many, read_meta, FootprintIndex, GeoTransform, sample_points, load_many, iter_load_many, BLEND_MODES, largest_valid_window, resample, RESAMPLE_METHODS, set_rescale_cache, RescaleCache, evict_cache, set_dtype, get_dtype, TiledMap, mosaic_to_hdf5, mosaic_parallel, sample_dataset
 import numpy as np
 import os
+import sys
+import json
+import io
+import zipfile
+import h5py
+import asdf
+from skimage.transform import rescale
 from aigeanpy.net import  download_isa
+from aigeanpy.testing import make_satmap, write_file
 
 download_isa('aigean_lir_20221205_191610.asdf')
 download_isa('aigean_fan_20221208_170852.zip')
@@ -249,3 +257,655 @@ def test_cal_centre():
 # def test_net_connect():
 #     with pytest.raises(ConnectionError):
 #         net.query_isa()
+
+
+def test_mosaic_many():
+    maps = []
+    for xcoords, ycoords, resolution, value in [((0, 60), (0, 60), 30, 1), ((30, 90), (0, 30), 15, 2), ((15, 45), (30, 60), 15, 3)]:
+        meta = {'instrument': 'Lir', 'observatory': 'Aigean', 'resolution': resolution, 'time': '19:16:10',
+                'date': '2022-12-05', 'xcoords': xcoords, 'ycoords': ycoords, 'archive': 'ISA'}
+        data = np.full(((ycoords[1]-ycoords[0])//resolution, (xcoords[1]-xcoords[0])//resolution), float(value))
+        maps.append(satmap(meta, data, data.shape, cal_fov(meta), cal_centre(meta)))
+    SatMap = mosaic_many(maps)
+    assert SatMap.meta['xcoords'] == [0, 90] and SatMap.meta['ycoords'] == [0, 60]
+    assert SatMap.meta['resolution'] == 15
+    # the later maps are pasted over the earlier ones, the pixels no map covers are 0
+    assert np.array_equal(SatMap.data, [[1, 3, 3, 1, 0, 0],
+                                        [1, 3, 3, 1, 0, 0],
+                                        [1, 1, 2, 2, 2, 2],
+                                        [1, 1, 2, 2, 2, 2]])
+
+def test_mosaic_many_resolution():
+    map1 = make_satmap((500, 1100), (200, 500), 30, seed=1)
+    map2 = make_satmap((750, 1200), (250, 400), 15, seed=2, instrument='Manannan')
+    SatMap = mosaic_many([map1, map2], resolution=30)
+    assert SatMap.shape == (10, 23)
+
+def test_mosaic_many_empty():
+    with pytest.raises(ValueError):
+        mosaic_many([])
+#There is no satmap to mosaic, so it should raise ValueError
+
+def test_mosaic_many_type():
+    with pytest.raises(TypeError):
+        mosaic_many([make_satmap((500, 1100), (200, 500), 30), 7])
+#The second input is an integer, not the satmap class, so it should raise TypeError
+
+@pytest.mark.parametrize('extension', ['hdf5', 'asdf', 'zip'])
+def test_get_satmap_lazy(tmp_path, extension):
+    map_in = make_satmap((750, 1200), (250, 400), 15, instrument='Manannan')
+    filename = write_file(tmp_path / ('aigean_man_20221205_194510.' + extension), map_in)
+    with get_satmap(filename, lazy=True) as lazy_map:
+        assert lazy_map.lazy
+        assert lazy_map.meta == get_satmap(filename).meta
+        assert lazy_map.shape == map_in.shape
+        assert np.array_equal(lazy_map.data[2:5, 3:9], map_in.data[2:5, 3:9])
+        assert np.array_equal((lazy_map + lazy_map).data, (map_in + map_in).data)
+    assert lazy_map.source is None
+
+def test_get_satmap_lazy_zip_close(tmp_path):
+    map_in = make_satmap((750, 1200), (250, 400), 15, instrument='Manannan')
+    filename = write_file(tmp_path / 'aigean_man_20221205_194510.zip', map_in)
+    with get_satmap(filename, lazy=True) as lazy_map:
+        mapping = lazy_map.source
+        assert mapping is not None and not mapping.closed
+    # closing the map unmaps the file
+    assert mapping.closed and lazy_map.source is None
+    # a crop still viewing the mapping keeps it until the crop is freed
+    lazy_map = get_satmap(filename, lazy=True)
+    crop = lazy_map.crop((795, 1005, 265, 325))
+    lazy_map.close()
+    assert np.array_equal(crop.data, map_in.crop((795, 1005, 265, 325)).data)
+
+def test_get_satmap_lazy_type():
+    with pytest.raises(TypeError):
+        get_satmap('aigean_man_20221205_194510.hdf5', lazy='yes')
+#The lazy 'yes' is not bool type, so it should raise TypeError
+
+@pytest.mark.parametrize('extension', ['hdf5', 'asdf', 'zip'])
+def test_get_satmap_bbox(tmp_path, extension):
+    map_in = make_satmap((750, 1200), (250, 400), 15, instrument='Manannan')
+    filename = write_file(tmp_path / ('aigean_man_20221205_194510.' + extension), map_in)
+    SatMap = get_satmap(filename, bbox=(795, 1005, 265, 325))
+    assert SatMap.meta['xcoords'] == (795, 1005) and SatMap.meta['ycoords'] == (265, 325)
+    assert SatMap.shape == (4, 14)
+    assert np.array_equal(SatMap.data, map_in.data[5:9, 3:17])
+
+def test_get_satmap_bbox_non_overlap(tmp_path):
+    filename = write_file(tmp_path / 'aigean_man_20221205_194510.hdf5', make_satmap((750, 1200), (250, 400), 15))
+    with pytest.raises(ValueError):
+        get_satmap(filename, bbox=(0, 100, 0, 100))
+#The bbox is outside of the map, so it should raise ValueError
+
+def test_crop():
+    map_in = make_satmap((75, 300), (450, 500), 5, instrument='Fand')
+    SatMap = map_in.crop((100, 200, 450, 480))
+    assert SatMap.meta['xcoords'] == (100, 200) and SatMap.meta['ycoords'] == (450, 480)
+    assert np.array_equal(SatMap.data, map_in.data[4:10, 5:25])
+
+@pytest.mark.parametrize('extension', ['hdf5', 'asdf', 'zip'])
+def test_read_meta(tmp_path, extension):
+    map_in = make_satmap((750, 1200), (250, 400), 15, instrument='Manannan')
+    filename = write_file(tmp_path / ('aigean_man_20221205_194510.' + extension), map_in)
+    assert read_meta(filename) == get_satmap(filename).meta
+    assert read_meta(filename)['xcoords'] == (750, 1200)
+
+def test_read_meta_file_type():
+    with pytest.raises(ValueError):
+        read_meta('aigean_lir_20221205_191610.txt')
+#The file 'txt' doesn't belong to Aigean file, so it should raise ValueError
+
+def test_footprint_index_pairs():
+    rng = np.random.default_rng(0)
+    metas = [{'xcoords': (int(x), int(x)+225), 'ycoords': (int(y), int(y)+50)} for x, y in zip(rng.integers(0, 1125, 200), rng.integers(0, 450, 200))]
+    index = FootprintIndex(metas)
+    answer = [(i, j) for i in range(200) for j in range(i+1, 200) if isoverlap(metas[i], metas[j])]
+    assert [tuple(pair) for pair in index.all_overlapping_pairs()] == answer
+    # the same pairs when the candidates are checked in small chunks
+    index.chunk_pairs = 5
+    assert [tuple(pair) for pair in index.all_overlapping_pairs()] == answer
+
+def test_footprint_index_query():
+    map1 = make_satmap((75, 300), (450, 500), 5, instrument='Fand')
+    map2 = make_satmap((300, 525), (50, 100), 5, instrument='Fand')
+    index = FootprintIndex([map1, map2])
+    assert list(index.query((200, 400, 400, 480))) == [0]
+    assert list(index.query((0, 1000, 0, 1000))) == [0, 1]
+    assert len(index.all_overlapping_pairs()) == 0
+
+def test_footprint_index_insert_remove():
+    index = FootprintIndex()
+    first = index.insert({'xcoords': (0, 100), 'ycoords': (0, 100)})
+    second = index.insert({'xcoords': (50, 150), 'ycoords': (50, 150)})
+    assert index.all_overlapping_pairs().tolist() == [[first, second]]
+    index.remove(first)
+    assert len(index) == 1 and len(index.all_overlapping_pairs()) == 0
+    with pytest.raises(KeyError):
+        index.remove(first)
+#The footprint was already removed, so it should raise KeyError
+
+def test_geotransform_to_pixel():
+    transform = GeoTransform((75, 300), (450, 500), 5)
+    pixel_x, pixel_y = transform.to_pixel(np.array([100, 120, 300]), np.array([470, 490, 450]))
+    assert list(pixel_x) == [6, 2, 10] and list(pixel_y) == [5, 9, 45]
+    meta = {'xcoords': (75, 300), 'ycoords': (450, 500), 'resolution': 5}
+    assert earth_to_pixel(meta, 100, 470) == (pixel_x[0], pixel_y[0])
+
+def test_geotransform_clip():
+    transform = GeoTransform((75, 300), (450, 500), 5)
+    pixel_x, pixel_y = transform.to_pixel([0, 1000], [470, 100], clip=True)
+    assert list(pixel_x) == [6, 10] and list(pixel_y) == [0, 45]
+    with pytest.raises(ValueError):
+        transform.to_pixel([0, 1000], [470, 100])
+#The earth coordinates are out of range without clip, so it should raise ValueError
+
+def test_geotransform_to_earth():
+    map_in = make_satmap((75, 300), (450, 500), 5, instrument='Fand')
+    earth_x, earth_y = map_in.transform.to_earth(*map_in.transform.to_pixel([100, 120], [470, 490]))
+    assert list(earth_x) == [100, 120] and list(earth_y) == [470, 490]
+    assert map_in.transform is map_in.transform
+
+def test_sample_points(tmp_path):
+    map1 = make_satmap((750, 1200), (250, 400), 15, instrument='Manannan')
+    map2 = make_satmap((75, 300), (450, 500), 5, instrument='Fand')
+    filename1 = write_file(tmp_path / 'aigean_man_20221205_194510.hdf5', map1)
+    filename2 = write_file(tmp_path / 'aigean_fan_20221205_191610.zip', map2)
+    earth_x = [800, 100, 0]
+    earth_y = [300, 470, 0]
+    values = sample_points([filename1, filename2], earth_x, earth_y)
+    assert values.shape == (3, 2)
+    # the values of the pixels containing the points
+    assert values[0, 0] == map1.data[6, 3]
+    assert values[1, 1] == map2.data[6, 5]
+    assert np.isnan(values[0, 1]) and np.isnan(values[1, 0]) and np.isnan(values[2]).all()
+    assert np.array_equal(values, sample_points([map1, map2], earth_x, earth_y, workers=1), equal_nan=True)
+
+def test_sample_points_pixel():
+    meta = {'instrument': 'Lir', 'observatory': 'Aigean', 'resolution': 5, 'time': '19:16:10',
+            'date': '2022-12-05', 'xcoords': (0, 50), 'ycoords': (0, 50), 'archive': 'ISA'}
+    data = np.arange(100.0).reshape(10, 10)
+    map_in = satmap(meta, data, data.shape, cal_fov(meta), cal_centre(meta))
+    # points off the grid are in the pixel containing them, points on the far edges in the last pixels
+    values = sample_points([map_in], [3.0, 47.0, 50.0, 0.0], [47.0, 3.0, 0.0, 50.0])
+    assert np.array_equal(values[:, 0], [0.0, 99.0, 99.0, 0.0])
+
+def test_sample_dataset(tmp_path):
+    data = np.arange(1000*1000.0).reshape(1000, 1000)
+    with h5py.File(str(tmp_path / 'data.hdf5'), 'w') as f:
+        dataset = f.create_dataset('data', data=data)
+        reads = []
+        class Recorder():
+            # the dataset, recording the windows read from it
+            chunks = dataset.chunks
+            dtype = dataset.dtype
+            def __getitem__(self, key):
+                reads.append(key)
+                return dataset[key]
+        # scattered points only read the windows around them
+        pixel_x = np.array([0, 3, 998, 999, 500])
+        pixel_y = np.array([0, 2, 999, 1, 500])
+        assert np.array_equal(sample_dataset(Recorder(), pixel_x, pixel_y), data[pixel_x, pixel_y])
+        assert sum((key[0].stop - key[0].start)*(key[1].stop - key[1].start) for key in reads) < 100
+        # dense points read the window around them once
+        reads.clear()
+        pixel_x, pixel_y = np.meshgrid(np.arange(10, 200, 2), np.arange(30, 90, 3), indexing='ij')
+        assert np.array_equal(sample_dataset(Recorder(), pixel_x.ravel(), pixel_y.ravel()), data[pixel_x.ravel(), pixel_y.ravel()])
+        assert len(reads) == 1
+
+def test_sample_points_length():
+    with pytest.raises(ValueError):
+        sample_points([make_satmap((75, 300), (450, 500), 5)], [100, 200], [470])
+#There are 2 earth x-coordinates but 1 earth y-coordinate, so it should raise ValueError
+
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_load_many(tmp_path, executor):
+    map1 = make_satmap((750, 1200), (250, 400), 15, instrument='Manannan')
+    map2 = make_satmap((75, 300), (450, 500), 5, instrument='Fand')
+    filenames = [write_file(tmp_path / 'aigean_man_20221205_194510.hdf5', map1),
+                 str(tmp_path / 'aigean_lir_20221205_191610.asdf'),
+                 write_file(tmp_path / 'aigean_fan_20221205_191610.zip', map2)]
+    satmaps, errors = load_many(filenames, workers=2, executor=executor)
+    assert np.array_equal(satmaps[0].data, map1.data) and np.array_equal(satmaps[2].data, map2.data)
+    assert satmaps[1] is None and list(errors) == [filenames[1]]
+
+def test_iter_load_many(tmp_path):
+    filenames = [write_file(tmp_path / ('aigean_fan_20221205_19161' + str(i) + '.zip'), make_satmap((75, 300), (450, 500), 5, seed=i)) for i in range(5)]
+    results = list(iter_load_many(filenames, workers=2, max_in_flight=1, loader=read_meta))
+    assert sorted(index for index, _, _, _ in results) == list(range(5))
+    assert all(error is None and meta['xcoords'] == (75, 300) for _, _, meta, error in results)
+
+def test_load_many_executor():
+    with pytest.raises(ValueError):
+        load_many(['aigean_fan_20221205_191610.zip'], executor='gpu')
+#The executor 'gpu' is not 'thread' or 'process', so it should raise ValueError
+
+@pytest.mark.parametrize('workers, max_in_flight', [(0, None), (2, 0)])
+def test_iter_load_many_workers(monkeypatch, workers, max_in_flight):
+    # no pool is started for arguments that are wrong
+    monkeypatch.setattr(sys.modules['aigeanpy.satmap'], 'ThreadPoolExecutor', None)
+    with pytest.raises(ValueError):
+        next(iter_load_many(['aigean_fan_20221205_191610.zip'], workers=workers, max_in_flight=max_in_flight))
+#The workers or max_in_flight is 0, so it should raise ValueError
+
+@pytest.mark.parametrize('blend', BLEND_MODES)
+def test_add_blend(blend):
+    map1 = make_satmap((0, 100), (0, 100), 10, seed=1, time='10:00:00')
+    map2 = make_satmap((50, 150), (50, 150), 10, seed=2, time='09:00:00')
+    SatMap = map1.__add__(map2, blend=blend)
+    # the overlap is the upper right of map1 and the lower left of map2
+    overlap1 = map1.data[0:5, 5:10]
+    overlap2 = map2.data[5:10, 0:5]
+    answer = {'last': overlap2, 'first': overlap1, 'mean': (overlap1 + overlap2)/2, 'max': np.maximum(overlap1, overlap2),
+              'min': np.minimum(overlap1, overlap2), 'latest': overlap1}[blend]
+    assert np.allclose(SatMap.data[5:10, 5:10], answer)
+    assert SatMap.data[14, 0] == map1.data[9, 0] and SatMap.data[0, 14] == map2.data[0, 9]
+    assert SatMap.data[0, 0] == 0
+
+def test_mosaic_many_latest():
+    map1 = make_satmap((0, 100), (0, 100), 10, seed=1, time='10:00:00')
+    map2 = make_satmap((0, 100), (0, 100), 10, seed=2, date='2022-12-04', time='23:00:00')
+    SatMap = mosaic_many([map1, map2], blend='latest')
+    assert np.array_equal(SatMap.data, map1.data)
+
+def test_mosaic_blend_value():
+    with pytest.raises(ValueError):
+        map1 = make_satmap((0, 100), (0, 100), 10)
+        map1.mosaic(map1, blend='sum')
+#'sum' is not one of the blend modes, so it should raise ValueError
+
+def test_largest_valid_window():
+    valid = np.zeros((8, 10), dtype=bool)
+    valid[1:7, 0:4] = True
+    valid[3:5, 0:10] = True
+    valid[5, 6] = True
+    rows, columns = largest_valid_window(valid)
+    assert (rows, columns) == (slice(1, 7), slice(0, 4))
+    assert largest_valid_window(np.zeros((3, 3), dtype=bool)) == (slice(0, 0), slice(0, 0))
+
+def test_mosaic_no_padding():
+    map1 = make_satmap((500, 1100), (200, 500), 30, seed=1)
+    map2 = make_satmap((750, 1200), (250, 400), 15, seed=2, instrument='Manannan')
+    padded = map1.mosaic(map2)
+    SatMap = map1.mosaic(map2, padding=False)
+    assert SatMap.meta['xcoords'] == [500, 1100] and SatMap.meta['ycoords'] == [200, 500]
+    assert SatMap.shape == (20, 40) and SatMap.fov == (600, 300)
+    assert (SatMap.data != 0).all()
+    assert np.array_equal(SatMap.data, padded.data[:, 0:40])
+
+def test_resample_identity():
+    data = np.arange(12.0).reshape(3, 4)
+    assert resample(data, 1, 'bilinear') is data
+
+def test_resample_integer():
+    data = np.arange(16.0).reshape(4, 4)
+    assert np.array_equal(resample(data, 2, 'nearest'), np.repeat(np.repeat(data, 2, axis=0), 2, axis=1))
+    assert np.array_equal(resample(data, 0.5, 'area'), [[2.5, 4.5], [10.5, 12.5]])
+    assert np.array_equal(resample(data, 0.5, 'max'), [[5, 7], [13, 15]])
+    assert np.array_equal(resample(data, 0.5, 'nearest'), [[5, 7], [13, 15]])
+    # blocks cut by the edge only average the pixels inside the image
+    assert np.array_equal(resample(np.arange(3.0).reshape(1, 3), 0.5, 'area'), [[0.5, 2]])
+
+def test_resample_bilinear():
+    data = np.random.default_rng(0).random((10, 12))
+    assert np.array_equal(resample(data, 1.5), rescale(data, 1.5))
+    assert np.array_equal(resample(data, 0.5), rescale(data, 0.5))
+
+def test_resample_method():
+    with pytest.raises(ValueError):
+        resample(np.ones((2, 2)), 2, 'cubic')
+#'cubic' is not one of the resampling methods, so it should raise ValueError
+
+def test_mosaic_method():
+    map1 = make_satmap((0, 100), (0, 100), 10, seed=1)
+    map2 = make_satmap((100, 200), (0, 100), 5, seed=2)
+    SatMap = map1.mosaic(map2, method='area')
+    assert SatMap.meta['resolution'] == 5 and SatMap.shape == (20, 40)
+    assert np.array_equal(SatMap.data[:, :20], resample(map1.data, 2, 'area'))
+
+def test_rescale_cache():
+    cache = set_rescale_cache(2**20)
+    try:
+        map1 = make_satmap((0, 100), (0, 100), 10, seed=1)
+        map2 = make_satmap((100, 200), (0, 100), 5, seed=2)
+        SatMap1 = map1.mosaic(map2)
+        SatMap2 = map1.mosaic(map2)
+        assert np.array_equal(SatMap1.data, SatMap2.data)
+        assert cache.stats()['misses'] == 1 and cache.stats()['hits'] == 1
+        # another method is another entry
+        map1.mosaic(map2, method='area')
+        assert len(cache) == 2
+        cache.clear()
+        assert cache.stats()['entries'] == 0 and cache.stats()['hits'] == 0
+    finally:
+        set_rescale_cache(None)
+
+def test_rescale_cache_file(tmp_path):
+    cache = set_rescale_cache(2**20)
+    try:
+        filename = str(tmp_path / 'aigean_lir_20221205_191610.zip')
+        write_file(filename, make_satmap((0, 100), (0, 100), 10, seed=1))
+        map2 = make_satmap((100, 200), (0, 100), 5, seed=2)
+        get_satmap(filename).mosaic(map2)
+        get_satmap(filename).mosaic(map2)
+        assert cache.stats()['hits'] == 1
+        # a cropped map is another image of the same file
+        get_satmap(filename, bbox=(0, 50, 0, 100)).mosaic(map2)
+        assert cache.stats()['misses'] == 2
+    finally:
+        set_rescale_cache(None)
+
+def test_rescale_cache_eviction():
+    cache = RescaleCache(1000)
+    cache.put('a', np.zeros(50))
+    cache.put('b', np.zeros(50))
+    cache.get('a')
+    cache.put('c', np.zeros(50))
+    assert cache.get('b') is None and cache.get('a') is not None
+    assert cache.stats()['evictions'] == 1 and cache.nbytes == 800
+    # larger than the whole cache, so it is not cached
+    cache.put('d', np.zeros(200))
+    assert len(cache) == 2
+    assert cache.get('d') is None
+
+def test_rescale_cache_size():
+    with pytest.raises(ValueError):
+        RescaleCache(0)
+#The max_bytes is not positive, so it should raise ValueError
+
+def test_get_satmap_cache(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    for extension in ('hdf5', 'asdf', 'zip'):
+        filename = str(tmp_path / ('aigean_lir_20221205_191610.' + extension))
+        map_in = make_satmap((500, 1100), (200, 500), 30, seed=1)
+        write_file(filename, map_in)
+        first = get_satmap(filename, cache_dir=cache_dir)
+        second = get_satmap(filename, cache_dir=cache_dir)
+        # the second load memory-maps the cached image
+        assert isinstance(second.data, np.memmap)
+        assert np.array_equal(first.data, second.data) and np.array_equal(second.data, map_in.data)
+        assert second.meta == get_satmap(filename).meta
+        cropped = get_satmap(filename, bbox=(600, 700, 300, 400), cache_dir=cache_dir)
+        assert np.array_equal(cropped.data, get_satmap(filename, bbox=(600, 700, 300, 400)).data)
+    assert len([name for name in os.listdir(cache_dir) if name.endswith('.npy')]) == 3
+
+def test_get_satmap_cache_changed(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    monkeypatch.setenv('AIGEAN_CACHE_DIR', cache_dir)
+    filename = str(tmp_path / 'aigean_lir_20221205_191610.zip')
+    write_file(filename, make_satmap((500, 1100), (200, 500), 30, seed=1))
+    get_satmap(filename)
+    map_in = make_satmap((500, 1100), (200, 500), 30, seed=2)
+    write_file(filename, map_in)
+    os.utime(filename, (1, 1))
+    # a changed file gets a new entry
+    assert np.array_equal(get_satmap(filename).data, map_in.data)
+    assert len([name for name in os.listdir(cache_dir) if name.endswith('.npy')]) == 2
+    # changing the map does not change the cache
+    SatMap = get_satmap(filename)
+    SatMap.data[0, 0] = -1
+    assert get_satmap(filename).data[0, 0] == map_in.data[0, 0]
+
+def test_evict_cache(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    for seed in range(3):
+        filename = str(tmp_path / 'aigean_lir_20221205_19161{}.zip'.format(seed))
+        write_file(filename, make_satmap((500, 1100), (200, 500), 30, seed=seed))
+        get_satmap(filename, cache_dir=cache_dir)
+        os.utime(os.path.join(cache_dir, [name for name in os.listdir(cache_dir) if name.startswith(os.path.basename(filename)) and name.endswith('.npy')][0]), (seed, seed))
+    assert evict_cache(cache_dir, max_bytes=2*(20*10*8 + 1000)) == 1
+    names = os.listdir(cache_dir)
+    assert len(names) == 4 and not any(name.startswith('aigean_lir_20221205_191610.zip') for name in names)
+
+def write_zip_members(path, members, compression=zipfile.ZIP_STORED):
+    # write a zip file with the members in the given order
+    with zipfile.ZipFile(path, 'w', compression=compression) as zfile:
+        for name, content in members:
+            zfile.writestr(name, content)
+
+def npy_bytes(data):
+    npy = io.BytesIO()
+    np.save(npy, data)
+    return npy.getvalue()
+
+def test_read_zip_members(tmp_path):
+    map_in = make_satmap((500, 1100), (200, 500), 30, seed=1)
+    meta = dict(map_in.meta, xcoords=list(map_in.meta['xcoords']), ycoords=list(map_in.meta['ycoords']))
+    for compression in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+        filename = str(tmp_path / 'aigean_lir_20221205_191610.zip')
+        # the image data comes first, the members are found by name
+        write_zip_members(filename, [('image.npy', npy_bytes(map_in.data)), ('meta.json', json.dumps(meta))], compression)
+        meta_read, data = read_zip(filename)
+        assert meta_read['xcoords'] == (500, 1100) and np.array_equal(data, map_in.data)
+        assert data.flags.writeable and not isinstance(data, np.memmap)
+        with get_satmap(filename, lazy=True) as lazy_map:
+            assert np.array_equal(lazy_map.data, map_in.data)
+            assert isinstance(lazy_map.data, np.memmap) == (compression == zipfile.ZIP_STORED)
+
+def test_read_zip_layout(tmp_path):
+    meta = {'instrument': 'Lir', 'resolution': 30, 'xcoords': [0, 90], 'ycoords': [0, 60]}
+    for data in (np.asfortranarray(np.arange(6.0).reshape(2, 3)), np.arange(6, dtype='>i4').reshape(2, 3), np.zeros((0, 3))):
+        filename = str(tmp_path / 'aigean_lir_20221205_191610.zip')
+        write_zip_members(filename, [('meta.json', json.dumps(meta)), ('data.npy', npy_bytes(data))], zipfile.ZIP_DEFLATED)
+        _, data_read = read_zip(filename)
+        assert data_read.dtype == data.dtype and np.array_equal(data_read, data)
+
+def test_read_zip_truncated(tmp_path):
+    filename = str(tmp_path / 'aigean_lir_20221205_191610.zip')
+    meta = {'instrument': 'Lir', 'resolution': 30, 'xcoords': [0, 90], 'ycoords': [0, 60]}
+    write_zip_members(filename, [('meta.json', json.dumps(meta)), ('data.npy', npy_bytes(np.ones((2, 3)))[:-8])])
+    with pytest.raises(ValueError):
+        read_zip(filename)
+#The npy data is shorter than its header, so it should raise ValueError
+
+def test_dtype_kept():
+    map1 = make_satmap((0, 100), (0, 100), 10, seed=1)
+    map2 = make_satmap((50, 150), (0, 100), 10, seed=2)
+    map1.data = map1.data.astype(np.float32)
+    map2.data = map2.data.astype(np.float32)
+    assert (map1 + map2).data.dtype == np.float32
+    assert map1.mosaic(map2).data.dtype == np.float32
+    assert mosaic_many([map1, map2], resolution=5).data.dtype == np.float32
+    # integer images keep their dtype unless values are interpolated or averaged
+    map1.data = map1.data.astype(np.uint16)
+    map2.data = map2.data.astype(np.uint16)
+    assert (map1 + map2).data.dtype == np.uint16
+    assert map1.__add__(map2, blend='mean').data.dtype == np.float32
+    assert mosaic_many([map1, map2], resolution=5, method='nearest').data.dtype == np.uint16
+    assert mosaic_many([map1, map2], resolution=5).data.dtype == np.float32
+
+def test_dtype_mean_integer(tmp_path):
+    map1 = make_satmap((0, 100), (0, 100), 10, seed=1)
+    map2 = make_satmap((50, 150), (0, 100), 10, seed=2)
+    map1.data = np.full(map1.shape, 60000, dtype=np.uint16)
+    map2.data = np.full(map2.shape, 59999, dtype=np.uint16)
+    # the sum of the overlapping pixels does not overflow the integer canvas
+    expected = np.full((10, 15), 60000, dtype=np.uint16)
+    expected[:, 10:] = 59999
+    for SatMap in (map1.__add__(map2, blend='mean', dtype=np.uint16),
+                   mosaic_many([map1, map2], blend='mean', dtype=np.uint16),
+                   mosaic_to_hdf5([map1, map2], str(tmp_path / 'mosaic.hdf5'), blend='mean', dtype=np.uint16),
+                   TiledMap.from_satmaps([map1, map2], tile_size=4, dtype=np.uint16, blend='mean').densify()):
+        assert SatMap.data.dtype == np.uint16 and np.array_equal(SatMap.data[:, :], expected)
+        SatMap.close()
+
+def test_dtype_resample_max():
+    data = np.arange(36, dtype=np.uint16).reshape(6, 6)*1000
+    # 'max' at an integer factor keeps input values, at other factors it interpolates
+    assert resample(data, 1/2, 'max').dtype == np.uint16
+    resampled = resample(data, 1.5, 'max')
+    assert resampled.dtype == np.float32
+    assert np.array_equal(resampled, resample(data, 1.5, 'bilinear'))
+    map_in = make_satmap((0, 180), (0, 180), 30)
+    map_in.data = data
+    assert mosaic_many([map_in], resolution=20, method='max').data.dtype == np.float32
+    assert mosaic_many([map_in], resolution=15, method='max').data.dtype == np.uint16
+
+def test_dtype_sub_unsigned():
+    map1 = make_satmap((0, 100), (0, 100), 10, seed=1)
+    map2 = make_satmap((50, 150), (0, 100), 10, seed=2, date='2022-12-06')
+    map1.data = np.full(map1.shape, 1, dtype=np.uint16)
+    map2.data = np.full(map2.shape, 3, dtype=np.uint16)
+    SatMap = map1 - map2
+    # unsigned images give a signed difference instead of wrapping around
+    assert SatMap.data.dtype == np.int32 and (SatMap.data == -2).all()
+
+def test_dtype_policy(tmp_path):
+    filename = str(tmp_path / 'aigean_lir_20221205_191610.zip')
+    map_in = make_satmap((500, 1100), (200, 500), 30, seed=1)
+    write_file(filename, map_in)
+    assert get_dtype() is None
+    previous = set_dtype(np.float32)
+    try:
+        assert get_dtype() == np.float32 and previous is None
+        assert get_satmap(filename).data.dtype == np.float32
+        assert get_satmap(filename, bbox=(600, 700, 300, 400)).data.dtype == np.float32
+        assert (map_in - make_satmap((500, 1100), (200, 500), 30, date='2022-12-06')).data.dtype == np.float32
+        assert map_in.mosaic(map_in, resolution=15).data.dtype == np.float32
+        # the dtype of a call wins over the policy
+        assert get_satmap(filename, dtype=np.float64).data.dtype == np.float64
+        assert map_in.mosaic(map_in, dtype=np.float64).data.dtype == np.float64
+    finally:
+        set_dtype(previous)
+    assert get_satmap(filename).data.dtype == np.float64
+
+def test_set_dtype_value():
+    with pytest.raises(ValueError):
+        set_dtype(object)
+#object is not a numeric dtype, so it should raise ValueError
+
+def test_subtract_out():
+    map1 = make_satmap((0, 300), (0, 300), 30, seed=1)
+    buffer = np.full((20, 20), np.nan)
+    for seed in range(2, 4):
+        map2 = make_satmap((150, 450), (60, 360), 30, seed=seed, date='2022-12-06')
+        SatMap = map1.subtract(map2, out=buffer)
+        # the difference is written into the upper left of the buffer
+        assert np.shares_memory(SatMap.data, buffer) and SatMap.shape == (8, 5)
+        assert np.array_equal(SatMap.data, (map1 - map2).data)
+        assert np.isnan(buffer[8:, :]).all() and np.isnan(buffer[:, 5:]).all()
+
+def test_subtract_out_shape():
+    with pytest.raises(ValueError):
+        map1 = make_satmap((0, 300), (0, 300), 30, seed=1)
+        map2 = make_satmap((150, 450), (60, 360), 30, seed=2, date='2022-12-06')
+        map1.subtract(map2, out=np.empty((4, 4)))
+#The out buffer is smaller than the overlap, so it should raise ValueError
+
+def test_subtract_out_dtype():
+    map1 = make_satmap((0, 300), (0, 300), 30, seed=1)
+    map2 = make_satmap((150, 450), (60, 360), 30, seed=2, date='2022-12-06')
+    map1.data = np.full(map1.shape, 700, dtype=np.int16)
+    map2.data = np.full(map2.shape, 2, dtype=np.int16)
+    # a wider buffer holds the difference
+    assert (map1.subtract(map2, out=np.empty((8, 5), dtype=np.int32)).data == 698).all()
+    with pytest.raises(ValueError):
+        map1.subtract(map2, out=np.empty((8, 5), dtype=np.int8))
+#The int8 buffer can not hold the int16 difference, 698 would wrap around, so it should raise ValueError
+
+def test_isub():
+    map1 = make_satmap((0, 300), (0, 300), 30, seed=1)
+    map2 = make_satmap((150, 450), (60, 360), 30, seed=2, date='2022-12-06')
+    expected = map1 - map2
+    data = map1.data
+    map1 -= map2
+    # the difference is written into the overlap of the map's own data
+    assert np.shares_memory(map1.data, data) and map1.meta['xcoords'] == [150, 300]
+    assert map1.shape == expected.shape and np.array_equal(map1.data, expected.data)
+    # unsigned images need a signed difference, so they get a new array
+    map3 = make_satmap((0, 300), (0, 300), 30, seed=1)
+    map3.data = map3.data.astype(np.uint16)
+    data = map3.data
+    map3 -= map2
+    assert not np.shares_memory(map3.data, data) and map3.data.dtype == np.float64
+
+def test_iadd():
+    map1 = make_satmap((0, 300), (0, 300), 30, seed=1)
+    map2 = make_satmap((60, 150), (30, 120), 30, seed=2)
+    expected = map1 + map2
+    data = map1.data
+    map1 += map2
+    assert map1.data is data and np.array_equal(map1.data, expected.data)
+    # a map reaching outside gives a new map
+    map3 = make_satmap((240, 360), (0, 90), 30, seed=3)
+    map1 += map3
+    assert map1.data is not data and map1.meta['xcoords'] == [0, 360]
+
+def test_tiled_map():
+    maps = [make_satmap((0, 225), (0, 50), 5, seed=1), make_satmap((1125, 1350), (450, 500), 5, seed=2),
+            make_satmap((600, 825), (200, 250), 5, seed=3), make_satmap((700, 900), (220, 260), 10, seed=4)]
+    for blend in BLEND_MODES:
+        tiled_map = TiledMap.from_satmaps(maps, tile_size=16, blend=blend)
+        SatMap = tiled_map.densify()
+        assert np.array_equal(SatMap.data, mosaic_many(maps, blend=blend).data)
+        assert tiled_map.shape == SatMap.shape == (100, 270)
+    # only the tiles under the strips are allocated
+    assert tiled_map.logical_bytes == 100*270*8
+    assert tiled_map.allocated_bytes == len(tiled_map.tiles)*16*16*8 < tiled_map.logical_bytes/3
+
+def test_tiled_map_add():
+    map1 = make_satmap((0, 225), (0, 50), 5, seed=1)
+    map2 = make_satmap((1125, 1350), (450, 500), 5, seed=2)
+    tiled_map = TiledMap(map1.meta, tile_size=16)
+    tiled_map += map1
+    added = tiled_map + map2
+    # + writes into a copy, += into the raster itself
+    assert tiled_map.meta['xcoords'] == [0, 225] and added.meta['xcoords'] == [0, 1350]
+    assert np.array_equal(added.densify().data, (map1 + map2).data)
+    mosaic = added.mosaic(make_satmap((600, 800), (200, 260), 10, seed=3))
+    assert np.array_equal(mosaic.densify().data, mosaic_many([map1, map2, make_satmap((600, 800), (200, 260), 10, seed=3)]).data)
+
+def test_tiled_map_resolution():
+    with pytest.raises(ValueError):
+        map1 = make_satmap((0, 225), (0, 50), 5, seed=1)
+        TiledMap(map1.meta) + make_satmap((0, 200), (0, 60), 10, seed=2)
+#The resolution of the two maps is different, so it should raise ValueError
+
+def test_tiled_map_visualise(tmp_path):
+    tiled_map = TiledMap.from_satmaps([make_satmap((0, 225), (0, 50), 5, seed=1), make_satmap((1125, 1350), (450, 500), 5, seed=2)], tile_size=16)
+    tiled_map.visualise(save=True, savepath=str(tmp_path))
+    assert os.path.exists(tmp_path / 'Aigean_lir_20221205_191610_mosaic.png')
+
+def test_mosaic_to_hdf5(tmp_path):
+    maps = [make_satmap((500, 1100), (200, 500), 30, seed=1), make_satmap((750, 1200), (250, 400), 15, seed=2),
+            make_satmap((0, 225), (0, 50), 5, seed=3, time='20:00:00')]
+    filename = str(tmp_path / 'mosaic.hdf5')
+    for blend in BLEND_MODES:
+        with mosaic_to_hdf5(maps, filename, blend=blend, chunk_size=16) as SatMap:
+            expected = mosaic_many(maps, blend=blend)
+            assert SatMap.lazy and SatMap.meta['xcoords'] == (0, 1200) and SatMap.shape == expected.shape
+            assert np.array_equal(SatMap.data[:, :], expected.data)
+            assert SatMap.data.chunks == (16, 16)
+        assert os.listdir(str(tmp_path)) == ['mosaic.hdf5']
+    # the file is read back like the Aigean hdf5 files
+    meta, data = read_hdf5(filename)
+    assert meta['resolution'] == 5 and np.array_equal(data, expected.data)
+
+def test_mosaic_to_hdf5_filename(tmp_path):
+    with pytest.raises(ValueError):
+        mosaic_to_hdf5([make_satmap((0, 100), (0, 100), 10)], str(tmp_path / 'mosaic.zip'))
+#The file name is not a hdf5 file name, so it should raise ValueError
+
+def test_mosaic_parallel():
+    maps = [make_satmap((500, 1100), (200, 500), 30, seed=1), make_satmap((750, 1200), (250, 400), 15, seed=2),
+            make_satmap((0, 225), (0, 50), 5, seed=3, time='20:00:00'), make_satmap((600, 825), (200, 250), 5, seed=4)]
+    for blend in BLEND_MODES:
+        for method in RESAMPLE_METHODS:
+            expected = mosaic_many(maps, blend=blend, method=method)
+            SatMap = mosaic_parallel(maps, blend=blend, method=method, workers=2, band_rows=7)
+            assert SatMap.meta == expected.meta and SatMap.data.dtype == expected.data.dtype
+            assert np.array_equal(SatMap.data, expected.data)
+    assert np.array_equal(mosaic_many(maps, workers=2).data, mosaic_many(maps).data)
+
+def test_mosaic_parallel_lazy(tmp_path):
+    map1 = make_satmap((750, 1200), (250, 400), 15, seed=2, instrument='Manannan')
+    map2 = make_satmap((500, 1100), (200, 500), 30, seed=1)
+    filename = write_file(tmp_path / 'aigean_man_20221205_194510.hdf5', map1)
+    # the workers rescale the array read from the hdf5 file, not the file
+    with get_satmap(filename, lazy=True) as lazy_map:
+        SatMap = mosaic_parallel([lazy_map, map2], resolution=10, workers=2)
+    assert np.array_equal(SatMap.data, mosaic_many([map1, map2], resolution=10).data)
+
+def test_mosaic_parallel_workers():
+    with pytest.raises(TypeError):
+        mosaic_many([make_satmap((0, 100), (0, 100), 10)], workers='2')
+#The workers is a str, not an int, so it should raise TypeError
@@ -0,0 +1,35 @@
+# helpers of the tests, building satmaps and writing them in the Aigean file layouts
+import io
+import json
+import zipfile
+import numpy as np
+import h5py
+import asdf
+from aigeanpy.satmap import satmap, cal_fov, cal_centre
+
+def make_satmap(xcoords, ycoords, resolution, seed=0, instrument='Lir', date='2022-12-05', time='19:16:10'):
+    # build a satmap with random data covering the given earth coordinates
+    meta = {'instrument': instrument, 'observatory': 'Aigean', 'resolution': resolution, 'time': time,
+            'date': date, 'xcoords': tuple(xcoords), 'ycoords': tuple(ycoords), 'archive': 'ISA'}
+    rng = np.random.default_rng(seed)
+    data = rng.uniform(1, 1000, ((ycoords[1]-ycoords[0])//resolution, (xcoords[1]-xcoords[0])//resolution))
+    return satmap(meta, data, data.shape, cal_fov(meta), cal_centre(meta))
+
+def write_file(path, map_in):
+    # write a satmap in the same layout as the Aigean hdf5, asdf and zip files
+    meta = dict(map_in.meta, xcoords=list(map_in.meta['xcoords']), ycoords=list(map_in.meta['ycoords']))
+    path = str(path)
+    if path.endswith('hdf5'):
+        with h5py.File(path, 'w') as f:
+            group = f.create_group(meta['instrument'].lower())
+            group.create_dataset('data', data=map_in.data)
+            group.attrs.update(meta)
+    elif path.endswith('asdf'):
+        asdf.AsdfFile(dict(meta, data=map_in.data)).write_to(path)
+    else:
+        npy = io.BytesIO()
+        np.save(npy, map_in.data)
+        with zipfile.ZipFile(path, 'w') as zfile:
+            zfile.writestr('meta.json', json.dumps(meta))
+            zfile.writestr('data.npy', npy.getvalue())
+    return path